@@ -9,8 +9,23 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bargetrader.settings')
 
 application = get_asgi_application()
+
+# Game events are fanned out in-process, so the clock runs next to the event streams it feeds
+if settings.GAME_CLOCK_ENABLED:
+    from trading.clock import GameClock
+
+    game_clock = GameClock()
+    game_clock.start()
+
+# Sessions are built next to the logins that claim them, so a claim can wake the filler up
+if settings.SESSION_POOL_ENABLED:
+    from trading.session_pool import SessionPoolFiller
+
+    session_pool_filler = SessionPoolFiller()
+    session_pool_filler.start()
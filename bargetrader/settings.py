@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Answers the requests under /api/ itself, so the middleware below only runs for pages
+    'trading.api.ApiMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -58,6 +60,9 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'bargetrader.urls'
 
+# URLconf of the game's JSON endpoints served by trading.api.ApiMiddleware
+API_URLCONF = 'trading.api_urls'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -94,6 +99,62 @@ DATABASES = {
 
 
 
+# Cache
+# When REDIS_URL is set the cache is shared by every gunicorn worker, otherwise each process
+# keeps its own in-memory cache.
+
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
+# Game clock
+# When enabled, messages are released by a game clock started in the ASGI process instead of by
+# clients polling get_next_message, which then only reads the latest release, and the browser
+# stops polling and waits for the release events. The event hub is in-process, so events reach
+# the browsers only from the process that publishes them: the web server must run a single
+# worker (the Procfile pins -w 1), and the run_game_clock command refuses to start.
+
+GAME_CLOCK_ENABLED = config('GAME_CLOCK_ENABLED', default=False, cast=bool)
+
+
+# Session pool
+# When enabled, logins claim a game session built in advance by a filler started in the ASGI
+# process (or by the fill_session_pool command), which refills the pool to SESSION_POOL_HIGH
+# sessions whenever it drops below SESSION_POOL_LOW.
+
+SESSION_POOL_ENABLED = config('SESSION_POOL_ENABLED', default=False, cast=bool)
+SESSION_POOL_LOW = config('SESSION_POOL_LOW', default=10, cast=int)
+SESSION_POOL_HIGH = config('SESSION_POOL_HIGH', default=40, cast=int)
+
+
+# Session expiry
+# Active sessions with no message released for this many seconds are finished by the
+# reap_sessions command, so closed browsers do not leave them active forever.
+
+SESSION_EXPIRY = config('SESSION_EXPIRY', default=30 * 60, cast=int)
+
+
+# Idempotency keys
+# Trade requests sent with an Idempotency-Key header are answered with their first response if
+# they are sent again within this many seconds. Expired keys are purged by the reap_sessions
+# command.
+
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=24 * 60 * 60, cast=int)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -150,32 +211,60 @@ AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
 ]
 
+# Records are written by a background thread (trading.log.QueueHandler), so logging never
+# makes a request wait on the console or the disk. Debug and info lines are sampled per
+# message, and the log file holds one JSON object per line and is rotated at LOG_FILE_MAX_BYTES.
+LOG_FILE = config('LOG_FILE', default='debug.log')
+LOG_FILE_MAX_BYTES = config('LOG_FILE_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'trading.log.JsonFormatter',
+        },
+    },
+    'filters': {
+        'sample': {
+            '()': 'trading.log.SampleFilter',
+            'rate': config('LOG_SAMPLE_RATE', default=10, cast=int),  # records per message per second
+            'level': 'WARNING',  # warnings and errors are never sampled
+        },
+    },
     'handlers': {
         'file': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'filename': 'debug.log',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': LOG_FILE,
+            'maxBytes': LOG_FILE_MAX_BYTES,
+            'backupCount': 5,
+            'formatter': 'json',
         },
-        'console': {  # Add this handler
+        'console': {
             'class': 'logging.StreamHandler',
         },
+        # Named to sort after the handlers it writes to, which must be configured first
+        'queue': {
+            '()': 'trading.log.QueueHandler',
+            'handlers': ['cfg://handlers.console', 'cfg://handlers.file'],
+            'filters': ['sample'],
+        },
     },
     'loggers': {
         'django': {
-            'handlers': ['file', 'console'],
+            'handlers': ['queue'],
             'level': 'DEBUG',
             'propagate': True,
         },
         'trading': {  # Assuming 'trading' is the name of your app
-            'handlers': ['console'],
+            'handlers': ['queue'],
             'level': 'DEBUG',
         },
     },
 }
 
+
 # Include functionality to expire sessions on browser closing
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 
@@ -1,8 +1,11 @@
 from django.contrib import admin
-from .models import Trader, Player, AIPlayer, Trade
+from .models import Trader, Player, AIPlayer, Trade, TraderLedger, Order, StrategyParameters
 
 # Register your models here.
 admin.site.register(Trader)
 admin.site.register(Player)
 admin.site.register(AIPlayer)
 admin.site.register(Trade)
+admin.site.register(TraderLedger)
+admin.site.register(Order)
+admin.site.register(StrategyParameters)
@@ -0,0 +1,109 @@
+"""
+Fast path for the game's JSON endpoints.
+
+The game page polls a few endpoints many times a minute, and through the regular stack each
+poll loads the session, the user and the player from the database and runs the message,
+CSRF and clickjacking middleware that only HTML pages need. Requests under API_PREFIX are
+instead answered by ApiMiddleware, placed right after SecurityMiddleware: it resolves them
+against their own URLconf (settings.API_URLCONF), authenticates them from a signed token sent
+as "Authorization: Bearer <token>" and hands the view the player's id and active session id,
+read from the cache. The rest of MIDDLEWARE never runs for them.
+
+The token is sent as a header, which browsers never attach on their own, so these requests
+need no CSRF protection. It carries the player's api_token_generation, which logout moves on,
+so the tokens handed out before a logout stop working (see revoke_tokens). The cached context
+is dropped whenever the player's current session or token generation changes (see
+forget_players).
+"""
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+API_PREFIX = '/api/'
+
+TOKEN_SALT = 'trading.api'
+TOKEN_MAX_AGE = 12 * 60 * 60
+
+PLAYER_KEY = 'trading:api:player:{player_id}'
+PLAYER_TIMEOUT = 60 * 60
+
+
+def make_token(player):
+    """
+    A compact token for the player: its id and token generation, a timestamp and a signature.
+    """
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(f'{player.pk}.{player.api_token_generation}')
+
+
+def check_token(token):
+    """
+    Return (player id, token generation) of the token, or None if it is invalid or expired.
+    """
+    try:
+        player_id, generation = signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=TOKEN_MAX_AGE).split('.')
+        return int(player_id), int(generation)
+    except (signing.BadSignature, ValueError):
+        return None
+
+
+def player_context(player_id):
+    """
+    Return {'session_id': ..., 'token_generation': ...} for the player, the id of their current
+    session or None and their current token generation, from the cache or else from the player
+    row. Returns None if there is no such player.
+    """
+    key = PLAYER_KEY.format(player_id=player_id)
+    context = cache.get(key)
+    if context is None:
+        # Imported here because models clears these entries when sessions change
+        from .models import Player
+
+        row = Player.objects.filter(pk=player_id).values_list('current_session_id', 'api_token_generation')
+        if not row:
+            return None
+        context = {'session_id': row[0][0], 'token_generation': row[0][1]}
+        cache.set(key, context, PLAYER_TIMEOUT)
+    return context
+
+
+def revoke_tokens(player_id):
+    """
+    Stop every token handed out to the player so far from working.
+    """
+    from .models import Player
+
+    Player.objects.filter(pk=player_id).update(api_token_generation=F('api_token_generation') + 1)
+    transaction.on_commit(lambda: forget_players([player_id]))
+
+
+def forget_players(player_ids):
+    cache.delete_many([PLAYER_KEY.format(player_id=player_id) for player_id in player_ids])
+
+
+class ApiMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.urlconf = settings.API_URLCONF
+
+    def __call__(self, request):
+        if not request.path_info.startswith(API_PREFIX):
+            return self.get_response(request)
+
+        try:
+            match = resolve(request.path_info, self.urlconf)
+        except Resolver404:
+            return JsonResponse({'error': 'Not found.'}, status=404)
+
+        player_id, generation = check_token(request.headers.get('Authorization', '').removeprefix('Bearer ')) or (None, None)
+        context = player_context(player_id) if player_id is not None else None
+        # A token from before the player's last logout carries an old generation
+        if context is None or context['token_generation'] != generation:
+            return JsonResponse({'error': 'Invalid or expired token.'}, status=401)
+
+        request.player_id = player_id
+        request.game_session_id = context['session_id']
+        return match.func(request, *match.args, **match.kwargs)
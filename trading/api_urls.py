@@ -0,0 +1,13 @@
+"""
+URLconf of the API fast path, resolved by trading.api.ApiMiddleware instead of ROOT_URLCONF.
+Every pattern must start with trading.api.API_PREFIX.
+"""
+from django.urls import path
+from . import views
+
+
+urlpatterns = [
+    path('api/next_message/', views.api_next_message, name='api_next_message'),
+    path('api/player_summary/', views.api_player_summary, name='api_player_summary'),
+    path('api/update_bid_offer/', views.api_update_bid_offer, name='api_update_bid_offer'),
+]
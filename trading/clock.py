@@ -0,0 +1,217 @@
+"""
+Server-side game clock.
+
+Instead of every open browser tab polling get_next_message, one process keeps a heap of the
+active game sessions ordered by when their next message is due, releases each message on time
+through GameSession.release_next_message and records how late each release was.
+"""
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import GameSession
+
+logger = logging.getLogger(__name__)
+
+
+class GameClock:
+    """
+    Releases the messages of every active GameSession, one every `interval` seconds.
+
+    Sessions are kept in a heap of (due time, session id), so finding the next due session is
+    O(1) and rescheduling one is O(log n). The next due time is computed from the previous due
+    time rather than from when the release finished, so lag does not accumulate into drift.
+    Releases run on a small thread pool, since they spend their time waiting on the database.
+    """
+
+    def __init__(self, interval=GameSession.MESSAGE_INTERVAL, workers=4, scan_interval=5.0, max_sleep=1.0, clock=time.monotonic):
+        self.interval = interval
+        self.scan_interval = scan_interval
+        self.max_sleep = max_sleep
+        self.clock = clock
+
+        self._heap = []
+        self._scheduled = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self._next_scan = 0
+
+        # Metrics, updated by the release threads under _lock
+        self.lags = deque(maxlen=1000)
+        self.releases = 0
+        self.failures = 0
+
+    def schedule(self, session_id, due):
+        """
+        Schedule the next release of a session at `due` (on the clock's time scale). A session
+        that is already scheduled keeps its current slot.
+        """
+        with self._lock:
+            if session_id in self._scheduled:
+                return
+            self._scheduled.add(session_id)
+            heapq.heappush(self._heap, (due, session_id))
+        self._wakeup.set()
+
+    def scan(self):
+        """
+        Schedule the active sessions that are not scheduled yet. A session's first message is
+        due straight away; a session that already has released messages is due `interval`
+        seconds after its last release. Sessions still waiting in the pool and sessions whose
+        whole deck is out are not started.
+        """
+        # Every active session is checked rather than those created since the last scan: a
+        # session's created_at is set before the transaction that builds or claims it commits,
+        # so a watermark on it can pass over a session for good
+        session_ids = GameSession.objects.filter(
+            active=True, pooled=False, messages_released__lt=GameSession.DECK_SIZE,
+        ).values_list('pk', flat=True)
+        with self._lock:
+            new_ids = set(session_ids) - self._scheduled
+        if not new_ids:
+            return
+
+        sessions = (
+            GameSession.objects.filter(pk__in=new_ids)
+            .annotate(last_release=Max('deck__release_timestamp'))
+            .values_list('pk', 'last_release')
+        )
+
+        now = self.clock()
+        wall_now = timezone.now()
+        for session_id, last_release in sessions:
+            self.schedule(session_id, now + self.seconds_until_due(last_release, wall_now))
+
+    def seconds_until_due(self, last_release, wall_now=None):
+        if last_release is None:
+            return 0.0
+        wall_now = wall_now or timezone.now()
+        return max(0.0, self.interval - (wall_now - last_release).total_seconds())
+
+    def next_due(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def run_pending(self):
+        """
+        Release every session whose message is due. Returns the number of releases started.
+        """
+        now = self.clock()
+        due_items = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due_items.append(heapq.heappop(self._heap))
+
+        for due, session_id in due_items:
+            if self._executor:
+                self._executor.submit(self._release, session_id, due)
+            else:
+                self._release(session_id, due)
+
+        return len(due_items)
+
+    def _release(self, session_id, due):
+        self.lags.append(self.clock() - due)
+        next_due = None
+
+        close_old_connections()
+        try:
+            game_session = GameSession.objects.filter(pk=session_id, active=True).first()
+
+            if game_session is not None:
+                # A client may have released a message itself, in which case wait out the gap again
+                last_entry = game_session.last_released_entry()
+                wait = self.seconds_until_due(last_entry.release_timestamp if last_entry else None)
+
+                if wait > 0:
+                    next_due = self.clock() + wait
+                else:
+                    release = game_session.release_next_message()
+                    if release is not None:
+                        # A release made by a client at the same moment is not counted as the clock's
+                        if not release.contended:
+                            with self._lock:
+                                self.releases += 1
+                        if game_session.next_deck_entry() is not None:
+                            next_due = max(due + self.interval, self.clock())
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            logger.exception("Game clock failed to release a message for game session %s.", session_id)
+            next_due = self.clock() + self.interval
+        finally:
+            close_old_connections()
+
+        with self._lock:
+            self._scheduled.discard(session_id)
+        if next_due is not None:
+            self.schedule(session_id, next_due)
+
+    def metrics(self):
+        """
+        Return the scheduler's counters, the release lag (seconds late) over the last 1000
+        releases and how often releases collided.
+        """
+        lags = sorted(self.lags)
+        with self._lock:
+            scheduled = len(self._heap)
+            releases, failures = self.releases, self.failures
+
+        return {
+            'scheduled_sessions': scheduled,
+            'releases': releases,
+            'failures': failures,
+            'lag_mean': sum(lags) / len(lags) if lags else 0.0,
+            'lag_p50': lags[len(lags) // 2] if lags else 0.0,
+            'lag_p99': lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else 0.0,
+            'lag_max': lags[-1] if lags else 0.0,
+            # Releases of every worker, clients included
+            'release_contention': GameSession.release_metrics(),
+        }
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            now = self.clock()
+            if now >= self._next_scan:
+                close_old_connections()
+                try:
+                    self.scan()
+                except Exception:
+                    logger.exception("Game clock failed to scan for new game sessions.")
+                self._next_scan = now + self.scan_interval
+
+            self.run_pending()
+
+            # Sleep until the next release or scan is due, but wake up early if a session is scheduled
+            self._wakeup.clear()
+            next_due = self.next_due()
+            timeout = min(self.max_sleep, self._next_scan - self.clock())
+            if next_due is not None:
+                timeout = min(timeout, next_due - self.clock())
+            self._wakeup.wait(max(timeout, 0))
+
+    def start(self):
+        """
+        Run the clock in a background thread.
+        """
+        self._thread = threading.Thread(target=self.run_forever, name='game-clock', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+        if self._executor:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,18 @@
+"""
+Counters shared by every worker through the cache, for metrics and for the versions of
+cached values.
+"""
+from django.core.cache import cache
+
+
+def incr(key):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between the add and the incr
+        cache.set(key, 1, None)
+
+
+def get(key):
+    return cache.get(key, 0)
@@ -0,0 +1,137 @@
+"""
+Push of game session events to the browser.
+
+Models publish events (message released, quote changed, trade filled, session finished) to an
+in-process hub once their transaction commits. The hub fans each event out to the Server-Sent
+Events connections of that session, each with its own bounded queue, and keeps a short history
+per session that clients which cannot hold a connection open can poll instead.
+"""
+import asyncio
+import itertools
+import threading
+from collections import OrderedDict, deque
+
+from django.db import transaction
+
+from . import state
+
+# Events a slow connection may have waiting before the oldest ones are dropped
+QUEUE_SIZE = 100
+
+# Events kept per session for reconnects and polling clients, and the number of sessions kept
+HISTORY_SIZE = 200
+MAX_SESSIONS = 10000
+
+
+class Subscription:
+    """
+    One client connection to a session's events. Events can be put from any thread; they are
+    read from the event loop the subscription was created on.
+    """
+
+    def __init__(self, session_id, backlog, queue_size=QUEUE_SIZE):
+        self.session_id = session_id
+        self.backlog = backlog
+        self.dropped = 0
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=queue_size)
+
+    def put(self, event):
+        try:
+            self._loop.call_soon_threadsafe(self._put_nowait, event)
+        except RuntimeError:
+            # The connection's event loop has already shut down
+            pass
+
+    def _put_nowait(self, event):
+        # A connection that cannot keep up loses its oldest events rather than holding up the others
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(event)
+
+    async def get(self):
+        return await self._queue.get()
+
+
+class EventHub:
+    def __init__(self, history_size=HISTORY_SIZE, max_sessions=MAX_SESSIONS):
+        self.history_size = history_size
+        self.max_sessions = max_sessions
+        self._subscribers = {}
+        self._history = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def publish(self, session_id, event_type, data):
+        """
+        Send an event to every connection of the session and add it to the session's history.
+        """
+        with self._lock:
+            event = {'id': next(self._ids), 'type': event_type, 'data': data}
+
+            history = self._history.get(session_id)
+            if history is None:
+                history = self._history[session_id] = deque(maxlen=self.history_size)
+                if len(self._history) > self.max_sessions:
+                    self._history.popitem(last=False)
+            else:
+                self._history.move_to_end(session_id)
+            history.append(event)
+
+            subscribers = list(self._subscribers.get(session_id, ()))
+
+        for subscription in subscribers:
+            subscription.put(event)
+
+        return event
+
+    def events_since(self, session_id, after_id=0):
+        """
+        Return the session's recent events with an id greater than after_id.
+        """
+        with self._lock:
+            return [event for event in self._history.get(session_id, ()) if event['id'] > after_id]
+
+    def subscribe(self, session_id, after_id=None):
+        """
+        Register a connection. Must be called from the event loop that will read it. If after_id
+        is given, the events the client missed since then are put in the subscription's backlog.
+        """
+        with self._lock:
+            backlog = []
+            if after_id is not None:
+                backlog = [event for event in self._history.get(session_id, ()) if event['id'] > after_id]
+            subscription = Subscription(session_id, backlog)
+            self._subscribers.setdefault(session_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.session_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.session_id]
+
+    def connection_count(self, session_id=None):
+        with self._lock:
+            if session_id is not None:
+                return len(self._subscribers.get(session_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+hub = EventHub()
+
+
+def publish(session_id, event_type, data):
+    """
+    Publish an event once the current transaction commits, so clients never see an event for
+    a change that was rolled back. Outside a transaction the event is published immediately.
+    The event is also recorded as a change of the session's versioned state.
+    """
+    def deliver():
+        state.record_change(session_id, event_type, data)
+        hub.publish(session_id, event_type, data)
+
+    transaction.on_commit(deliver)
@@ -1,12 +1,17 @@
 from django import forms
 from django.core.exceptions import ValidationError
-from .models import Player, Trader, User, AIPlayer, Trade, GameSession
+from .models import Player, Trader, User, AIPlayer, Trade, GameSession, Order
 from django.db.models import Max, Min
 
 class BidOfferForm(forms.Form):
     bid = forms.DecimalField(required=False, max_digits=10, decimal_places=2, widget=forms.NumberInput(attrs={'placeholder': 'Enter your bid'}),)
     offer = forms.DecimalField(required=False, max_digits=10, decimal_places=2, widget=forms.NumberInput(attrs={'placeholder': 'Enter your offer'}),)
 
+    def __init__(self, *args, game_session=None, **kwargs):
+        # Quotes are validated against the session's own market when there is one
+        self.game_session = game_session
+        super().__init__(*args, **kwargs)
+
     def clean(self):
         cleaned_data = super().clean()
         
@@ -22,8 +27,12 @@ class BidOfferForm(forms.Form):
         return cleaned_data
 
     def validate_against_market(self, bid, offer):
-        highest_bid = AIPlayer.objects.all().aggregate(Max('bid'))['bid__max']
-        lowest_offer = AIPlayer.objects.all().aggregate(Min('offer'))['offer__min']
+        if self.game_session is not None:
+            # Written through by the session's releases, see GameSession.top_of_book
+            highest_bid, lowest_offer = self.game_session.top_of_book()
+        else:
+            highest_bid = AIPlayer.objects.all().aggregate(Max('bid'))['bid__max']
+            lowest_offer = AIPlayer.objects.all().aggregate(Min('offer'))['offer__min']
 
         # If there are no bids or offers in AIPlayer, return without any checks
         if highest_bid is None and lowest_offer is None:
@@ -40,3 +49,9 @@ class BidOfferForm(forms.Form):
     def validate_bid_offer_relation(self, bid, offer):
         if bid is not None and offer is not None and bid > offer:
             raise ValidationError("The bid cannot be higher than the offer.")
+
+
+class OrderForm(forms.Form):
+    side = forms.ChoiceField(choices=Order.SIDES)
+    price = forms.DecimalField(max_digits=6, decimal_places=2, min_value=0.01)
+    quantity = forms.IntegerField(min_value=1, initial=2000)
@@ -0,0 +1,152 @@
+"""
+Non-blocking logging pipeline, wired up in settings.LOGGING.
+
+Loggers hand their records to QueueHandler, which only merges the message with its arguments
+and puts the record on a bounded queue; a background thread formats the records and writes
+them to the real handlers (the console, and a rotating file of JSON lines written by
+JsonFormatter). A full queue drops records instead of making the request wait, and reports
+how many were dropped once it has room again. SampleFilter lets through at most `rate`
+records per `period` seconds of each message below `level`, so a hot-path debug line cannot
+flood the queue.
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; any other attribute was passed with `extra`
+RECORD_ATTRIBUTES = frozenset(logging.LogRecord('', logging.INFO, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+
+class QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Waits for room, so every record queued before stopping is written
+        self.queue.put(self._sentinel)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Put records on a queue of at most `maxsize` records, emptied by a thread that passes them
+    to `handlers`. The handlers are given as 'cfg://handlers.<name>' in LOGGING, and must be
+    named so they sort before this handler, which dictConfig configures in name order.
+    """
+
+    def __init__(self, handlers, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        # Indexed rather than iterated, so dictConfig resolves the cfg:// references
+        self.listener = QueueListener(self.queue, *[handlers[i] for i in range(len(handlers))], respect_handler_level=True)
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._running = True
+
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def prepare(self, record):
+        """
+        Copy the record with its message merged, so the logging thread never reads objects the
+        caller may change afterwards. Formatting is left to the logging thread.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            self._put(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': f'Dropped {dropped} log records, the logging queue was full.', 'dropped': dropped,
+            }), dropped)
+        self._put(record)
+
+    def _put(self, record, count=1):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += count
+
+    def stop(self):
+        """
+        Write out the records still queued and stop the logging thread.
+        """
+        if self._running:
+            self._running = False
+            self.listener.stop()
+
+
+class SampleFilter(logging.Filter):
+    """
+    Let through at most `rate` records of each message (logger and message template) per
+    `period` seconds, and every record at or above `level`. The first record let through
+    after some were held back carries their number as `suppressed`.
+    """
+    MAX_KEYS = 10000
+
+    def __init__(self, rate=10, period=1.0, level='WARNING', clock=time.monotonic):
+        super().__init__()
+        self.rate = rate
+        self.period = period
+        self.level = level if isinstance(level, int) else logging.getLevelName(level)
+        self.clock = clock
+
+        # {(logger name, message template): [window start, records let through, records held back]}
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+
+        key = (record.name, str(record.msg))
+        now = self.clock()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                if window is None and len(self._windows) >= self.MAX_KEYS:
+                    self._windows.clear()
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, suppressed]
+
+            if window[1] >= self.rate:
+                window[2] += 1
+                return False
+
+            window[1] += 1
+            if window[2]:
+                record.suppressed, window[2] = window[2], 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line, with the attributes passed with `extra`.
+    """
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        data.update((key, value) for key, value in record.__dict__.items() if key not in RECORD_ATTRIBUTES)
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, default=str)
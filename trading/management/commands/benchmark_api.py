@@ -0,0 +1,63 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.conf import settings
+from trading import api
+from trading.models import GameSession, Player, User
+
+# (method, page URL name, API URL name, data) of the endpoints compared
+ENDPOINTS = (
+    ('get', 'player_summary', 'api_player_summary', {}),
+    ('post', 'update_bid_offer', 'api_update_bid_offer', {}),
+)
+
+class Command(BaseCommand):
+    help = 'Times the game JSON endpoints through the full middleware stack and through the API fast path.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='Requests timed per endpoint and path.')
+
+    def handle(self, *args, **kwargs):
+        # Everything the benchmark creates is rolled back
+        with override_settings(ALLOWED_HOSTS=['testserver']), transaction.atomic():
+            user = User.objects.create_user(username='benchmark-api', password='benchmark-api')
+            player = Player.objects.create(user=user)
+            try:
+                GameSession.bootstrap(player)
+            except ValueError as e:
+                raise CommandError(str(e))
+
+            client = Client()
+            client.force_login(user)
+            token = api.make_token(player)
+
+            for method, page_name, api_name, data in ENDPOINTS:
+                page = self.measure(client, method, reverse(page_name), data, kwargs['requests'])
+                fast = self.measure(client, method, reverse(api_name, urlconf=settings.API_URLCONF), data, kwargs['requests'], HTTP_AUTHORIZATION=f'Bearer {token}')
+                self.stdout.write(
+                    f'{page_name}: full stack {page[0]:.0f} us, {page[1]} queries; '
+                    f'API {fast[0]:.0f} us, {fast[1]} queries; saved {page[0] - fast[0]:.0f} us per request'
+                )
+
+            transaction.set_rollback(True)
+        api.forget_players([player.pk])
+
+    def measure(self, client, method, url, data, requests, **extra):
+        """
+        Return the mean time of a request in microseconds, and the number of queries it runs.
+        """
+        send = getattr(client, method)
+
+        # Counted with a wrapper, since the query log is reset when a request starts
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, params, many, context: queries.append(sql) or execute(sql, params, many, context)):
+            response = send(url, data, **extra)
+        if response.status_code != 200:
+            raise CommandError(f'{url} answered {response.status_code}.')
+
+        started = time.perf_counter()
+        for _ in range(requests):
+            send(url, data, **extra)
+        return (time.perf_counter() - started) / requests * 1e6, len(queries)
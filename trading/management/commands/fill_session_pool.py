@@ -0,0 +1,38 @@
+import logging
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from trading import session_pool
+from trading.session_pool import SessionPoolFiller
+
+logger = logging.getLogger('trading')
+
+class Command(BaseCommand):
+    help = 'Keeps the pool of pre-built game sessions between its low and high watermarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--low', type=int, default=settings.SESSION_POOL_LOW, help='Refill when fewer sessions than this are pooled.')
+        parser.add_argument('--high', type=int, default=settings.SESSION_POOL_HIGH, help='Number of sessions to refill to.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between two checks of the pool depth.')
+        parser.add_argument('--once', action='store_true', help='Fill the pool to the high watermark and exit.')
+        parser.add_argument('--metrics-every', type=float, default=60, help='Seconds between two metrics log lines.')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['once']:
+            built = session_pool.fill(kwargs['high'])
+            self.stdout.write(self.style.SUCCESS(f'Built {built} game sessions.'))
+            return
+
+        filler = SessionPoolFiller(low=kwargs['low'], high=kwargs['high'], interval=kwargs['interval'])
+        filler.start()
+        self.stdout.write(self.style.SUCCESS('Session pool filler started.'))
+
+        try:
+            while True:
+                time.sleep(kwargs['metrics_every'])
+                logger.info("Session pool metrics: %s, built %s", session_pool.metrics(), filler.built)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            filler.stop()
+            self.stdout.write('Session pool filler stopped.')
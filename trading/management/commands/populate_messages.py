@@ -1,6 +1,7 @@
 import csv
 from django.core.management.base import BaseCommand
 from trading.models import Message
+from trading.sampling import MessagePool
 
 class Command(BaseCommand):
     help = 'Populates the database with messages from a CSV file.'
@@ -24,4 +25,7 @@ class Command(BaseCommand):
         
         # Bulk add messages to the database
         Message.objects.bulk_create(messages_to_add)
+
+        # bulk_create skips Message.save, so refresh the sampling pool explicitly
+        MessagePool.invalidate()
         self.stdout.write(self.style.SUCCESS('Successfully populated messages.'))
@@ -0,0 +1,23 @@
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from trading.montecarlo import price_distribution
+
+class Command(BaseCommand):
+    help = 'Samples random decks from the message catalog and prints the distribution of the trade out price.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--decks', type=int, default=1000000, help='Number of decks to sample.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--initial-price', type=Decimal, default=Decimal('70.00'))
+
+    def handle(self, *args, **kwargs):
+        try:
+            summary = price_distribution(initial_price=kwargs['initial_price'], decks=kwargs['decks'], seed=kwargs['seed'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        quantiles = summary.pop('quantiles')
+        for key, value in summary.items():
+            self.stdout.write(f'{key}: {value}')
+        for q, value in quantiles.items():
+            self.stdout.write(f'q{q}: {value:.2f}')
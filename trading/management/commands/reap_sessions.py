@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from trading import reaper
+from trading.models import IdempotencyKey
+
+class Command(BaseCommand):
+    help = 'Finishes the game sessions that have been idle for longer than SESSION_EXPIRY, and purges expired idempotency keys.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, default=settings.SESSION_EXPIRY, help='Seconds without a message release after which a session expires.')
+        parser.add_argument('--chunk-size', type=int, default=reaper.CHUNK_SIZE, help='Sessions finished per transaction.')
+        parser.add_argument('--loop', action='store_true', help='Keep reaping every --interval seconds.')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between two passes with --loop.')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['loop']:
+            self.stdout.write(self.style.SUCCESS('Session reaper started.'))
+            try:
+                reaper.run_forever(kwargs['interval'], kwargs['max_age'], kwargs['chunk_size'])
+            except KeyboardInterrupt:
+                self.stdout.write('Session reaper stopped.')
+            return
+
+        reaped = reaper.reap_expired_sessions(kwargs['max_age'], kwargs['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Finished {reaped} expired game sessions.'))
+
+        purged = IdempotencyKey.purge_expired(kwargs['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} expired idempotency keys.'))
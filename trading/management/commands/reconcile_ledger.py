@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from trading.models import GameSession, TraderLedger
+
+class Command(BaseCommand):
+    help = 'Checks the per-session trader ledgers against a full recompute from the Trade rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--game-session', type=int, help='Only check the ledgers of this game session.')
+
+    def handle(self, *args, **kwargs):
+        game_session = None
+        if kwargs['game_session']:
+            try:
+                game_session = GameSession.objects.get(pk=kwargs['game_session'])
+            except GameSession.DoesNotExist:
+                raise CommandError(f"Game session {kwargs['game_session']} does not exist.")
+
+        mismatches = TraderLedger.reconcile(game_session)
+
+        for ledger, field, ledger_value, expected_value in mismatches:
+            self.stdout.write(
+                f'Trader {ledger.trader_id}, session {ledger.game_session_id}: '
+                f'{field} is {ledger_value} in the ledger but {expected_value} from trades'
+            )
+
+        if mismatches:
+            raise CommandError(f'{len(mismatches)} ledger mismatches found.')
+
+        self.stdout.write(self.style.SUCCESS('Ledger matches the trade history.'))
@@ -0,0 +1,40 @@
+import logging
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from trading.clock import GameClock
+from trading.models import GameSession
+
+logger = logging.getLogger('trading')
+
+class Command(BaseCommand):
+    help = (
+        'Runs the server-side game clock that releases the messages of every active game session. '
+        'Its events are only seen by clients that poll, since the event streams are served by the web process.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=GameSession.MESSAGE_INTERVAL, help='Seconds between two messages of a session.')
+        parser.add_argument('--workers', type=int, default=4, help='Number of threads releasing messages.')
+        parser.add_argument('--metrics-every', type=float, default=60, help='Seconds between two metrics log lines.')
+
+    def handle(self, *args, **kwargs):
+        # Events are fanned out by the process that publishes them, so releases made here would
+        # never reach the browsers that stopped polling when the clock was enabled
+        if settings.GAME_CLOCK_ENABLED:
+            raise CommandError('GAME_CLOCK_ENABLED is set, so the game clock already runs in the web process.')
+        self.stderr.write(self.style.WARNING('Events of this clock reach only clients that poll get_next_message.'))
+
+        clock = GameClock(interval=kwargs['interval'], workers=kwargs['workers'])
+        clock.start()
+        self.stdout.write(self.style.SUCCESS('Game clock started.'))
+
+        try:
+            while True:
+                time.sleep(kwargs['metrics_every'])
+                logger.info("Game clock metrics: %s", clock.metrics())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            clock.stop()
+            self.stdout.write('Game clock stopped.')
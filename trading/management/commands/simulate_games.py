@@ -0,0 +1,44 @@
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from trading import strategies
+from trading.models import GameSession, StrategyParameters
+from trading.sampling import MessagePool
+from trading.simulation import simulate_games, save_results, summarize
+
+class Command(BaseCommand):
+    help = 'Plays many complete games offline, without the database, and stores the aggregate results.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--games', type=int, default=1000, help='Number of games to play.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the first game; game i uses seed + i.')
+        parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: one per CPU).')
+        parser.add_argument('--initial-price', type=Decimal, default=Decimal('70.00'))
+        parser.add_argument('--player-bid', type=Decimal, default=Decimal('0.00'), help='Fixed bid of the simulated player.')
+        parser.add_argument('--player-offer', type=Decimal, default=Decimal('0.00'), help='Fixed offer of the simulated player.')
+        parser.add_argument('--style', type=str, default=strategies.DEFAULT_STYLE, help='Style of the simulated AI, played with its stored strategy parameters.')
+        parser.add_argument('--label', type=str, default='', help='Label stored with the run.')
+        parser.add_argument('--no-save', action='store_true', help='Print the summary without writing to the database.')
+
+    def handle(self, *args, **kwargs):
+        catalog = MessagePool.current()
+        if len(catalog) < GameSession.DECK_SIZE:
+            raise CommandError('Not enough messages in the database to sample from!')
+
+        params = {
+            'initial_price': kwargs['initial_price'],
+            'player_bid': kwargs['player_bid'],
+            'player_offer': kwargs['player_offer'],
+        }
+        seeds = range(kwargs['seed'], kwargs['seed'] + kwargs['games'])
+
+        style = kwargs['style']
+        parameters = StrategyParameters.for_styles([style]).get(style)
+
+        results = simulate_games(seeds, catalog, workers=kwargs['workers'], style=style, parameters=parameters, **params)
+
+        for key, value in summarize(results).items():
+            self.stdout.write(f'{key}: {value}')
+
+        if not kwargs['no_save']:
+            run = save_results(results, label=kwargs['label'], base_seed=kwargs['seed'], **params)
+            self.stdout.write(self.style.SUCCESS(f'Saved simulation run {run.id}.'))
@@ -0,0 +1,95 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:36
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_ledgers(apps, schema_editor):
+    # Build the ledger rows for the trades that already exist
+    Trade = apps.get_model("trading", "Trade")
+    TraderLedger = apps.get_model("trading", "TraderLedger")
+
+    ledgers = {}
+    for trade in Trade.objects.all().iterator():
+        notional = Decimal(trade.quantity) * trade.price
+
+        buyer = ledgers.setdefault(
+            (trade.buyer_id, trade.game_session_id),
+            TraderLedger(
+                trader_id=trade.buyer_id,
+                game_session_id=trade.game_session_id,
+                cash_flow=Decimal("0"),
+            ),
+        )
+        buyer.position += trade.quantity
+        buyer.cash_flow -= notional
+        buyer.buy_trades_count += 1
+
+        seller = ledgers.setdefault(
+            (trade.seller_id, trade.game_session_id),
+            TraderLedger(
+                trader_id=trade.seller_id,
+                game_session_id=trade.game_session_id,
+                cash_flow=Decimal("0"),
+            ),
+        )
+        seller.position -= trade.quantity
+        seller.cash_flow += notional
+        seller.sell_trades_count += 1
+
+    TraderLedger.objects.bulk_create(ledgers.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0020_message_release_timestamp"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TraderLedger",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("position", models.IntegerField(default=0)),
+                (
+                    "cash_flow",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                ("buy_trades_count", models.IntegerField(default=0)),
+                ("sell_trades_count", models.IntegerField(default=0)),
+                (
+                    "game_session",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ledgers",
+                        to="trading.gamesession",
+                    ),
+                ),
+                (
+                    "trader",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ledgers",
+                        to="trading.trader",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="traderledger",
+            constraint=models.UniqueConstraint(
+                fields=("trader", "game_session"), name="unique_trader_ledger"
+            ),
+        ),
+        migrations.RunPython(backfill_ledgers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,96 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0021_traderledger"),
+    ]
+
+    operations = [
+        # Turn the auto-created GameSession.messages table into the SessionMessage model
+        # without touching the database, then extend it with the deck columns.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="SessionMessage",
+                    fields=[
+                        (
+                            "id",
+                            models.AutoField(
+                                auto_created=True,
+                                primary_key=True,
+                                serialize=False,
+                                verbose_name="ID",
+                            ),
+                        ),
+                        (
+                            "game_session",
+                            models.ForeignKey(
+                                db_column="gamesession_id",
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="deck",
+                                to="trading.gamesession",
+                            ),
+                        ),
+                        (
+                            "message",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                to="trading.message",
+                            ),
+                        ),
+                    ],
+                    options={
+                        "db_table": "trading_gamesession_messages",
+                        "unique_together": {("game_session", "message")},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name="gamesession",
+                    name="messages",
+                    field=models.ManyToManyField(
+                        through="trading.SessionMessage", to="trading.message"
+                    ),
+                ),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="sessionmessage",
+            name="id",
+            field=models.BigAutoField(
+                auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+            ),
+        ),
+        migrations.AddField(
+            model_name="sessionmessage",
+            name="sequence",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="sessionmessage",
+            name="release_timestamp",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="sessionmessage",
+            index=models.Index(
+                condition=models.Q(("release_timestamp__isnull", True)),
+                fields=["game_session", "sequence"],
+                name="deck_unreleased_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="sessionmessage",
+            index=models.Index(
+                fields=["game_session", "release_timestamp"], name="deck_released_idx"
+            ),
+        ),
+        migrations.RemoveField(
+            model_name="message",
+            name="release_timestamp",
+        ),
+    ]
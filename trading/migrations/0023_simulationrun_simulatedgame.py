@@ -0,0 +1,85 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0022_sessionmessage"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SimulationRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("label", models.CharField(blank=True, max_length=200)),
+                ("base_seed", models.BigIntegerField(default=0)),
+                ("games", models.IntegerField(default=0)),
+                (
+                    "initial_price",
+                    models.DecimalField(decimal_places=2, default=70, max_digits=10),
+                ),
+                (
+                    "player_bid",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                (
+                    "player_offer",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                ("mean_final_price", models.FloatField(default=0)),
+                ("min_final_price", models.FloatField(default=0)),
+                ("max_final_price", models.FloatField(default=0)),
+                ("mean_player_pnl", models.FloatField(default=0)),
+                ("mean_ai_ev", models.FloatField(default=0)),
+                ("total_trades", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="SimulatedGame",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("seed", models.BigIntegerField()),
+                ("final_price", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("ai_ev", models.DecimalField(decimal_places=4, max_digits=10)),
+                ("player_position", models.IntegerField(default=0)),
+                (
+                    "player_cash_flow",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                (
+                    "player_pnl",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                ("trades", models.IntegerField(default=0)),
+                (
+                    "run",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="simulated_games",
+                        to="trading.simulationrun",
+                    ),
+                ),
+            ],
+        ),
+    ]
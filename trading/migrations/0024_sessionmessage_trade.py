@@ -0,0 +1,25 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0023_simulationrun_simulatedgame"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sessionmessage",
+            name="trade",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="trading.trade",
+            ),
+        ),
+    ]
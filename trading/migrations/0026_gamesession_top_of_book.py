@@ -0,0 +1,46 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:51
+
+from django.db import migrations, models
+from django.db.models import Max, Min, OuterRef, Subquery
+
+
+def backfill_top_of_book(apps, schema_editor):
+    # Fill in the best AI quotes of the sessions that are still being played
+    GameSession = apps.get_model("trading", "GameSession")
+    membership = GameSession.ai_players.through.objects.filter(
+        gamesession_id=OuterRef("pk")
+    ).values("gamesession_id")
+
+    GameSession.objects.filter(active=True).update(
+        best_bid=Subquery(
+            membership.annotate(best=Max("aiplayer__bid")).values("best")
+        ),
+        best_offer=Subquery(
+            membership.annotate(best=Min("aiplayer__offer")).values("best")
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0025_order_book"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="gamesession",
+            name="best_bid",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=10, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="gamesession",
+            name="best_offer",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=10, null=True
+            ),
+        ),
+        migrations.RunPython(backfill_top_of_book, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0026_gamesession_top_of_book"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StrategyParameters",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("style", models.CharField(max_length=200, unique=True)),
+                ("parameters", models.JSONField(blank=True, default=dict)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name_plural": "strategy parameters",
+            },
+        ),
+    ]
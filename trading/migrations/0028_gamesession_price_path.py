@@ -0,0 +1,53 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:59
+
+from decimal import Decimal, ROUND_HALF_EVEN
+from django.db import migrations, models
+
+
+def backfill_price_paths(apps, schema_editor):
+    # Compute the price path and release count of the sessions that already have a deck
+    GameSession = apps.get_model("trading", "GameSession")
+    SessionMessage = apps.get_model("trading", "SessionMessage")
+
+    for game_session in GameSession.objects.all().iterator():
+        deck = SessionMessage.objects.filter(game_session=game_session).order_by(
+            "sequence", "id"
+        )
+
+        price = game_session.initial_price
+        path = []
+        released = 0
+        for entry in deck.select_related("message"):
+            impact = entry.message.impact_value / 100
+            if entry.message.impact_type == "bullish":
+                price += price * impact
+            elif entry.message.impact_type == "bearish":
+                price -= price * impact
+            path.append(str(price.quantize(Decimal("0.01"), rounding=ROUND_HALF_EVEN)))
+            if entry.release_timestamp is not None:
+                released += 1
+
+        game_session.price_path = path
+        game_session.messages_released = released
+        game_session.save(update_fields=["price_path", "messages_released"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0027_strategyparameters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="gamesession",
+            name="messages_released",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="gamesession",
+            name="price_path",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(backfill_price_paths, migrations.RunPython.noop),
+    ]
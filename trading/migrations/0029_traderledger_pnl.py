@@ -0,0 +1,89 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:02
+
+from decimal import Decimal, ROUND_HALF_EVEN
+from django.db import migrations, models
+
+
+def backfill_pnl(apps, schema_editor):
+    # Replay the trades of every ledger with the average-cost method, then mark or settle it
+    Trade = apps.get_model("trading", "Trade")
+    TraderLedger = apps.get_model("trading", "TraderLedger")
+
+    for ledger in TraderLedger.objects.select_related("game_session").iterator():
+        game_session = ledger.game_session
+        position, cost_basis = 0, Decimal("0.00")
+
+        trades = Trade.objects.filter(game_session=game_session).order_by("id")
+        for trade in trades.filter(buyer_id=ledger.trader_id) | trades.filter(
+            seller_id=ledger.trader_id
+        ):
+            quantity = (
+                trade.quantity
+                if trade.buyer_id == ledger.trader_id
+                else -trade.quantity
+            )
+            new_position = position + quantity
+            if position == 0 or (position > 0) == (quantity > 0):
+                cost_basis += quantity * trade.price
+            elif new_position == 0:
+                cost_basis = Decimal("0.00")
+            elif (new_position > 0) == (position > 0):
+                cost_basis = (cost_basis * new_position / position).quantize(
+                    Decimal("0.01"), rounding=ROUND_HALF_EVEN
+                )
+            else:
+                cost_basis = new_position * trade.price
+            position = new_position
+
+        ledger.cost_basis = cost_basis
+        if game_session.active:
+            released = game_session.messages_released
+            path = game_session.price_path
+            mark = (
+                Decimal(path[min(released, len(path)) - 1])
+                if released and path
+                else game_session.initial_price
+            )
+            ledger.mark_price = mark
+            ledger.realized_pnl = ledger.cash_flow + cost_basis
+            ledger.unrealized_pnl = ledger.position * mark - cost_basis
+        else:
+            ledger.mark_price = game_session.trade_out_price
+            ledger.realized_pnl = (
+                ledger.cash_flow + ledger.position * game_session.trade_out_price
+            )
+            ledger.unrealized_pnl = Decimal("0.00")
+        ledger.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0028_gamesession_price_path"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="traderledger",
+            name="cost_basis",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name="traderledger",
+            name="mark_price",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, max_digits=10, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="traderledger",
+            name="realized_pnl",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name="traderledger",
+            name="unrealized_pnl",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.RunPython(backfill_pnl, migrations.RunPython.noop),
+    ]
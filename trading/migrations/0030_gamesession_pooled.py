@@ -0,0 +1,26 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0029_traderledger_pnl"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="gamesession",
+            name="pooled",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name="gamesession",
+            index=models.Index(
+                condition=models.Q(("pooled", True)),
+                fields=["id"],
+                name="pooled_sessions_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_current_sessions(apps, schema_editor):
+    # Point every player at their newest active session, as the views used to find it. A
+    # session shared by several players stays with the first of them.
+    Player = apps.get_model("trading", "Player")
+    GameSession = apps.get_model("trading", "GameSession")
+
+    taken = set()
+    for player in Player.objects.all().iterator():
+        game_session = (
+            GameSession.objects.filter(games=player, active=True)
+            .exclude(pk__in=taken)
+            .order_by("-pk")
+            .first()
+        )
+        if game_session is not None:
+            taken.add(game_session.pk)
+            Player.objects.filter(pk=player.pk).update(current_session=game_session)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0030_gamesession_pooled"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="player",
+            name="current_session",
+            field=models.OneToOneField(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="current_player",
+                to="trading.gamesession",
+            ),
+        ),
+        migrations.RunPython(backfill_current_sessions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:11
+
+from django.db import migrations, models
+from django.db.models import Case, Exists, OuterRef, Subquery, Value, When
+
+
+def backfill_identities(apps, schema_editor):
+    # Copy the traders' current names and kinds onto their existing trades, a column at a time
+    Trade = apps.get_model("trading", "Trade")
+    Trader = apps.get_model("trading", "Trader")
+    AIPlayer = apps.get_model("trading", "AIPlayer")
+
+    for side in ("buyer", "seller"):
+        trader_id = OuterRef(f"{side}_id")
+        Trade.objects.update(
+            **{
+                f"{side}_name": Subquery(
+                    Trader.objects.filter(pk=trader_id).values("name")[:1]
+                ),
+                f"{side}_kind": Case(
+                    When(
+                        Exists(AIPlayer.objects.filter(pk=trader_id)), then=Value("ai")
+                    ),
+                    default=Value("player"),
+                ),
+            }
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0031_player_current_session"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trade",
+            name="buyer_kind",
+            field=models.CharField(
+                blank=True,
+                choices=[("player", "Player"), ("ai", "AI player")],
+                default="",
+                max_length=10,
+            ),
+        ),
+        migrations.AddField(
+            model_name="trade",
+            name="buyer_name",
+            field=models.CharField(blank=True, default="", max_length=200),
+        ),
+        migrations.AddField(
+            model_name="trade",
+            name="seller_kind",
+            field=models.CharField(
+                blank=True,
+                choices=[("player", "Player"), ("ai", "AI player")],
+                default="",
+                max_length=10,
+            ),
+        ),
+        migrations.AddField(
+            model_name="trade",
+            name="seller_name",
+            field=models.CharField(blank=True, default="", max_length=200),
+        ),
+        migrations.RunPython(backfill_identities, migrations.RunPython.noop),
+    ]
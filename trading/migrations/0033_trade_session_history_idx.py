@@ -0,0 +1,19 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0032_trade_trader_identity"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="trade",
+            index=models.Index(
+                fields=["game_session", "id"], name="trade_session_history_idx"
+            ),
+        ),
+    ]
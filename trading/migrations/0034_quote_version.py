@@ -0,0 +1,23 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0033_trade_session_history_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="aiplayer",
+            name="quote_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="player",
+            name="quote_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0035_idempotencykey"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="player",
+            name="api_token_generation",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.3 on 2026-10-18 08:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0036_player_api_token_generation"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="aiplayer",
+            name="quote_version",
+        ),
+        migrations.AddField(
+            model_name="gamesession",
+            name="ai_quote_versions",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
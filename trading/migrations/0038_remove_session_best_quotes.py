@@ -0,0 +1,21 @@
+# Generated by Django 4.2.3 on 2026-10-18 08:15
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("trading", "0037_session_ai_quote_versions"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="gamesession",
+            name="best_bid",
+        ),
+        migrations.RemoveField(
+            model_name="gamesession",
+            name="best_offer",
+        ),
+    ]
@@ -1,12 +1,26 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db.models import Sum
+from django.db.models import Sum, Count, F, Max, Min, OuterRef, Subquery
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.db.models import Q
 import random
 from django.db import transaction
+from django.conf import settings
+from django.core.cache import cache
 from decimal import Decimal
+from collections import namedtuple
+import numpy as np
+from .sampling import MessagePool, sample_message_ids
+from . import rules
+from . import events
+from . import strategies
+from . import session_pool
+from . import counters
+from . import api
+from .orderbook import OrderBook
 
 
 
@@ -82,14 +96,39 @@ class Player(Trader):
     cash_flow = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     bid = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     offer = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    quote_version = models.PositiveIntegerField(default=0)  # Moves on whenever the quotes change
     games = models.ManyToManyField('trading.GameSession', related_name='games')
 
+    # The session the player is playing, or None. This is the one record of a player's active
+    # session: it is set when the player joins a session and cleared when the session finishes.
+    current_session = models.OneToOneField('trading.GameSession', null=True, blank=True, on_delete=models.SET_NULL, related_name='current_player')
+
+    # Signed into the player's API tokens and moved on at logout, which revokes them (see trading.api)
+    api_token_generation = models.PositiveIntegerField(default=0)
+
     def save(self, *args, **kwargs):
         self.name = self.user.username
+
+        # current_session is only written by the session registry, and api_token_generation
+        # only by api.revoke_tokens, so saving a player loaded before either moved does not
+        # move it back
+        if self.pk and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ('current_session', 'api_token_generation')
+            ]
         super().save(*args, **kwargs)
     
-    def calculate_total_pnl(self):
-        return self.cash_flow    
+    def calculate_total_pnl(self, game_session=None):
+        # Realized plus marked-to-market PnL, from the ledger rows of one session or of all of them
+        ledgers = self.ledgers.all()
+        if game_session:
+            ledgers = ledgers.filter(game_session=game_session)
+        totals = ledgers.aggregate(realized=Sum('realized_pnl'), unrealized=Sum('unrealized_pnl'))
+        return (totals['realized'] or 0) + (totals['unrealized'] or 0)
+
+    def quote_data(self):
+        return {'trader_id': self.id, 'name': self.name, 'bid': str(self.bid), 'offer': str(self.offer), 'quote_version': self.quote_version}
 
     def __str__(self):
         return self.user.username
@@ -100,30 +139,31 @@ class AIPlayer(Trader):
     offer = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     current_ev = models.DecimalField(max_digits=10, decimal_places=4, default=Decimal('0.00'))
 
-
     def __str__(self):
         return f"AI Player: {self.name}, Style: {self.style}"
+
+    def quote_version_in(self, game_session):
+        # Kept per session, see GameSession.ai_quote_versions
+        return game_session.ai_quote_versions.get(str(self.pk), 0)
+
+    def quote_data(self, game_session):
+        return {'trader_id': self.id, 'name': self.name, 'bid': str(self.bid), 'offer': str(self.offer), 'quote_version': self.quote_version_in(game_session)}
+
     
 
     # Constants for impact and uncertainty values
-    adjustment_factor = Decimal("0.05")  # 5% impact on expected value
-    UNCERTAINTY_FACTOR = Decimal("0.10")  # 10% uncertainty factor
+    adjustment_factor = rules.ADJUSTMENT_FACTOR  # 5% impact on expected value
+    UNCERTAINTY_FACTOR = rules.UNCERTAINTY_FACTOR  # 10% uncertainty factor
 
     def compute_ev(self, initial_price, message):
         """
         Compute the Expected Value based on the message impact.
         If no current EV has been set, it initializes with the game's initial price.
         """
-        if self.current_ev == Decimal('0.00'):
-            self.current_ev = initial_price
-
-        if message.impact_type == "bullish":
-            self.current_ev *= (1 + AIPlayer.adjustment_factor)
-        elif message.impact_type == "bearish":
-            self.current_ev *= (1 - AIPlayer.adjustment_factor)
+        self.current_ev = rules.adjust_ev(self.current_ev, initial_price, message.impact_type, AIPlayer.adjustment_factor)
         
-        # Save the updated Expected Value
-        self.save()
+        # Save the updated Expected Value, without writing back quotes that may have moved since
+        self.save(update_fields=['current_ev'])
 
         return self.current_ev
     
@@ -135,7 +175,7 @@ class AIPlayer(Trader):
         """
 
         # 1. Retrieve the active game session for the player.
-        active_game_session = player.games.filter(active=True).first()
+        active_game_session = player.current_session
         if not active_game_session:
             return 'none'  # No active game session found for the player, so no decision made.
         
@@ -147,16 +187,11 @@ class AIPlayer(Trader):
         ai_current_ev = self.current_ev
 
         
-        #4. Check if the player bid and offer is not zero.
-        if player_bid != Decimal('0.00') or player_offer != Decimal('0.00'):
-
-            if ai_current_ev > player_offer: 
-                # Current expected value is higher than player's offer -> AI buys from player at player's offer price
-                return self.initiate_trade(player, "buy", player_offer, active_game_session)
-            
-            if ai_current_ev < player_bid: 
-                # Current expected value is lower than player's bid -> AI sells to player at player's bid price
-                return self.initiate_trade(player, "sell", player_bid, active_game_session)
+        #4. Compare the EV with the player's bid and offer, unless both are zero.
+        action = rules.trade_action(ai_current_ev, player_bid, player_offer)
+        if action:
+            action_type, price = action
+            return self.initiate_trade(player, action_type, price, active_game_session)
 
         # No opportunity to trade.
         return 'no_opportunity_to_trade'
@@ -179,20 +214,153 @@ class AIPlayer(Trader):
         # You can return trade or any information related to the created trade if needed.
         return trade
 
-    
+    def trade_at_quote(self, player, action, price, game_session, quote_version=None):
+        """
+        Let the player trade on this AI player's quote: 'sell' hits the bid and 'buy' lifts the
+        offer. The price must match the AI's current quote, and the quote_version if given its
+        version in the session; the trade then moves that version on. A quote that moved in the
+        meantime, or a request sent twice, raises a ValidationError (code 'stale_quote') instead
+        of trading.
+
+        The session row is locked first, which serializes the trade with the session's releases
+        and other trades, then this AI's row alone, so the quote cannot move before the trade is
+        made. Trades in other sessions only wait for each other when they hit the same AI.
+        """
+        with transaction.atomic():
+            versions = GameSession.objects.select_for_update().values_list('ai_quote_versions', flat=True).get(pk=game_session.pk)
+            ai_player = AIPlayer.objects.select_for_update(of=('self',)).get(pk=self.pk)
+
+            quote = ai_player.bid if action == 'sell' else ai_player.offer
+            if rules.quantize_price(Decimal(str(price))) != quote or quote_version not in (None, versions.get(str(self.pk), 0)):
+                raise ValidationError("The quote has changed.", code='stale_quote')
+
+            # The action is the player's, so the AI takes the other side
+            trade = ai_player.initiate_trade(player, 'buy' if action == 'sell' else 'sell', quote, game_session)
+
+            game_session.move_ai_quote_versions([self.pk], versions)
+            events.publish(game_session.id, 'quote_changed', ai_player.quote_data(game_session))
+
+        return trade
+
     def decide_bid_offer(self, initial_price, message):
         """
         Decide the AI's bid and offer based on the message and its computed EV.
         """
         current_ev = self.compute_ev(initial_price, message)
 
-        bid = current_ev - (current_ev * AIPlayer.UNCERTAINTY_FACTOR)
-        offer = current_ev + (current_ev * AIPlayer.UNCERTAINTY_FACTOR) 
+        return rules.quote_around(current_ev, AIPlayer.UNCERTAINTY_FACTOR)
+
+    @classmethod
+    def react_in_bulk(cls, ai_players, game_session, message, player=None):
+        """
+        Let every AI player of a session react to a newly released message in one pass: move
+        each EV once, let the AIs trade against the player's quotes if they are off-market, then
+        requote around the new EVs. Each group of AIs with the same style is handed to its
+        strategy in one call, and the arithmetic runs on NumPy arrays (see trading.strategies).
+        The new EVs and quotes are written with a single bulk_update, so the number of queries
+        does not grow with the number of AI players. Returns the trades made.
+
+        AI players quote in every session, so their rows are locked first, in id order, and
+        the EVs and quotes are read again under the lock: a release in another session that
+        committed after the caller loaded them is built on rather than overwritten, and two
+        releases locking the same rows cannot deadlock.
+        """
+        if not ai_players:
+            return []
+
+        current = {
+            pk: (current_ev, bid, offer)
+            for pk, current_ev, bid, offer in cls.objects.select_for_update(of=('self',))
+            .filter(pk__in=[ai_player.pk for ai_player in ai_players])
+            .order_by('pk')
+            .values_list('pk', 'current_ev', 'bid', 'offer')
+        }
+        for ai_player in ai_players:
+            ai_player.current_ev, ai_player.bid, ai_player.offer = current[ai_player.pk]
+
+        groups = {}
+        for index, ai_player in enumerate(ai_players):
+            groups.setdefault(ai_player.style, []).append(index)
+        parameters = StrategyParameters.for_styles(groups)
+        group_strategies = {style: strategies.get_strategy(style, parameters.get(style)) for style in groups}
+
+        ev_units = rules.to_fixed([ai_player.current_ev for ai_player in ai_players], rules.EV_PLACES)
+
+        # Inventory and message history cost a query each, so they are only loaded when a strategy reads them
+        positions = np.zeros(len(ai_players), dtype=np.int64)
+        if any(strategy.uses_positions for strategy in group_strategies.values()):
+            index_of = {ai_player.pk: index for index, ai_player in enumerate(ai_players)}
+            ledgers = TraderLedger.objects.filter(game_session=game_session, trader__in=list(index_of)).values_list('trader_id', 'position')
+            for trader_id, position in ledgers:
+                positions[index_of[trader_id]] = position
+
+        history = ()
+        if any(strategy.uses_history for strategy in group_strategies.values()):
+            history = tuple(game_session.deck.filter(release_timestamp__isnull=False).order_by('release_timestamp', 'sequence').values_list('message__impact_type', flat=True))
+
+        context = strategies.MarketContext(game_session.initial_price, message.impact_type, message.impact_value, history, [game_session.pk, message.pk])
+
+        bids = np.zeros_like(ev_units)
+        offers = np.zeros_like(ev_units)
+        for style, indexes in groups.items():
+            indexes = np.array(indexes)
+            states = strategies.AIStates(ev_units[indexes], positions[indexes])
+            ev_units[indexes], bids[indexes], offers[indexes] = group_strategies[style].on_message(states, context)
+
+        # Without a player there is nobody to trade against
+        trades = []
+        if player is not None:
+            for index, action_type, price in rules.trade_actions_many(ev_units, player.bid, player.offer):
+                trades.append(ai_players[index].initiate_trade(player, action_type, price, game_session))
+
+        current_evs = rules.from_fixed(ev_units, rules.EV_PLACES)
+        bids = rules.from_fixed(bids, rules.PRICE_PLACES)
+        offers = rules.from_fixed(offers, rules.PRICE_PLACES)
+        for ai_player, current_ev, bid, offer in zip(ai_players, current_evs, bids, offers):
+            ai_player.current_ev = current_ev
+            ai_player.bid = bid
+            ai_player.offer = offer
+
+        cls.objects.bulk_update(ai_players, ['current_ev', 'bid', 'offer'], batch_size=500)
+        game_session.cache_top_of_book((max(bids), min(offers)))
 
-        return bid, offer
+        return trades
     
 
 
+class StrategyParameters(models.Model):
+    """
+    Parameters of the strategy played by the AI players of one style, overriding the
+    strategy's defaults (see trading.strategies).
+    """
+    style = models.CharField(max_length=200, unique=True)
+    parameters = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'strategy parameters'
+
+    def clean(self):
+        # Every parameter must be a valid factor for the fixed-point arithmetic
+        for name, value in self.parameters.items():
+            try:
+                value = Decimal(str(value))
+            except ArithmeticError:
+                raise ValidationError(f"Parameter {name} must be a number.")
+            if value.as_tuple().exponent < rules.FACTOR_PLACES.as_tuple().exponent:
+                raise ValidationError(f"Parameter {name} can have at most 4 decimal places.")
+
+    @classmethod
+    def for_styles(cls, styles):
+        """
+        Return {style: parameters} for the given styles, in one query.
+        """
+        return dict(cls.objects.filter(style__in=list(styles)).values_list('style', 'parameters'))
+
+    def __str__(self):
+        return f"Strategy parameters for {self.style}"
+
+
 class Message(models.Model):
     CONTENT_MAX_LENGTH = 255
 
@@ -203,7 +371,16 @@ class Message(models.Model):
     )
     impact_type = models.CharField(max_length=7, choices=IMPACT_TYPES)
     impact_value = models.DecimalField(max_digits=5, decimal_places=2)  # This will allow values like 99.99
-    release_timestamp = models.DateTimeField(null=True, blank=True)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # The sampling pool is a snapshot of the catalog, so any change makes it stale
+        MessagePool.invalidate()
+
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        MessagePool.invalidate()
+        return result
 
     def __str__(self):
         return self.content
@@ -212,29 +389,90 @@ class GameSession(models.Model):
     players = models.ManyToManyField(Player)
     ai_players = models.ManyToManyField(AIPlayer, related_name='game_sessions')
     active = models.BooleanField(default=True)
-    messages = models.ManyToManyField(Message)
+    messages = models.ManyToManyField(Message, through='SessionMessage')
     created_at = models.DateTimeField(auto_now_add=True)
     finished_at = models.DateTimeField(null=True, blank=True)
     initial_price = models.DecimalField(max_digits=10, decimal_places=2, default=70)
     trade_out_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
+    # Number of messages dealt into every session's deck
+    DECK_SIZE = 8
+
+    # Minimum number of seconds between two message releases
+    MESSAGE_INTERVAL = 20
+
+    # Counters of releases, and of callers that lost the race to release the same message
+    RELEASES_KEY = 'trading:releases'
+    TOP_OF_BOOK_KEY = 'trading:top_of_book:{session_id}'
+    TOP_OF_BOOK_TIMEOUT = 60 * 60
+    CONTENDED_RELEASES_KEY = 'trading:releases:contended'
+
+    # Bumped on every change to the session's order book, so a process can tell whether its copy is current
+    book_version = models.PositiveIntegerField(default=0)
+
+    # Version of each AI player's quote in this session, by AI player id. Moves on whenever the
+    # AI requotes in a release of this session or is traded on here, so a client of the session
+    # can only trade on the quote it was shown once (see AIPlayer.trade_at_quote). Only written
+    # under the lock on the session row.
+    ai_quote_versions = models.JSONField(default=dict, blank=True)
+
+    # The price after each message of the deck, in release order, fixed once the deck is dealt.
+    # Stored as a list of strings, so a lookup needs no query and no walk over the messages.
+    price_path = models.JSONField(default=list, blank=True)
+    messages_released = models.PositiveSmallIntegerField(default=0)
+
+    # Pre-built and waiting in the pool for a player to claim it (see trading.session_pool)
+    pooled = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=Q(pooled=True), name='pooled_sessions_idx'),
+        ]
+
     def finish(self):
+        GameSession.finish_sessions([self])
+
+    @staticmethod
+    def finish_sessions(game_sessions):
+        """
+        Finish the given active sessions with a fixed number of queries however many there are:
+        each is settled at the final price of its path and the ledgers are closed. The decks keep
+        their release history, so a finished session still reports the fair value it ended on.
+        """
+        game_sessions = list(game_sessions)
+        if not game_sessions:
+            return
+
+        finished_at = timezone.now()
         with transaction.atomic():
-            self.active = False
-            self.finished_at = timezone.now()
-            final_price = self.initial_price
+            for game_session in game_sessions:
+                game_session.active = False
+                game_session.finished_at = finished_at
+                game_session.trade_out_price = game_session.final_price()
+
+            # Only the trade out price differs between the sessions, so it is the only column
+            # written with a CASE per row
+            GameSession.objects.filter(pk__in=[game_session.pk for game_session in game_sessions]).update(
+                active=False, finished_at=finished_at,
+            )
+            GameSession.objects.bulk_update(game_sessions, ['trade_out_price'])
+            TraderLedger.settle(game_sessions)
 
-            for message in self.messages.all():
-                if message.impact_type == "bullish":
-                    final_price += final_price * (message.impact_value / 100)
-                elif message.impact_type == "bearish":
-                    final_price -= final_price * (message.impact_value / 100)
+            # Their players are no longer playing them
+            players = Player.objects.filter(current_session__in=game_sessions)
+            forget_current_sessions(players.values_list('pk', flat=True))
+            players.update(current_session=None)
 
-            self.trade_out_price = final_price
-            self.save()
+            # Dropped on commit, so a request running meanwhile cannot cache a book read before the finish
+            session_ids = [game_session.id for game_session in game_sessions]
 
-        # Reset the messages for the game session
-        GameSession.reset_messages_for_game_session(self)
+            def drop_order_books():
+                for session_id in session_ids:
+                    _order_books.pop(session_id, None)
+            transaction.on_commit(drop_order_books)
+
+            for game_session in game_sessions:
+                events.publish(game_session.id, 'session_finished', {'trade_out_price': str(game_session.trade_out_price)})
 
     def start_new_round(self):
         #code to start a new round goes here
@@ -242,30 +480,420 @@ class GameSession(models.Model):
 
     @staticmethod
     def add_player_to_game_session(player, game_session):
-    # First, set all other active sessions of this player to inactive
-        active_sessions = player.games.filter(active=True)
-        for session in active_sessions:
-            session.finish()
+    # First, finish the session the player is currently in
+        GameSession.finish_sessions(GameSession.objects.filter(pk=player.current_session_id, active=True))
 
-        # Then, add the player to the new game session
+        # Then, add the player to the new game session, which makes it the player's current session
         game_session.players.add(player)
-    
+
+    @classmethod
+    def bootstrap(cls, player, initial_price=Decimal('70.00'), rng=None):
+        """
+        Start a new session for the player against every AI player, in one transaction and with
+        the same number of queries however many AI players there are. The player's other active
+        sessions are finished first; then a pre-built session is claimed from the pool, or one
+        is built, and the player is added to it.
+        """
+        with transaction.atomic():
+            # Locking the player row keeps two logins of the same player from both starting a session
+            current_session_id = Player.objects.select_for_update().filter(pk=player.pk).values_list('current_session_id', flat=True).first()
+            if current_session_id is not None:
+                GameSession.finish_sessions(GameSession.objects.filter(pk=current_session_id, active=True))
+
+            game_session = None
+            if settings.SESSION_POOL_ENABLED:
+                game_session = cls.claim_pooled(initial_price)
+                session_pool.record_claim(game_session is not None)
+            if game_session is None:
+                game_session = cls.build(initial_price, rng=rng)
+
+            cls.players.through.objects.bulk_create([cls.players.through(gamesession=game_session, player=player)])
+            Player.games.through.objects.bulk_create([Player.games.through(player=player, gamesession=game_session)])
+            Player.objects.filter(pk=player.pk).update(current_session=game_session)
+            player.current_session = game_session
+            forget_current_sessions([player.pk])
+
+        return game_session
+
+    @classmethod
+    def build(cls, initial_price=Decimal('70.00'), rng=None, pooled=False):
+        """
+        Create a session with its deck dealt and every AI player in it, with one INSERT each.
+        The price path is computed before the session row is written.
+        """
+        with transaction.atomic():
+            message_ids = sample_message_ids(cls.DECK_SIZE, rng=rng)
+            pool = MessagePool.current()
+            impacts = [(pool.impact_types[i], pool.impact_values[i]) for i in pool.positions_of(message_ids)]
+
+            ai_player_ids = list(AIPlayer.objects.order_by('pk').values_list('pk', flat=True))
+
+            game_session = cls(
+                initial_price=initial_price,
+                pooled=pooled,
+                price_path=[str(price) for price in rules.price_path(initial_price, impacts)],
+            )
+            # bulk_create skips save(), which would deal the session a deck of its own
+            cls.objects.bulk_create([game_session])
+
+            SessionMessage.objects.bulk_create([
+                SessionMessage(game_session=game_session, message_id=message_id, sequence=sequence)
+                for sequence, message_id in enumerate(message_ids)
+            ])
+            cls.ai_players.through.objects.bulk_create([
+                cls.ai_players.through(gamesession_id=game_session.pk, aiplayer_id=ai_player_id)
+                for ai_player_id in ai_player_ids
+            ])
+
+        return game_session
+
+    @classmethod
+    def claim_pooled(cls, initial_price=Decimal('70.00')):
+        """
+        Take the oldest pre-built session out of the pool, or return None if the pool is empty.
+        Rows another transaction is claiming are skipped rather than waited for, so concurrent
+        logins never queue up behind each other. Must be called inside a transaction.
+        """
+        game_session = (
+            cls.objects.select_for_update(skip_locked=True)
+            .filter(pooled=True, active=True, initial_price=initial_price)
+            .order_by('pk')
+            .first()
+        )
+        if game_session is None:
+            return None
+
+        # The game starts now, not when the session was built
+        game_session.pooled = False
+        game_session.created_at = timezone.now()
+        cls.objects.filter(pk=game_session.pk).update(pooled=False, created_at=game_session.created_at)
+
+        # The AI players may have moved their quotes while the session waited in the pool
+        GameSession.forget_top_of_book([game_session.pk])
+        return game_session
+
     @staticmethod
     def reset_messages_for_game_session(game_session):
-        for message in game_session.messages.all():
-            message.release_timestamp = None
-            message.save()
+        # Release state lives on the session's own deck, so shared Message rows are never touched
+        SessionMessage.objects.filter(game_session=game_session).update(release_timestamp=None)
+        GameSession.objects.filter(pk=game_session.pk).update(messages_released=0)
+        game_session.messages_released = 0
     
-    def assign_random_messages(self):
-        # Directly fetch 8 random messages
-        selected_messages = Message.objects.order_by('?')[:8]
+    def assign_random_messages(self, rng=None, weighted=False):
+        # Draw 8 distinct message ids from the cached catalog pool. This raises a ValueError
+        # if there are not enough messages to sample from. The draw order is random, so it
+        # also fixes the release order for the whole session.
+        message_ids = sample_message_ids(GameSession.DECK_SIZE, rng=rng, weighted=weighted)
+
+        # Associate these messages with the GameSession as its deck, in a single INSERT
+        SessionMessage.objects.bulk_create([
+            SessionMessage(game_session=self, message_id=message_id, sequence=sequence)
+            for sequence, message_id in enumerate(message_ids)
+        ])
+
+        # The pool already holds the impacts of the drawn messages
+        pool = MessagePool.current()
+        self.rebuild_price_path([(pool.impact_types[i], pool.impact_values[i]) for i in pool.positions_of(message_ids)])
+
+    def rebuild_price_path(self, impacts=None):
+        """
+        Compute the price after each message of the deck and store it on the session. Runs
+        whenever the deck is dealt or its messages change; impacts are read from the deck
+        unless given in deck order.
+        """
+        if impacts is None:
+            impacts = self.deck.order_by('sequence', 'id').values_list('message__impact_type', 'message__impact_value')
+        self.price_path = [str(price) for price in rules.price_path(self.initial_price, impacts)]
+        GameSession.objects.filter(pk=self.pk).update(price_path=self.price_path)
+
+    def price_after(self, released):
+        """
+        Return the price once `released` messages of the deck have been released.
+        """
+        if released <= 0 or not self.price_path:
+            return self.initial_price
+        return Decimal(self.price_path[min(released, len(self.price_path)) - 1])
+
+    def fair_value(self):
+        # The true price given the messages released so far
+        return self.price_after(self.messages_released)
+
+    def final_price(self):
+        return self.price_after(len(self.price_path))
+
+    def step_impact(self, step):
+        """
+        Return how much the step-th released message (counting from 1) moved the price.
+        """
+        return self.price_after(step) - self.price_after(step - 1)
+
+    def next_deck_entry(self):
+        """
+        Return the next unreleased entry of the session's deck, or None once every message
+        has been released.
+        """
+        return self.deck.filter(release_timestamp__isnull=True).select_related('message').order_by('sequence', 'id').first()
+
+    def last_released_entry(self):
+        """
+        Return the most recently released entry of the session's deck, or None if nothing
+        has been released yet.
+        """
+        return self.deck.filter(release_timestamp__isnull=False).select_related('message', 'trade__buyer', 'trade__seller').order_by('-release_timestamp').first()
+
+    def release_next_message(self, player=None):
+        """
+        Release the next message of the deck and let all the session's AI players react to it,
+        trading against `player` (by default the session's player).
+
+        Returns a MessageRelease, whose ai_player (the first AI player, whose quotes the view
+        reports) is None if the session has no AI player, or None if every message of the deck
+        has already been released.
+
+        Releases are single-flight: the release moves messages_released on from the value this
+        instance loaded with a compare-and-set UPDATE, so of several callers that loaded the same
+        value (two tabs, a retry, the game clock) only one releases a message. The others wait
+        for it and get its release back, with contended set, instead of releasing another one.
+
+        Runs in one transaction holding row locks on the session (taken by the UPDATE), the
+        player and the AI players, in that order, so concurrent releases and trades never act
+        on EVs or quotes that another one is changing. The AI players are locked in id order
+        before their EVs are read (see AIPlayer.react_in_bulk).
+        """
+        with transaction.atomic():
+            released = self.messages_released
+            if not GameSession.objects.filter(pk=self.pk, messages_released=released).update(messages_released=released + 1):
+                counters.incr(GameSession.CONTENDED_RELEASES_KEY)
+                return self._contended_release()
+
+            self.messages_released = released + 1
+            release = self._release_next_message(player)
+            if release is None:
+                # Nothing left to release, so the counter is not moved either
+                transaction.set_rollback(True)
+                self.messages_released = released
+                return None
+
+            counters.incr(GameSession.RELEASES_KEY)
+            return release
+
+    def _contended_release(self):
+        """
+        The release made by the caller that won, once it has committed.
+        """
+        self.refresh_from_db(fields=['messages_released', 'ai_quote_versions'])
+        entry = self.last_released_entry()
+        if entry is None:
+            return None
+
+        ai_player = self.ai_players.order_by('id').first()
+        return MessageRelease(entry, ai_player, entry.trade, contended=True)
+
+    @staticmethod
+    def release_metrics():
+        """
+        How many releases went through, and how many callers lost the race to another release
+        of the same message and were handed its result, over every worker.
+        """
+        releases = counters.get(GameSession.RELEASES_KEY)
+        contended = counters.get(GameSession.CONTENDED_RELEASES_KEY)
+        return {
+            'releases': releases,
+            'contended_releases': contended,
+            'contention_rate': contended / (releases + contended) if releases + contended else 0.0,
+        }
+
+    def _release_next_message(self, player):
+        entry = self.next_deck_entry()
+        if entry is None:
+            return None
+
+        entry.release_timestamp = timezone.now()
+        entry.save(update_fields=['release_timestamp'])
+        TraderLedger.mark_to_market(self, self.fair_value())
+
+        message = entry.message
+        events.publish(self.id, 'message_released', {
+            'sequence': entry.sequence,
+            'message_content': message.content,
+            'impact_type': message.impact_type,
+            'impact_value': str(message.impact_value),
+            'released_at': entry.release_timestamp.isoformat(),
+            'messages_released': self.messages_released,
+        })
+
+        # The AI players trade against the player's quotes as they are now, not as the caller loaded them
+        player_id = player.pk if player is not None else self.players.values_list('pk', flat=True).first()
+        if player_id is not None:
+            player = Player.objects.select_for_update(of=('self',)).get(pk=player_id)
+
+        ai_players = list(self.ai_players.order_by('id'))
+        if not ai_players:
+            return MessageRelease(entry, None, None)
+
+        trades = AIPlayer.react_in_bulk(ai_players, self, entry.message, player)
+        self.move_ai_quote_versions([ai_player.pk for ai_player in ai_players])
+
+        # Keep the first trade with the release, so the outcome can be read back later
+        trade = trades[0] if trades else None
+        if trade:
+            entry.trade = trade
+            entry.save(update_fields=['trade'])
+
+        events.publish(self.id, 'quotes_changed', {'quotes': [ai_player.quote_data(self) for ai_player in ai_players]})
+
+        return MessageRelease(entry, ai_players[0], trade, ai_players, trades)
+
+    def move_ai_quote_versions(self, ai_player_ids, versions=None):
+        """
+        Move on the session's quote versions of the AI players. The caller must hold the lock
+        on the session row; `versions` are the versions it read under it, if it did.
+        """
+        if versions is None:
+            versions = GameSession.objects.values_list('ai_quote_versions', flat=True).get(pk=self.pk)
+        for ai_player_id in ai_player_ids:
+            versions[str(ai_player_id)] = versions.get(str(ai_player_id), 0) + 1
+
+        GameSession.objects.filter(pk=self.pk).update(ai_quote_versions=versions)
+        self.ai_quote_versions = versions
+
+    def top_of_book(self):
+        """
+        Return (best bid, best offer) of the AI quotes last published to the session, None when
+        no AI player quotes in it. Each release writes the quotes it published through to the
+        session's cache key once committed (see cache_top_of_book), so validating a player's
+        quotes reads no rows; a miss aggregates the AI players' current quotes once.
+        """
+        key = GameSession.TOP_OF_BOOK_KEY.format(session_id=self.pk)
+        quotes = cache.get(key)
+        if quotes is None:
+            best = self.ai_players.aggregate(best_bid=Max('bid'), best_offer=Min('offer'))
+            quotes = (best['best_bid'], best['best_offer'])
+            cache.set(key, quotes, GameSession.TOP_OF_BOOK_TIMEOUT)
+        return quotes
+
+    def cache_top_of_book(self, quotes):
+        # Written once committed, so a rolled back release leaves the quotes it never published
+        key = GameSession.TOP_OF_BOOK_KEY.format(session_id=self.pk)
+        transaction.on_commit(lambda: cache.set(key, quotes, GameSession.TOP_OF_BOOK_TIMEOUT))
+
+    @staticmethod
+    def forget_top_of_book(game_session_ids):
+        # Dropped once committed, so the next top_of_book() aggregates the quotes as they are then
+        keys = [GameSession.TOP_OF_BOOK_KEY.format(session_id=session_id) for session_id in game_session_ids]
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+    def order_book(self):
+        """
+        Return this process's copy of the session's order book, rebuilt from the open Order rows
+        if another process has changed the book since it was loaded. The book must not be
+        modified outside submit_order and cancel_order.
+        """
+        cached = _order_books.get(self.id)
+        if cached is not None and cached[0] == self.book_version:
+            return cached[1]
+
+        book = OrderBook()
+        open_orders = self.orders.filter(status=Order.OPEN).order_by('id').values_list('id', 'trader_id', 'side', 'price', 'remaining')
+        for order_id, trader_id, side, price, remaining in open_orders:
+            book.add(order_id, trader_id, side, price, remaining)
+
+        _order_books[self.id] = (self.book_version, book)
+        return book
 
-        # Check if we have at least 8 messages
-        if len(selected_messages) < 8:
-            raise ValueError("Not enough messages in the database to sample from!")
+    def _locked_book(self):
+        # The row lock serialises every change to the book of this session across processes
+        self.book_version = GameSession.objects.select_for_update().values_list('book_version', flat=True).get(pk=self.pk)
+        book = self.order_book()
 
-        # Associate these messages with the GameSession
-        self.messages.add(*selected_messages)
+        # Until the transaction commits, the copy may hold changes that could still be rolled back
+        del _order_books[self.id]
+        return book
+
+    def _save_book(self, book):
+        self.book_version += 1
+        GameSession.objects.filter(pk=self.pk).update(book_version=self.book_version)
+
+        version = self.book_version
+        transaction.on_commit(lambda: _order_books.__setitem__(self.id, (version, book)))
+        events.publish(self.id, 'book_changed', self.depth_data(book))
+
+    def submit_order(self, trader, side, price, quantity):
+        """
+        Place a limit order for the trader and match it against the book. Every fill is saved
+        as a Trade at the resting order's price, and whatever is not filled rests in the book.
+        Returns (order, trades).
+        """
+        if not self.active:
+            raise ValidationError("Orders can only be placed in an active game session.")
+        if side not in (Order.BUY, Order.SELL):
+            raise ValidationError("An order must be a buy or a sell.")
+        if quantity <= 0 or price <= 0:
+            raise ValidationError("An order needs a positive price and quantity.")
+
+        price = rules.quantize_price(Decimal(str(price)))
+
+        with transaction.atomic():
+            book = self._locked_book()
+            order = Order.objects.create(game_session=self, trader=trader, side=side, price=price, quantity=quantity, remaining=quantity)
+            result = book.submit(order.id, trader.pk, side, price, quantity)
+
+            # The makers' names are looked up once for all the fills
+            identities = Trade.identities({fill.buyer_id for fill in result.fills} | {fill.seller_id for fill in result.fills}) if result.fills else {}
+
+            trades = []
+            for fill in result.fills:
+                trade = Trade(game_session=self, buyer_id=fill.buyer_id, seller_id=fill.seller_id, price=fill.price, quantity=fill.quantity)
+                trade.resolve_identities(identities)
+                trade.save()
+                trades.append(trade)
+
+            # Write back the resting orders that were filled or cancelled, in one query
+            touched_ids = {fill.maker_id for fill in result.fills} | set(result.cancelled)
+            touched = list(Order.objects.filter(pk__in=touched_ids))
+            for resting in touched:
+                resting.remaining = book.remaining(resting.id)
+                if resting.id in result.cancelled:
+                    resting.status = Order.CANCELLED
+                elif resting.remaining == 0:
+                    resting.status = Order.FILLED
+            Order.objects.bulk_update(touched, ['remaining', 'status'])
+
+            order.remaining = result.remaining
+            if order.remaining == 0:
+                order.status = Order.FILLED
+            order.save(update_fields=['remaining', 'status'])
+
+            self._save_book(book)
+
+        return order, trades
+
+    def cancel_order(self, order):
+        """
+        Take an open order out of the book. Returns False if it was no longer open.
+        """
+        with transaction.atomic():
+            book = self._locked_book()
+            if not book.cancel(order.id):
+                # Put the unchanged copy back
+                _order_books[self.id] = (self.book_version, book)
+                return False
+
+            order.status = Order.CANCELLED
+            Order.objects.filter(pk=order.pk).update(status=Order.CANCELLED)
+            self._save_book(book)
+
+        return True
+
+    def depth_data(self, book=None, levels=5):
+        """
+        Describe the best price levels of the session's book for the browser.
+        """
+        depth = (book or self.order_book()).depth(levels)
+        return {
+            side: [{'price': str(price), 'quantity': quantity, 'orders': count} for price, quantity, count in depth[side]]
+            for side in ('bids', 'offers')
+        }
     
     def save(self, *args, **kwargs):
         # Check if this is a new instance (i.e. being created and not updated)
@@ -277,6 +905,112 @@ class GameSession(models.Model):
             self.assign_random_messages()
 
 
+# Outcome of GameSession.release_next_message
+MessageRelease = namedtuple('MessageRelease', ['entry', 'ai_player', 'trade', 'ai_players', 'trades', 'contended'], defaults=[(), (), False])
+
+# This process's copies of the order books, as {game_session_id: (book_version, OrderBook)}
+_order_books = {}
+
+
+@receiver(m2m_changed, sender='trading.SessionMessage')
+def deck_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Messages added to or removed from a deck through GameSession.messages change its price path
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        instance.rebuild_price_path()
+    elif pk_set:
+        for game_session in GameSession.objects.filter(pk__in=pk_set):
+            game_session.rebuild_price_path()
+
+
+@receiver(m2m_changed, sender=GameSession.ai_players.through)
+def ai_players_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # The AI players quoting in a session changed, so its best quotes may have too
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            GameSession.forget_top_of_book([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        GameSession.forget_top_of_book(pk_set)
+    elif action == 'pre_clear':
+        # The AI player's sessions are only known before they are cleared
+        GameSession.forget_top_of_book(list(instance.game_sessions.values_list('pk', flat=True)))
+
+
+@receiver(post_save, sender=AIPlayer)
+def ai_player_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    # Quotes set by hand (in the admin, say) move the top of book of the AI's sessions
+    if not created and (update_fields is None or {'bid', 'offer'} & set(update_fields)):
+        GameSession.forget_top_of_book(list(instance.game_sessions.filter(active=True).values_list('pk', flat=True)))
+
+
+@receiver(m2m_changed, sender=GameSession.players.through)
+@receiver(m2m_changed, sender=Player.games.through)
+def player_sessions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Joining an active session makes it the player's current session, and leaving it clears it
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if isinstance(instance, Player):
+        forget_current_sessions([instance.pk])
+        players = Player.objects.filter(pk=instance.pk)
+        if action == 'post_add':
+            game_session = GameSession.objects.filter(pk__in=pk_set, active=True).order_by('-pk').first()
+            if game_session is not None:
+                players.update(current_session=game_session)
+                instance.current_session = game_session
+        elif action == 'post_clear' or instance.current_session_id in pk_set:
+            players.update(current_session=None)
+            instance.current_session = None
+    else:
+        if action == 'post_add':
+            if instance.active:
+                Player.objects.filter(pk__in=pk_set).update(current_session=instance)
+                forget_current_sessions(pk_set)
+        else:
+            players = Player.objects.filter(current_session=instance)
+            if action == 'post_remove':
+                players = players.filter(pk__in=pk_set)
+            forget_current_sessions(players.values_list('pk', flat=True))
+            players.update(current_session=None)
+
+
+def forget_current_sessions(player_ids):
+    """
+    Drop the cached current session of the players (see trading.api) once the transaction
+    that moves them commits.
+    """
+    player_ids = list(player_ids)
+    if player_ids:
+        transaction.on_commit(lambda: api.forget_players(player_ids))
+
+
+class SessionMessage(models.Model):
+    """
+    One message in a game session's deck. The release order is fixed by `sequence` when the
+    session is created, and the release time is tracked per session rather than on the
+    shared Message row.
+    """
+    game_session = models.ForeignKey(GameSession, related_name='deck', on_delete=models.CASCADE, db_column='gamesession_id')
+    message = models.ForeignKey(Message, on_delete=models.CASCADE)
+    sequence = models.PositiveIntegerField(default=0)
+    release_timestamp = models.DateTimeField(null=True, blank=True)
+    trade = models.ForeignKey('Trade', null=True, blank=True, related_name='+', on_delete=models.SET_NULL)  # Trade the AI made on release, if any
+
+    class Meta:
+        # Reuses the table Django created for the original GameSession.messages field
+        db_table = 'trading_gamesession_messages'
+        unique_together = [('game_session', 'message')]
+        indexes = [
+            models.Index(fields=['game_session', 'sequence'], condition=Q(release_timestamp__isnull=True), name='deck_unreleased_idx'),
+            models.Index(fields=['game_session', 'release_timestamp'], name='deck_released_idx'),
+        ]
+
+    def __str__(self):
+        return f"Session {self.game_session_id} #{self.sequence}: {self.message}"
+
+
 class Round(models.Model):
     game_session = models.ForeignKey(GameSession, on_delete=models.CASCADE)
     start_time = models.DateTimeField(auto_now_add=True)
@@ -293,14 +1027,424 @@ class Trade(models.Model):
     buyer = models.ForeignKey(Trader, related_name='buy_trades', on_delete=models.CASCADE)
     seller = models.ForeignKey(Trader, related_name='sell_trades', on_delete=models.CASCADE)
     price = models.DecimalField(max_digits=6, decimal_places=2) # price in USD per tonne
-    quantity = models.IntegerField(default=2000)  # Add the 'quantity' field, it is fixed as 2000 metric tonnes for each trade
+    quantity = models.IntegerField(default=rules.TRADE_QUANTITY)  # Add the 'quantity' field, it is fixed as 2000 metric tonnes for each trade
+
+    PLAYER = 'player'
+    AI = 'ai'
+    KIND_CHOICES = [(PLAYER, 'Player'), (AI, 'AI player')]
+
+    # Names and kinds of the two traders as they were when the trade was made, so trade feeds
+    # need no join through the Trader tables
+    buyer_name = models.CharField(max_length=200, blank=True, default='')
+    seller_name = models.CharField(max_length=200, blank=True, default='')
+    buyer_kind = models.CharField(max_length=10, choices=KIND_CHOICES, blank=True, default='')
+    seller_kind = models.CharField(max_length=10, choices=KIND_CHOICES, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # Trade history pages are read by keyset on (game_session, id)
+            models.Index(fields=['game_session', 'id'], name='trade_session_history_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        if self.buyer == self.seller:
+        if self.buyer_id == self.seller_id:
             raise ValidationError("Buyer and seller can't be the same Trader.")
-        super().save(*args, **kwargs)
+
+        if not (self.buyer_name and self.seller_name and self.buyer_kind and self.seller_kind):
+            self.resolve_identities()
+
+        # Only new fills move the ledger, and they move it in the same transaction as the insert
+        is_new = not self.pk
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if is_new and self.game_session_id:
+                TraderLedger.record_trade(self)
+                events.publish(self.game_session_id, 'trade_filled', self.feed_item())
+
+    @classmethod
+    def history(cls, game_session_id, after=None, before=None, limit=50):
+        """
+        Return one page of a session's trades in id order and whether there are more beyond it:
+        the trades after the id `after` (newer ones), before the id `before` (older ones), or
+        else the latest ones. Pages are read by keyset, so a page costs the same however deep it is.
+        """
+        trades = cls.objects.filter(game_session_id=game_session_id)
+        if after is not None:
+            page = list(trades.filter(id__gt=after).order_by('id')[:limit + 1])
+            return page[:limit], len(page) > limit
+
+        if before is not None:
+            trades = trades.filter(id__lt=before)
+        page = list(trades.order_by('-id')[:limit + 1])
+        return page[:limit][::-1], len(page) > limit
+
+    @staticmethod
+    def identities(trader_ids):
+        """
+        Return {trader_id: (name, kind)} for the given traders, in one query.
+        """
+        rows = Trader.objects.filter(pk__in=trader_ids).values_list('pk', 'name', 'aiplayer')
+        return {pk: (name, Trade.AI if ai_player_id is not None else Trade.PLAYER) for pk, name, ai_player_id in rows}
+
+    def resolve_identities(self, identities=None):
+        """
+        Fill in the names and kinds of the buyer and seller. Traders already loaded as a Player
+        or AIPlayer cost nothing; the others are read from `identities`, or looked up together.
+        """
+        resolved = {}
+        for field in ('buyer', 'seller'):
+            trader = getattr(self, field) if Trade._meta.get_field(field).is_cached(self) else None
+            if isinstance(trader, (Player, AIPlayer)):
+                resolved[field] = (trader.name, Trade.AI if isinstance(trader, AIPlayer) else Trade.PLAYER)
+
+        missing = [getattr(self, f'{field}_id') for field in ('buyer', 'seller') if field not in resolved]
+        if missing:
+            if identities is None or not all(trader_id in identities for trader_id in missing):
+                identities = Trade.identities(missing)
+            for field in ('buyer', 'seller'):
+                if field not in resolved:
+                    resolved[field] = identities[getattr(self, f'{field}_id')]
+
+        self.buyer_name, self.buyer_kind = resolved['buyer']
+        self.seller_name, self.seller_kind = resolved['seller']
+
+    def feed_item(self):
+        """
+        Describe the trade for the trade log in the browser.
+        """
+        return {
+            'trade_id': self.id,
+            'buyer': self.buyer_name,
+            'seller': self.seller_name,
+            'buyer_kind': self.buyer_kind,
+            'seller_kind': self.seller_kind,
+            'price': str(self.price),
+            'quantity': self.quantity,
+        }
 
     def __str__(self):
-        return f"Trade: {self.buyer.name} bought from {self.seller.name} at {'{:.2f}'.format(self.price)}"
-    
+        return f"Trade: {self.buyer_name} bought from {self.seller_name} at {'{:.2f}'.format(self.price)}"
+
+
+class Order(models.Model):
+    """
+    A limit order in a game session's order book. Open orders are matched by price, then by
+    arrival (id) within a price.
+    """
+    BUY = 'buy'
+    SELL = 'sell'
+    SIDES = (
+        (BUY, 'Buy'),
+        (SELL, 'Sell'),
+    )
+
+    OPEN = 'open'
+    FILLED = 'filled'
+    CANCELLED = 'cancelled'
+    STATUSES = (
+        (OPEN, 'Open'),
+        (FILLED, 'Filled'),
+        (CANCELLED, 'Cancelled'),
+    )
+
+    game_session = models.ForeignKey(GameSession, related_name='orders', on_delete=models.CASCADE)
+    trader = models.ForeignKey(Trader, related_name='orders', on_delete=models.CASCADE)
+    side = models.CharField(max_length=4, choices=SIDES)
+    price = models.DecimalField(max_digits=6, decimal_places=2)  # same precision as Trade.price
+    quantity = models.IntegerField()
+    remaining = models.IntegerField()
+    status = models.CharField(max_length=9, choices=STATUSES, default=OPEN)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['game_session', 'id'], condition=Q(status='open'), name='open_orders_idx'),
+        ]
+
+    def order_data(self):
+        return {
+            'order_id': self.id,
+            'side': self.side,
+            'price': str(self.price),
+            'quantity': self.quantity,
+            'remaining': self.remaining,
+            'status': self.status,
+        }
+
+    def __str__(self):
+        return f"Order {self.id}: {self.side} {self.remaining}/{self.quantity} at {self.price} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    The response a player's request got the first time it was sent with an Idempotency-Key. A
+    retry with the same key (a double click, or a resend over a flaky network) is answered from
+    here, found by the unique index, without making the trade again. Keys are kept for at least
+    IDEMPOTENCY_KEY_TTL seconds, after which purge_expired deletes them in chunks.
+    """
+    MAX_LENGTH = 64
+
+    player = models.ForeignKey(Player, related_name='idempotency_keys', on_delete=models.CASCADE)
+    endpoint = models.CharField(max_length=32)
+    key = models.CharField(max_length=MAX_LENGTH)
+    status_code = models.PositiveSmallIntegerField(default=200)
+    response = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['player', 'endpoint', 'key'], name='unique_idempotency_key'),
+        ]
+
+    @classmethod
+    def lookup(cls, player, endpoint, key):
+        return cls.objects.filter(player=player, endpoint=endpoint, key=key).only('status_code', 'response').first()
+
+    @classmethod
+    def record(cls, player, endpoint, key, status_code, response):
+        """
+        Store the response of a request. Raises IntegrityError if a request with the same key was
+        recorded first, so the caller's transaction (and the trade in it) is rolled back.
+        """
+        expires_at = timezone.now() + timezone.timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        return cls.objects.create(player=player, endpoint=endpoint, key=key, status_code=status_code, response=response, expires_at=expires_at)
+
+    @classmethod
+    def purge_expired(cls, chunk_size=1000, now=None):
+        """
+        Delete the expired keys, chunk_size at a time so no single DELETE holds its locks for
+        long. Returns the number of keys deleted.
+        """
+        now = now or timezone.now()
+
+        purged = 0
+        while True:
+            pks = list(cls.objects.filter(expires_at__lte=now).order_by('expires_at').values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                return purged
+            purged += cls.objects.filter(pk__in=pks).delete()[0]
+            if len(pks) < chunk_size:
+                return purged
+
+    def __str__(self):
+        return f"{self.endpoint} {self.key} of {self.player}"
+
+
+class TraderLedger(models.Model):
+    """
+    Running totals of a trader's fills in one game session. The row is updated in the same
+    transaction as every new Trade, so reading position and cash flow is a single row lookup.
+
+    PnL is kept with the average-cost method (rules.apply_fill): every fill moves the realized
+    PnL, every message release marks the open positions of the session to its fair value, and
+    finishing the session settles them at the trade out price.
+    """
+    trader = models.ForeignKey(Trader, related_name='ledgers', on_delete=models.CASCADE)
+    game_session = models.ForeignKey(GameSession, related_name='ledgers', on_delete=models.CASCADE)
+    position = models.IntegerField(default=0)
+    cash_flow = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    buy_trades_count = models.IntegerField(default=0)
+    sell_trades_count = models.IntegerField(default=0)
+    cost_basis = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    mark_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    realized_pnl = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    unrealized_pnl = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['trader', 'game_session'], name='unique_trader_ledger'),
+        ]
+
+    def __str__(self):
+        return f"Ledger: {self.trader_id} in session {self.game_session_id}, position {self.position}"
+
+    @classmethod
+    def for_trader(cls, trader, game_session):
+        """
+        Return the ledger row for the trader in the session, or an unsaved empty row if the
+        trader has not traded in that session yet.
+        """
+        ledger = cls.objects.filter(trader_id=trader.pk, game_session_id=game_session.pk).first()
+        if ledger is None:
+            ledger = cls(trader_id=trader.pk, game_session_id=game_session.pk)
+        return ledger
+
+    @property
+    def total_pnl(self):
+        return self.realized_pnl + self.unrealized_pnl
+
+    def apply_fill(self, quantity, price):
+        """
+        Apply one fill to the totals in memory. quantity is positive for a buy and negative for a sell.
+        """
+        self.position, self.cost_basis = rules.apply_fill(self.position, self.cost_basis, quantity, price)
+        self.cash_flow -= quantity * price
+        if quantity > 0:
+            self.buy_trades_count += 1
+        else:
+            self.sell_trades_count += 1
+
+        self.realized_pnl = self.cash_flow + self.cost_basis
+        mark_price = self.mark_price if self.mark_price is not None else price
+        self.unrealized_pnl = self.position * mark_price - self.cost_basis
+
+    @classmethod
+    def record_trade(cls, trade):
+        """
+        Apply a new trade to the buyer's and seller's ledgers. Both rows are locked, in a fixed
+        order, so that concurrent fills for the same trader apply one after the other instead of
+        overwriting each other.
+        """
+        price = Decimal(str(trade.price))
+        trader_ids = sorted({trade.buyer_id, trade.seller_id})
+
+        with transaction.atomic():
+            ledgers = {
+                ledger.trader_id: ledger
+                for ledger in cls.objects.select_for_update().filter(game_session_id=trade.game_session_id, trader_id__in=trader_ids).order_by('trader_id')
+            }
+            for trader_id in trader_ids:
+                if trader_id not in ledgers:
+                    # Positions opened mid-game are marked at the session's current fair value
+                    ledgers[trader_id], _ = cls.objects.get_or_create(
+                        trader_id=trader_id, game_session_id=trade.game_session_id,
+                        defaults={'mark_price': trade.game_session.fair_value()},
+                    )
+
+            ledgers[trade.buyer_id].apply_fill(trade.quantity, price)
+            ledgers[trade.seller_id].apply_fill(-trade.quantity, price)
+
+            fields = ['position', 'cash_flow', 'buy_trades_count', 'sell_trades_count', 'cost_basis', 'realized_pnl', 'unrealized_pnl']
+            for trader_id in trader_ids:
+                ledgers[trader_id].save(update_fields=fields)
+
+    @classmethod
+    def mark_to_market(cls, game_session, price):
+        """
+        Mark every open position of the session at `price`, in one UPDATE.
+        """
+        cls.objects.filter(game_session=game_session).update(
+            mark_price=price,
+            unrealized_pnl=F('position') * price - F('cost_basis'),
+        )
+
+    @classmethod
+    def settle(cls, game_sessions):
+        """
+        Close every position of the given finished sessions at their trade out prices, in one UPDATE.
+        """
+        trade_out_price = Subquery(GameSession.objects.filter(pk=OuterRef('game_session_id')).values('trade_out_price')[:1])
+        cls.objects.filter(game_session__in=game_sessions).update(
+            mark_price=trade_out_price,
+            realized_pnl=F('cash_flow') + F('position') * trade_out_price,
+            unrealized_pnl=0,
+        )
+
+    @classmethod
+    def recompute(cls, trader, game_session):
+        """
+        Rebuild the totals for one trader and session from the Trade rows. This is the slow
+        path that the ledger replaces, and is only used to check it.
+        """
+        buy_trades = trader.buy_trades.filter(game_session=game_session).aggregate(quantity=Sum('quantity'), count=Count('id'))
+        sell_trades = trader.sell_trades.filter(game_session=game_session).aggregate(quantity=Sum('quantity'), count=Count('id'))
+
+        # Replay the fills in order for the average cost
+        position, cost_basis = 0, Decimal('0.00')
+        fills = Trade.objects.filter(Q(buyer=trader) | Q(seller=trader), game_session=game_session).order_by('id')
+        for buyer_id, quantity, price in fills.values_list('buyer_id', 'quantity', 'price'):
+            position, cost_basis = rules.apply_fill(position, cost_basis, quantity if buyer_id == trader.pk else -quantity, price)
+
+        cash_flow = trader.calculate_cash_flow(game_session)
+        if game_session.active:
+            realized_pnl = cash_flow + cost_basis
+        else:
+            realized_pnl = cash_flow + position * game_session.trade_out_price
+
+        return {
+            'position': (buy_trades['quantity'] or 0) - (sell_trades['quantity'] or 0),
+            'cash_flow': cash_flow,
+            'buy_trades_count': buy_trades['count'],
+            'sell_trades_count': sell_trades['count'],
+            'cost_basis': cost_basis,
+            'realized_pnl': realized_pnl,
+        }
+
+    @classmethod
+    def reconcile(cls, game_session=None):
+        """
+        Compare every ledger row (optionally limited to one session) against a full recompute
+        from the Trade rows. Returns a list of (ledger, field, ledger_value, expected_value)
+        tuples, one per mismatch; an empty list means the ledger is consistent.
+
+        Traders that have trades in a session but no ledger row are reported as well.
+        """
+        mismatches = []
+        fields = ['position', 'cash_flow', 'buy_trades_count', 'sell_trades_count', 'cost_basis', 'realized_pnl']
+
+        trades = Trade.objects.all()
+        ledgers = cls.objects.select_related('trader', 'game_session')
+        if game_session:
+            trades = trades.filter(game_session=game_session)
+            ledgers = ledgers.filter(game_session=game_session)
+
+        # Every (trader, session) pair that has traded must have a ledger row
+        expected_keys = set(trades.values_list('buyer_id', 'game_session_id'))
+        expected_keys |= set(trades.values_list('seller_id', 'game_session_id'))
+
+        for ledger in ledgers:
+            expected_keys.discard((ledger.trader_id, ledger.game_session_id))
+            expected = cls.recompute(ledger.trader, ledger.game_session)
+            for field in fields:
+                if getattr(ledger, field) != expected[field]:
+                    mismatches.append((ledger, field, getattr(ledger, field), expected[field]))
+
+        for trader_id, game_session_id in expected_keys:
+            missing = cls(trader_id=trader_id, game_session_id=game_session_id)
+            expected = cls.recompute(missing.trader, missing.game_session)
+            for field in fields:
+                if getattr(missing, field) != expected[field]:
+                    mismatches.append((missing, field, getattr(missing, field), expected[field]))
+
+        return mismatches
+
+
+class SimulationRun(models.Model):
+    """
+    Aggregate results of a batch of headless games played by trading.simulation.
+    """
+    created_at = models.DateTimeField(auto_now_add=True)
+    label = models.CharField(max_length=200, blank=True)
+    base_seed = models.BigIntegerField(default=0)
+    games = models.IntegerField(default=0)
+    initial_price = models.DecimalField(max_digits=10, decimal_places=2, default=70)
+    player_bid = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    player_offer = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    mean_final_price = models.FloatField(default=0)
+    min_final_price = models.FloatField(default=0)
+    max_final_price = models.FloatField(default=0)
+    mean_player_pnl = models.FloatField(default=0)
+    mean_ai_ev = models.FloatField(default=0)
+    total_trades = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Simulation {self.label or self.id}: {self.games} games"
+
+
+class SimulatedGame(models.Model):
+    """
+    The outcome of one game of a SimulationRun.
+    """
+    run = models.ForeignKey(SimulationRun, related_name='simulated_games', on_delete=models.CASCADE)
+    seed = models.BigIntegerField()
+    final_price = models.DecimalField(max_digits=10, decimal_places=2)
+    ai_ev = models.DecimalField(max_digits=10, decimal_places=4)
+    player_position = models.IntegerField(default=0)
+    player_cash_flow = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    player_pnl = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    trades = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Simulated game {self.seed} of run {self.run_id}"
 
@@ -0,0 +1,126 @@
+"""
+Monte Carlo distribution of a game's trade out price.
+
+A session's deck is GameSession.DECK_SIZE distinct messages drawn uniformly from the catalog, and its trade
+out price compounds their impacts (rules.compound_price). This module draws millions of decks
+at once with NumPy, compounds each deck as a sum of log multipliers and summarises the final
+prices. Summaries are cached per catalog version, so asking again is a cache lookup until the
+catalog changes.
+"""
+import math
+
+import numpy as np
+from django.core.cache import cache
+
+from .models import GameSession
+from .sampling import MessagePool
+
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+DISTRIBUTION_KEY = 'trading:price_distribution:{version}:{initial_price}:{deck_size}:{decks}:{seed}'
+
+# Entries of older catalog versions are never read again, so they are left to expire
+DISTRIBUTION_TIMEOUT = 24 * 60 * 60
+
+# Upper bound on the random numbers held in memory at once (8 bytes each)
+CHUNK_ELEMENTS = 4_000_000
+
+
+def log_multipliers(catalog):
+    """
+    Return log(1 + impact/100) for bullish and log(1 - impact/100) for bearish messages, in pool order.
+    """
+    impacts = np.array([float(value) for value in catalog.impact_values]) / 100
+    signs = np.array([1.0 if impact_type == 'bullish' else -1.0 if impact_type == 'bearish' else 0.0 for impact_type in catalog.impact_types])
+    return np.log1p(signs * impacts)
+
+
+def draw_decks(rng, catalog_size, decks, deck_size):
+    """
+    Return a (decks, deck_size) array of message positions, each row a uniform draw of
+    deck_size distinct positions out of catalog_size.
+
+    Against a catalog much larger than the deck, rows are drawn with replacement and only the
+    rows that came out with a duplicate are drawn again, which costs O(deck_size) per deck
+    whatever the size of the catalog. Against a small catalog duplicates are common, so each
+    row takes the deck_size smallest of catalog_size uniform keys instead.
+    """
+    if deck_size * deck_size > catalog_size:
+        keys = rng.random((decks, catalog_size))
+        return np.argpartition(keys, deck_size - 1, axis=1)[:, :deck_size]
+
+    # A row is kept only if it has no duplicate, so every ordered draw of distinct positions is equally likely
+    deck = rng.integers(catalog_size, size=(decks, deck_size))
+    redraw = np.arange(decks)
+    while redraw.size:
+        ordered = np.sort(deck[redraw], axis=1)
+        redraw = redraw[(ordered[:, 1:] == ordered[:, :-1]).any(axis=1)]
+        deck[redraw] = rng.integers(catalog_size, size=(redraw.size, deck_size))
+    return deck
+
+
+def sample_final_prices(catalog, decks, initial_price=70.0, deck_size=GameSession.DECK_SIZE, seed=None):
+    """
+    Draw `decks` decks of `deck_size` distinct messages and return their final prices as a
+    float64 array.
+    """
+    if len(catalog) < deck_size:
+        raise ValueError("Not enough messages in the database to sample from!")
+
+    rng = np.random.default_rng(seed)
+    logs = log_multipliers(catalog)
+    # A deck costs len(catalog) keys against a small catalog and a few deck_size draws otherwise
+    chunk = max(1, CHUNK_ELEMENTS // min(len(catalog), deck_size * deck_size))
+
+    final_prices = np.empty(decks)
+    for start in range(0, decks, chunk):
+        rows = min(chunk, decks - start)
+        deck = draw_decks(rng, len(catalog), rows, deck_size)
+        final_prices[start:start + rows] = logs[deck].sum(axis=1)
+
+    return float(initial_price) * np.exp(final_prices)
+
+
+def summarize(final_prices):
+    return {
+        'decks': int(final_prices.size),
+        'mean': float(final_prices.mean()),
+        'variance': float(final_prices.var()),
+        'std': float(final_prices.std()),
+        'min': float(final_prices.min()),
+        'max': float(final_prices.max()),
+        'quantiles': {str(q): float(value) for q, value in zip(QUANTILES, np.quantile(final_prices, QUANTILES))},
+    }
+
+
+def price_distribution(initial_price=70, decks=1_000_000, deck_size=GameSession.DECK_SIZE, seed=0):
+    """
+    Return the summary of the final price distribution for the current catalog, computing it
+    only if this catalog version has not been summarised with these settings before.
+    """
+    catalog = MessagePool.current()
+    key = DISTRIBUTION_KEY.format(version=catalog.version, initial_price=initial_price, deck_size=deck_size, decks=decks, seed=seed)
+
+    summary = cache.get(key)
+    if summary is None:
+        summary = summarize(sample_final_prices(catalog, decks, initial_price, deck_size, seed))
+        summary['catalog_version'] = catalog.version
+        summary['initial_price'] = float(initial_price)
+        cache.set(key, summary, DISTRIBUTION_TIMEOUT)
+
+    return summary
+
+
+def exact_mean(catalog, initial_price=70.0, deck_size=GameSession.DECK_SIZE):
+    """
+    The exact mean final price over all possible decks, for checking the sampler. The sum over
+    every deck of the product of its multipliers is the elementary symmetric polynomial of
+    degree deck_size of the multipliers, and there are C(n, deck_size) decks.
+    """
+    multipliers = np.exp(log_multipliers(catalog))
+
+    e = np.zeros(deck_size + 1)
+    e[0] = 1.0
+    for value in multipliers:
+        e[1:] = e[1:] + value * e[:-1]
+    return float(initial_price) * e[deck_size] / math.comb(len(multipliers), deck_size)
@@ -0,0 +1,192 @@
+"""
+Price-time priority limit order book.
+
+Kept free of the ORM like trading.rules: GameSession.submit_order loads the session's open
+Order rows into an OrderBook, matches the incoming order against it and writes the fills back
+as Trade rows. Each side keeps its price levels in a dict, with a heap of level prices on top,
+so the best price is found in O(1) and a new level is added in O(log n). Orders within a level
+queue up in arrival order.
+"""
+import heapq
+from collections import deque, namedtuple
+
+BUY = 'buy'
+SELL = 'sell'
+SIDES = (BUY, SELL)
+
+# One execution between a resting (maker) order and an incoming (taker) order, at the maker's price
+Fill = namedtuple('Fill', ['maker_id', 'taker_id', 'buyer_id', 'seller_id', 'price', 'quantity'])
+
+# Outcome of OrderBook.submit: the fills, the resting orders cancelled to prevent a self-trade,
+# and the quantity of the incoming order left resting in the book
+MatchResult = namedtuple('MatchResult', ['fills', 'cancelled', 'remaining'])
+
+
+class BookOrder:
+    __slots__ = ('order_id', 'trader_id', 'side', 'price', 'remaining')
+
+    def __init__(self, order_id, trader_id, side, price, remaining):
+        self.order_id = order_id
+        self.trader_id = trader_id
+        self.side = side
+        self.price = price
+        self.remaining = remaining
+
+    def __repr__(self):
+        return f"BookOrder({self.order_id}, {self.side} {self.remaining} @ {self.price})"
+
+
+class PriceLevel:
+    """
+    The orders resting at one price, oldest first. Cancelled orders stay in the queue with
+    nothing remaining until they reach the front, so a cancel does not search the queue.
+    """
+    __slots__ = ('price', 'orders', 'quantity', 'count')
+
+    def __init__(self, price):
+        self.price = price
+        self.orders = deque()
+        self.quantity = 0
+        self.count = 0
+
+    def front(self):
+        while self.orders and self.orders[0].remaining == 0:
+            self.orders.popleft()
+        return self.orders[0] if self.orders else None
+
+
+class OrderBook:
+    def __init__(self):
+        self._levels = {BUY: {}, SELL: {}}
+        # Bid prices are negated, so the best price of either side is at the top of its heap
+        self._prices = {BUY: [], SELL: []}
+        self._orders = {}
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, order_id):
+        return order_id in self._orders
+
+    def _heap_key(self, side, price):
+        return -price if side == BUY else price
+
+    def _best_level(self, side):
+        # Prices of levels that have emptied out are dropped here, when they reach the top
+        heap = self._prices[side]
+        levels = self._levels[side]
+        while heap:
+            price = -heap[0] if side == BUY else heap[0]
+            level = levels.get(price)
+            if level is not None:
+                return level
+            heapq.heappop(heap)
+        return None
+
+    def add(self, order_id, trader_id, side, price, quantity):
+        """
+        Rest an order in the book without matching it, e.g. when loading the open orders.
+        """
+        if side not in SIDES:
+            raise ValueError(f"Unknown side: {side}")
+
+        levels = self._levels[side]
+        level = levels.get(price)
+        if level is None:
+            level = levels[price] = PriceLevel(price)
+            heapq.heappush(self._prices[side], self._heap_key(side, price))
+
+        order = BookOrder(order_id, trader_id, side, price, quantity)
+        level.orders.append(order)
+        level.quantity += quantity
+        level.count += 1
+        self._orders[order_id] = order
+        return order
+
+    def cancel(self, order_id):
+        """
+        Remove a resting order. Returns the quantity it still had, or 0 if it was not in the book.
+        """
+        order = self._orders.pop(order_id, None)
+        if order is None:
+            return 0
+
+        remaining = order.remaining
+        self._reduce(order, remaining)
+        return remaining
+
+    def _reduce(self, order, quantity):
+        level = self._levels[order.side][order.price]
+        order.remaining -= quantity
+        level.quantity -= quantity
+        if order.remaining == 0:
+            level.count -= 1
+            self._orders.pop(order.order_id, None)
+            if level.count == 0:
+                del self._levels[order.side][order.price]
+
+    def submit(self, order_id, trader_id, side, price, quantity):
+        """
+        Match an incoming limit order against the opposite side, best price first and oldest
+        first within a price, and rest whatever is left. A resting order of the same trader
+        that would be matched is cancelled instead. Returns a MatchResult.
+        """
+        if side not in SIDES:
+            raise ValueError(f"Unknown side: {side}")
+
+        opposite = SELL if side == BUY else BUY
+        fills = []
+        cancelled = []
+        remaining = quantity
+
+        while remaining > 0:
+            level = self._best_level(opposite)
+            if level is None:
+                break
+            if (side == BUY and level.price > price) or (side == SELL and level.price < price):
+                break
+
+            maker = level.front()
+            if maker.trader_id == trader_id:
+                cancelled.append(maker.order_id)
+                self.cancel(maker.order_id)
+                continue
+
+            traded = min(remaining, maker.remaining)
+            if side == BUY:
+                buyer_id, seller_id = trader_id, maker.trader_id
+            else:
+                buyer_id, seller_id = maker.trader_id, trader_id
+            fills.append(Fill(maker.order_id, order_id, buyer_id, seller_id, maker.price, traded))
+
+            remaining -= traded
+            self._reduce(maker, traded)
+
+        if remaining > 0:
+            self.add(order_id, trader_id, side, price, remaining)
+
+        return MatchResult(fills, cancelled, remaining)
+
+    def best_bid(self):
+        level = self._best_level(BUY)
+        return level.price if level else None
+
+    def best_offer(self):
+        level = self._best_level(SELL)
+        return level.price if level else None
+
+    def remaining(self, order_id):
+        order = self._orders.get(order_id)
+        return order.remaining if order else 0
+
+    def depth(self, levels=5):
+        """
+        Return the best `levels` price levels of each side as (price, quantity, orders) tuples.
+        """
+        bid_prices = heapq.nlargest(levels, self._levels[BUY])
+        offer_prices = heapq.nsmallest(levels, self._levels[SELL])
+
+        def describe(side, prices):
+            return [(price, self._levels[side][price].quantity, self._levels[side][price].count) for price in prices]
+
+        return {'bids': describe(BUY, bid_prices), 'offers': describe(SELL, offer_prices)}
@@ -0,0 +1,94 @@
+"""
+Reaper of abandoned game sessions.
+
+A session normally ends when its player logs out, so a closed browser leaves it active for
+good and every active=True filter keeps paying for it. The reaper finishes the sessions that
+have seen no message release for SESSION_EXPIRY seconds, a chunk at a time: each chunk is
+locked with SELECT ... FOR UPDATE SKIP LOCKED, so several reapers (or a logout finishing the
+same session) never wait on each other, and settled with GameSession.finish_sessions in a
+handful of set-based UPDATEs. Each pass of the loop also purges the expired idempotency keys.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import GameSession, IdempotencyKey, SessionMessage
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+
+
+def expired_sessions(cutoff):
+    """
+    Active sessions started before the cutoff with no message released since then. Sessions
+    waiting in the pool are not started, so they never expire.
+    """
+    recent_release = SessionMessage.objects.filter(game_session=OuterRef('pk'), release_timestamp__gte=cutoff)
+    return (
+        GameSession.objects.filter(active=True, pooled=False, created_at__lt=cutoff)
+        .exclude(Exists(recent_release))
+        .order_by('pk')
+    )
+
+
+def reap_chunk(cutoff, chunk_size=CHUNK_SIZE):
+    """
+    Finish up to chunk_size expired sessions in one transaction. Returns the number finished.
+    """
+    with transaction.atomic():
+        # Only what final_price needs is loaded
+        game_sessions = list(
+            expired_sessions(cutoff)
+            .select_for_update(skip_locked=True)
+            .only('pk', 'initial_price', 'price_path')[:chunk_size]
+        )
+        GameSession.finish_sessions(game_sessions)
+    return len(game_sessions)
+
+
+def reap_expired_sessions(max_age=None, chunk_size=CHUNK_SIZE, now=None):
+    """
+    Finish every session idle for more than max_age seconds, chunk by chunk. Returns the
+    number of sessions finished.
+    """
+    max_age = settings.SESSION_EXPIRY if max_age is None else max_age
+    cutoff = (now or timezone.now()) - timezone.timedelta(seconds=max_age)
+
+    reaped = 0
+    while True:
+        finished = reap_chunk(cutoff, chunk_size)
+        reaped += finished
+        if finished < chunk_size:
+            return reaped
+
+
+def run_forever(interval=60.0, max_age=None, chunk_size=CHUNK_SIZE):
+    """
+    Reap expired sessions and purge expired idempotency keys every `interval` seconds, logging
+    the throughput of each pass.
+    """
+    while True:
+        started = time.monotonic()
+        close_old_connections()
+        try:
+            reaped = reap_expired_sessions(max_age, chunk_size)
+        except Exception:
+            logger.exception("Session reaper failed.")
+        else:
+            elapsed = time.monotonic() - started
+            if reaped:
+                logger.info("Reaped %s game sessions in %.2fs (%.0f/s).", reaped, elapsed, reaped / max(elapsed, 1e-9))
+
+        try:
+            purged = IdempotencyKey.purge_expired(chunk_size)
+        except Exception:
+            logger.exception("Idempotency key purge failed.")
+        else:
+            if purged:
+                logger.info("Purged %s expired idempotency keys.", purged)
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
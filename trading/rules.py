@@ -0,0 +1,230 @@
+"""
+The arithmetic of the game, kept free of the ORM.
+
+AIPlayer and GameSession call these functions for games played through the views, and
+trading.simulation calls the same functions for headless games, so both paths produce the
+same prices for the same deck.
+
+The *_many functions do the same arithmetic for a whole population of AI players at once, on
+NumPy arrays of fixed-point integers (multiples of EV_PLACES or PRICE_PLACES). Integer
+arithmetic rounds exactly like the Decimal functions followed by quantize_ev/quantize_price,
+so a batched reaction and a one-by-one reaction store the same values.
+"""
+from decimal import Decimal, ROUND_HALF_EVEN
+
+import numpy as np
+
+ADJUSTMENT_FACTOR = Decimal("0.05")  # 5% impact on expected value
+UNCERTAINTY_FACTOR = Decimal("0.10")  # 10% uncertainty factor
+
+# Every trade is for a fixed 2000 metric tonnes
+TRADE_QUANTITY = 2000
+
+# Precision of the stored columns: AIPlayer.current_ev and the bid/offer prices
+EV_PLACES = Decimal("0.0001")
+PRICE_PLACES = Decimal("0.01")
+
+# Factors (adjustment, uncertainty) may have up to 4 decimal places in the batched functions
+FACTOR_PLACES = Decimal("0.0001")
+# A factor of 1 in FACTOR_PLACES units
+FACTOR_SCALE = 10 ** -FACTOR_PLACES.as_tuple().exponent
+
+
+def quantize_ev(value):
+    return value.quantize(EV_PLACES, rounding=ROUND_HALF_EVEN)
+
+
+def quantize_price(value):
+    return value.quantize(PRICE_PLACES, rounding=ROUND_HALF_EVEN)
+
+
+def adjust_ev(current_ev, initial_price, impact_type, adjustment_factor=ADJUSTMENT_FACTOR):
+    """
+    Move an expected value by one message. An EV of zero means none has been set yet, and
+    starts from the game's initial price.
+    """
+    if current_ev == Decimal('0.00'):
+        current_ev = initial_price
+
+    if impact_type == "bullish":
+        current_ev *= (1 + adjustment_factor)
+    elif impact_type == "bearish":
+        current_ev *= (1 - adjustment_factor)
+
+    return current_ev
+
+
+def quote_around(current_ev, uncertainty_factor=UNCERTAINTY_FACTOR):
+    """
+    Return the (bid, offer) an AI quotes around its expected value.
+    """
+    bid = current_ev - (current_ev * uncertainty_factor)
+    offer = current_ev + (current_ev * uncertainty_factor)
+    return bid, offer
+
+
+def trade_action(current_ev, player_bid, player_offer):
+    """
+    Decide whether an AI with the given EV trades against a player's quotes. Returns
+    ("buy", price) when the AI lifts the player's offer, ("sell", price) when it hits the
+    player's bid, or None.
+    """
+    if player_bid != Decimal('0.00') or player_offer != Decimal('0.00'):
+
+        if current_ev > player_offer:
+            # Current expected value is higher than player's offer -> AI buys from player at player's offer price
+            return "buy", player_offer
+
+        if current_ev < player_bid:
+            # Current expected value is lower than player's bid -> AI sells to player at player's bid price
+            return "sell", player_bid
+
+    return None
+
+
+def compound_price(initial_price, impacts):
+    """
+    Apply a sequence of (impact_type, impact_value) pairs to the initial price, where
+    impact_value is a percentage.
+    """
+    final_price = initial_price
+
+    for impact_type, impact_value in impacts:
+        if impact_type == "bullish":
+            final_price += final_price * (impact_value / 100)
+        elif impact_type == "bearish":
+            final_price -= final_price * (impact_value / 100)
+
+    return final_price
+
+
+def apply_fill(position, cost_basis, quantity, price):
+    """
+    Average-cost accounting of one fill. quantity is positive for a buy and negative for a
+    sell; cost_basis is what the open position cost (negative for a short). Returns the new
+    (position, cost_basis). Realized PnL is then cash flow + cost basis, and unrealized PnL
+    is position * mark - cost basis.
+    """
+    new_position = position + quantity
+
+    if position == 0 or (position > 0) == (quantity > 0):
+        # Opening or adding to a position
+        return new_position, cost_basis + quantity * price
+
+    if new_position == 0:
+        return 0, Decimal('0.00')
+
+    if (new_position > 0) == (position > 0):
+        # Partly closing: what remains keeps its average cost
+        return new_position, quantize_price(cost_basis * new_position / position)
+
+    # Closing and reversing: the rest of the fill opens a new position at the fill price
+    return new_position, new_position * price
+
+
+def price_path(initial_price, impacts):
+    """
+    Return the price after each of the (impact_type, impact_value) pairs, compounded at full
+    precision and rounded to PRICE_PLACES only for storage, so the last step equals the
+    rounded compound_price.
+    """
+    path = []
+    price = initial_price
+
+    for impact in impacts:
+        price = compound_price(price, [impact])
+        path.append(quantize_price(price))
+
+    return path
+
+
+def _scale(quantum):
+    return 10 ** -quantum.as_tuple().exponent
+
+
+def to_fixed(values, quantum):
+    """
+    Convert Decimals to an int64 array counting multiples of quantum (e.g. EV_PLACES).
+    """
+    scale = _scale(quantum)
+    return np.array(
+        [int((Decimal(value) * scale).to_integral_value(rounding=ROUND_HALF_EVEN)) for value in values],
+        dtype=np.int64,
+    )
+
+
+def from_fixed(array, quantum):
+    places = quantum.as_tuple().exponent
+    return [Decimal(int(value)).scaleb(places) for value in array]
+
+
+def divide_half_even(numerator, denominator):
+    # Floor division leaves 0 <= remainder < denominator, also for negative numerators
+    quotient, remainder = np.divmod(numerator, denominator)
+    twice = 2 * remainder
+    round_up = (twice > denominator) | ((twice == denominator) & (quotient % 2 == 1))
+    return quotient + round_up
+
+
+def factor_units(factor):
+    """
+    Convert a factor to FACTOR_PLACES units. factor is a Decimal shared by every AI, or an
+    int64 array with one factor per AI that is already in FACTOR_PLACES units.
+    """
+    if isinstance(factor, np.ndarray):
+        return factor
+    return to_fixed([factor], FACTOR_PLACES)[0]
+
+
+def adjust_ev_many(ev_units, initial_price, impact_type, adjustment_factor=ADJUSTMENT_FACTOR):
+    """
+    adjust_ev followed by quantize_ev, for an array of EVs in EV_PLACES units. See factor_units
+    for the adjustment factor.
+    """
+    ev_units = np.where(ev_units == 0, to_fixed([initial_price], EV_PLACES)[0], ev_units)
+
+    factor_scale = FACTOR_SCALE
+    factor = factor_units(adjustment_factor)
+
+    if impact_type == "bullish":
+        return divide_half_even(ev_units * (factor_scale + factor), factor_scale)
+    if impact_type == "bearish":
+        return divide_half_even(ev_units * (factor_scale - factor), factor_scale)
+    return ev_units
+
+
+def quote_around_many(ev_units, uncertainty_factor=UNCERTAINTY_FACTOR):
+    """
+    quote_around followed by quantize_price, for an array of EVs in EV_PLACES units. Returns
+    (bids, offers) in PRICE_PLACES units.
+    """
+    factor_scale = FACTOR_SCALE
+    factor = factor_units(uncertainty_factor)
+
+    denominator = factor_scale * (_scale(EV_PLACES) // _scale(PRICE_PLACES))
+    bids = divide_half_even(ev_units * (factor_scale - factor), denominator)
+    offers = divide_half_even(ev_units * (factor_scale + factor), denominator)
+    return bids, offers
+
+
+def trade_actions_many(ev_units, player_bid, player_offer):
+    """
+    trade_action for a population of AIs trading against one player. The player's offer can
+    be lifted once and their bid hit once, by the AI with the highest (resp. lowest) EV; ties
+    go to the AI that comes first. Returns a list of (index, action, price).
+    """
+    if player_bid == Decimal('0.00') and player_offer == Decimal('0.00'):
+        return []
+
+    bid_units, offer_units = to_fixed([player_bid, player_offer], EV_PLACES)
+    buying = ev_units > offer_units
+    selling = (ev_units < bid_units) & ~buying
+
+    actions = []
+    if buying.any():
+        candidates = np.flatnonzero(buying)
+        actions.append((int(candidates[np.argmax(ev_units[candidates])]), "buy", player_offer))
+    if selling.any():
+        candidates = np.flatnonzero(selling)
+        actions.append((int(candidates[np.argmin(ev_units[candidates])]), "sell", player_bid))
+    return actions
@@ -0,0 +1,180 @@
+"""
+Sampling of message decks for new game sessions.
+
+The ids and impacts of the whole message catalog are kept in a versioned pool in the cache, so
+drawing a deck for a new GameSession costs O(k) instead of an ORDER BY RANDOM() over the table.
+The pool is rebuilt when its version is bumped (populate_messages, Message.save), when it is
+POOL_TIMEOUT old, or when a draw finds ids that no longer exist.
+"""
+import bisect
+import itertools
+import random
+import time
+
+from django.core.cache import cache
+
+POOL_VERSION_KEY = 'trading:message_pool:version'
+POOL_KEY = 'trading:message_pool:{version}'
+
+# Rebuild at least this often even if nobody bumps the version, e.g. when the cache is per process
+POOL_TIMEOUT = 60 * 60
+
+# Process-local copy of the pool, so a warm draw does not unpickle the catalog every time. It
+# expires with the shared copy, see MessagePool.expired
+_local_pool = None
+
+
+class MessagePool:
+    """
+    A snapshot of the message catalog: parallel lists of ids, impact types and impact values.
+    """
+
+    def __init__(self, version, ids, impact_types, impact_values):
+        self.version = version
+        self.ids = ids
+        self.impact_types = impact_types
+        self.impact_values = impact_values
+        self._indexes = {}
+        self._cumulative_weights = {}
+        self._positions = None
+        # Wall-clock time, so the copies of every process expire together with the shared one
+        self.expires_at = time.time() + POOL_TIMEOUT
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, version):
+        # Imported here because models uses this module when assigning decks
+        from .models import Message
+
+        rows = list(Message.objects.order_by('id').values_list('id', 'impact_type', 'impact_value'))
+        ids, impact_types, impact_values = (list(column) for column in zip(*rows)) if rows else ([], [], [])
+        return cls(version, ids, impact_types, impact_values)
+
+    def expired(self):
+        return time.time() >= self.expires_at
+
+    @classmethod
+    def current(cls):
+        """
+        Return the pool for the current catalog version, loading it from the database only if
+        neither this process nor the shared cache has an unexpired copy. The version key never
+        expires, so the age of the pool is what lets a process whose cache is its own (LocMemCache)
+        see a catalog that another process changed.
+        """
+        global _local_pool
+
+        version = cache.get(POOL_VERSION_KEY)
+        if version is None:
+            cache.add(POOL_VERSION_KEY, 1, None)
+            version = cache.get(POOL_VERSION_KEY, 1)
+
+        if _local_pool is not None and _local_pool.version == version and not _local_pool.expired():
+            return _local_pool
+
+        key = POOL_KEY.format(version=version)
+        pool = cache.get(key)
+        if pool is None or pool.expired():
+            pool = cls.load(version)
+            cache.set(key, pool, POOL_TIMEOUT)
+
+        _local_pool = pool
+        return pool
+
+    @staticmethod
+    def invalidate():
+        """
+        Bump the catalog version so the next draw, in any process sharing the cache, rebuilds
+        the pool from the database.
+        """
+        global _local_pool
+        _local_pool = None
+
+        try:
+            cache.incr(POOL_VERSION_KEY)
+        except ValueError:
+            cache.set(POOL_VERSION_KEY, 2, None)
+
+    def positions_of(self, message_ids):
+        """
+        Return the positions in the pool of the given message ids.
+        """
+        if self._positions is None:
+            self._positions = {message_id: i for i, message_id in enumerate(self.ids)}
+        return [self._positions[message_id] for message_id in message_ids]
+
+    def indexes_for(self, impact_type=None):
+        """
+        Return the positions in the pool of the messages with the given impact type (or all of them).
+        """
+        if impact_type is None:
+            return range(len(self.ids))
+
+        if impact_type not in self._indexes:
+            self._indexes[impact_type] = [i for i, value in enumerate(self.impact_types) if value == impact_type]
+        return self._indexes[impact_type]
+
+    def cumulative_weights_for(self, impact_type=None):
+        if impact_type not in self._cumulative_weights:
+            weights = (float(self.impact_values[i]) for i in self.indexes_for(impact_type))
+            self._cumulative_weights[impact_type] = list(itertools.accumulate(weights))
+        return self._cumulative_weights[impact_type]
+
+    def draw(self, k, rng=None, weighted=False, impact_type=None):
+        """
+        Draw k distinct message ids. Unweighted draws are uniform; weighted draws pick messages
+        in proportion to their impact_value. impact_type restricts the draw to bullish or bearish
+        messages. Raises ValueError if there are fewer than k candidates.
+        """
+        rng = rng or random
+        indexes = self.indexes_for(impact_type)
+
+        if len(indexes) < k:
+            raise ValueError("Not enough messages in the database to sample from!")
+
+        if not weighted:
+            return [self.ids[indexes[i]] for i in rng.sample(range(len(indexes)), k)]
+
+        cumulative_weights = self.cumulative_weights_for(impact_type)
+        total = cumulative_weights[-1]
+
+        # Rejection sampling: each pick is a binary search, and repeats are rare unless k is close to the pool size
+        chosen = []
+        seen = set()
+        attempts = 0
+        while len(chosen) < k and attempts < k * 50:
+            attempts += 1
+            position = bisect.bisect_right(cumulative_weights, rng.random() * total)
+            position = min(position, len(indexes) - 1)
+            if position not in seen:
+                seen.add(position)
+                chosen.append(position)
+
+        # Pathological weights: fill up with the remaining candidates, heaviest first
+        if len(chosen) < k:
+            remaining = sorted(
+                (position for position in range(len(indexes)) if position not in seen),
+                key=lambda position: self.impact_values[indexes[position]],
+                reverse=True,
+            )
+            chosen.extend(remaining[:k - len(chosen)])
+
+        return [self.ids[indexes[position]] for position in chosen]
+
+
+def sample_message_ids(k, rng=None, weighted=False, impact_type=None):
+    """
+    Draw k distinct ids of messages that exist in the database. A pool that refers to deleted
+    messages is rebuilt and the draw retried once.
+    """
+    from .models import Message
+
+    message_ids = MessagePool.current().draw(k, rng=rng, weighted=weighted, impact_type=impact_type)
+
+    existing_ids = set(Message.objects.filter(pk__in=message_ids).values_list('pk', flat=True))
+    if len(existing_ids) == len(message_ids):
+        return message_ids
+
+    MessagePool.invalidate()
+    return MessagePool.current().draw(k, rng=rng, weighted=weighted, impact_type=impact_type)
@@ -0,0 +1,132 @@
+"""
+Pool of ready-to-play game sessions.
+
+Building a session (drawing its deck, attaching every AI player) is work a player would
+otherwise wait for on login. A filler keeps between SESSION_POOL_LOW and SESSION_POOL_HIGH
+sessions built in advance, marked pooled so the game clock leaves them alone, and
+GameSession.bootstrap claims the oldest one with SELECT ... FOR UPDATE SKIP LOCKED. A session
+is only built during login when the pool is empty, which is counted as a miss.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import counters
+
+logger = logging.getLogger(__name__)
+
+# Counters shared by every worker through the cache
+HITS_KEY = 'trading:session_pool:hits'
+MISSES_KEY = 'trading:session_pool:misses'
+
+# The filler running in this process, woken up by claims
+_filler = None
+
+
+def record_claim(hit):
+    """
+    Count a login that found a pooled session (hit) or had to build one (miss), and nudge the
+    filler of this process so it checks the depth before its next scheduled look.
+    """
+    counters.incr(HITS_KEY if hit else MISSES_KEY)
+    if _filler is not None:
+        _filler.wake()
+
+
+def depth():
+    # Imported here because models uses this module when claiming sessions
+    from .models import GameSession
+
+    return GameSession.objects.filter(pooled=True, active=True).count()
+
+
+def fill(high=None):
+    """
+    Build sessions until the pool holds `high` of them. Returns the number built.
+    """
+    from .models import GameSession
+
+    high = settings.SESSION_POOL_HIGH if high is None else high
+    missing = max(0, high - depth())
+    for _ in range(missing):
+        GameSession.build(pooled=True)
+    return missing
+
+
+def metrics():
+    return {
+        'depth': depth(),
+        'hits': counters.get(HITS_KEY),
+        'misses': counters.get(MISSES_KEY),
+    }
+
+
+class SessionPoolFiller:
+    """
+    Tops the pool back up to the high watermark whenever it falls below the low watermark.
+    The depth is checked every `interval` seconds, and straight away after a claim in this process.
+    """
+
+    def __init__(self, low=None, high=None, interval=5.0):
+        self.low = settings.SESSION_POOL_LOW if low is None else low
+        self.high = settings.SESSION_POOL_HIGH if high is None else high
+        self.interval = interval
+
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Metrics
+        self.built = 0
+        self.failures = 0
+
+    def wake(self):
+        self._wakeup.set()
+
+    def run_once(self):
+        """
+        Refill the pool if it is below the low watermark. Returns the number of sessions built.
+        """
+        if depth() >= self.low:
+            return 0
+
+        built = fill(self.high)
+        self.built += built
+        return built
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            close_old_connections()
+            try:
+                self.run_once()
+            except Exception:
+                self.failures += 1
+                logger.exception("Session pool filler failed to refill the pool.")
+            finally:
+                close_old_connections()
+
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def start(self):
+        """
+        Run the filler in a background thread, and have claims in this process wake it up.
+        """
+        global _filler
+        _filler = self
+
+        self._thread = threading.Thread(target=self.run_forever, name='session-pool', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        global _filler
+        if _filler is self:
+            _filler = None
+
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
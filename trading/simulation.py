@@ -0,0 +1,204 @@
+"""
+Headless game simulation.
+
+Replays the GameSession lifecycle (deck draw, AI reaction to every message, settlement) on small
+in-memory objects without touching the ORM, so tens of thousands of games can be spread over a
+process pool. The decks are drawn from the same MessagePool and with the same rules as
+games played through get_next_message, and the AI reacts through the strategy of its style
+like AIPlayer.react_in_bulk, so a game with a given seed ends exactly as the database-backed
+game seeded the same way. The noise strategy is the exception: it is seeded by the session,
+which a simulated game does not have.
+"""
+import random
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+import numpy as np
+
+from . import rules, strategies
+from .models import GameSession
+
+# Catalog shared by the games of one worker process, set by _init_worker
+_worker_catalog = None
+
+
+class SimulatedTrader:
+    """
+    A trader's quotes and running totals for one simulated game.
+    """
+    __slots__ = ('current_ev', 'bid', 'offer', 'position', 'cash_flow', 'buy_trades_count', 'sell_trades_count')
+
+    def __init__(self, bid=Decimal('0.00'), offer=Decimal('0.00')):
+        self.current_ev = Decimal('0.00')
+        self.bid = bid
+        self.offer = offer
+        self.position = 0
+        self.cash_flow = Decimal('0.00')
+        self.buy_trades_count = 0
+        self.sell_trades_count = 0
+
+    def buy(self, price, quantity):
+        self.position += quantity
+        self.cash_flow -= quantity * price
+        self.buy_trades_count += 1
+
+    def sell(self, price, quantity):
+        self.position -= quantity
+        self.cash_flow += quantity * price
+        self.sell_trades_count += 1
+
+
+class GameResult:
+    """
+    The outcome of one simulated game.
+    """
+    __slots__ = ('seed', 'message_ids', 'final_price', 'ai_ev', 'ai_bid', 'ai_offer',
+                 'player_position', 'player_cash_flow', 'trades')
+
+    def __init__(self, seed, message_ids, final_price, ai, player):
+        self.seed = seed
+        self.message_ids = message_ids
+        self.final_price = final_price
+        self.ai_ev = ai.current_ev
+        self.ai_bid = ai.bid
+        self.ai_offer = ai.offer
+        self.player_position = player.position
+        self.player_cash_flow = player.cash_flow
+        self.trades = player.buy_trades_count + player.sell_trades_count
+
+    @property
+    def player_pnl(self):
+        # Open inventory is marked at the trade out price
+        return self.player_cash_flow + self.player_position * self.final_price
+
+    def __repr__(self):
+        return f"GameResult(seed={self.seed}, final_price={self.final_price}, trades={self.trades})"
+
+
+def simulate_game(seed, catalog, initial_price=Decimal('70.00'), player_bid=Decimal('0.00'), player_offer=Decimal('0.00'),
+                  style=strategies.DEFAULT_STYLE, parameters=None):
+    """
+    Play one game against a player who keeps a fixed bid and offer, with an AI of the given
+    style and strategy parameters (the StrategyParameters of the style, read by the caller).
+    catalog is a trading.sampling.MessagePool; the deck is drawn with random.Random(seed).
+    """
+    rng = random.Random(seed)
+    message_ids = catalog.draw(GameSession.DECK_SIZE, rng=rng)
+    positions = catalog.positions_of(message_ids)
+    impacts = [(catalog.impact_types[i], catalog.impact_values[i]) for i in positions]
+
+    strategy = strategies.get_strategy(style, parameters)
+    ai = SimulatedTrader()
+    player = SimulatedTrader(bid=player_bid, offer=player_offer)
+    history = []
+
+    # One step per released message, as AIPlayer.react_in_bulk does it for a group of one AI
+    for message_id, (impact_type, impact_value) in zip(message_ids, impacts):
+        history.append(impact_type)
+        states = strategies.AIStates(rules.to_fixed([ai.current_ev], rules.EV_PLACES), np.array([ai.position], dtype=np.int64))
+        context = strategies.MarketContext(initial_price, impact_type, impact_value, tuple(history), [seed, message_id])
+        ev_units, bids, offers = strategy.on_message(states, context)
+        ai.current_ev = rules.from_fixed(ev_units, rules.EV_PLACES)[0]
+
+        action = rules.trade_action(ai.current_ev, player.bid, player.offer)
+        if action:
+            action_type, price = action
+            if action_type == "buy":
+                ai.buy(price, rules.TRADE_QUANTITY)
+                player.sell(price, rules.TRADE_QUANTITY)
+            else:
+                ai.sell(price, rules.TRADE_QUANTITY)
+                player.buy(price, rules.TRADE_QUANTITY)
+
+        ai.bid = rules.from_fixed(bids, rules.PRICE_PLACES)[0]
+        ai.offer = rules.from_fixed(offers, rules.PRICE_PLACES)[0]
+
+    final_price = rules.quantize_price(rules.compound_price(initial_price, impacts))
+
+    return GameResult(seed, message_ids, final_price, ai, player)
+
+
+def _init_worker(catalog):
+    global _worker_catalog
+    _worker_catalog = catalog
+
+
+def _simulate_chunk(seeds, params):
+    return [simulate_game(seed, _worker_catalog, **params) for seed in seeds]
+
+
+def simulate_games(seeds, catalog, workers=None, chunk_size=500, **params):
+    """
+    Simulate one game per seed and return the results in seed order. With workers=1 the games
+    run in this process; otherwise they are spread over a process pool in chunks, and the
+    catalog is sent to each worker once.
+    """
+    seeds = list(seeds)
+
+    if workers == 1:
+        return [simulate_game(seed, catalog, **params) for seed in seeds]
+
+    chunks = [seeds[i:i + chunk_size] for i in range(0, len(seeds), chunk_size)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(catalog,)) as executor:
+        for chunk_results in executor.map(_simulate_chunk, chunks, [params] * len(chunks)):
+            results.extend(chunk_results)
+    return results
+
+
+def summarize(results):
+    """
+    Aggregate statistics over a list of GameResults.
+    """
+    final_prices = [float(result.final_price) for result in results]
+    player_pnls = [float(result.player_pnl) for result in results]
+
+    return {
+        'games': len(results),
+        'mean_final_price': statistics.fmean(final_prices) if results else 0.0,
+        'min_final_price': min(final_prices, default=0.0),
+        'max_final_price': max(final_prices, default=0.0),
+        'mean_player_pnl': statistics.fmean(player_pnls) if results else 0.0,
+        'mean_ai_ev': statistics.fmean(float(result.ai_ev) for result in results) if results else 0.0,
+        'total_trades': sum(result.trades for result in results),
+    }
+
+
+def save_results(results, label='', base_seed=0, initial_price=Decimal('70.00'), player_bid=Decimal('0.00'),
+                 player_offer=Decimal('0.00'), batch_size=1000):
+    """
+    Write a run and all its games to the database in bulk, once the simulation has finished.
+    """
+    from django.db import transaction
+    from .models import SimulationRun, SimulatedGame
+
+    summary = summarize(results)
+
+    with transaction.atomic():
+        run = SimulationRun.objects.create(
+            label=label,
+            base_seed=base_seed,
+            initial_price=initial_price,
+            player_bid=player_bid,
+            player_offer=player_offer,
+            **summary,
+        )
+        SimulatedGame.objects.bulk_create(
+            (
+                SimulatedGame(
+                    run=run,
+                    seed=result.seed,
+                    final_price=result.final_price,
+                    ai_ev=result.ai_ev,
+                    player_position=result.player_position,
+                    player_cash_flow=result.player_cash_flow,
+                    player_pnl=result.player_pnl,
+                    trades=result.trades,
+                )
+                for result in results
+            ),
+            batch_size=batch_size,
+        )
+
+    return run
@@ -0,0 +1,131 @@
+"""
+Versioned game session state for polling clients.
+
+Every event published for a session (see trading.events) is also a state change: it gets the
+next version number of the session from a counter in the cache and is stored under that
+version. A client that polls with the version it has seen gets back only the changes after
+it, read from the cache, or a 304 when the version has not moved, which costs a single cache
+read. Clients that are too far behind, or whose changes have expired, get a full snapshot
+built from the database instead.
+"""
+import time
+
+from django.core import signing
+from django.core.cache import cache
+from django.utils import timezone
+
+VERSION_KEY = 'trading:session_state:{session_id}:version'
+BASE_KEY = 'trading:session_state:{session_id}:base'
+CHANGE_KEY = 'trading:session_state:{session_id}:{version}'
+
+# How long changes are kept, and the most a client may be behind before it gets a snapshot
+CHANGE_TIMEOUT = 60 * 60
+MAX_CHANGES = 200
+
+# Polls prove they belong to the session with a signed token from the game page, so checking
+# them needs no database
+TOKEN_SALT = 'trading.state'
+TOKEN_MAX_AGE = 12 * 60 * 60
+
+
+def make_token(session_id, player_id):
+    return signing.dumps({'session_id': session_id, 'player_id': player_id}, salt=TOKEN_SALT)
+
+
+def check_token(token, session_id):
+    """
+    Return whether the token was issued for the session and has not expired.
+    """
+    try:
+        payload = signing.loads(token, salt=TOKEN_SALT, max_age=TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return payload.get('session_id') == session_id
+
+
+def record_change(session_id, event_type, data):
+    """
+    Store a change of the session's state under its next version. Returns the version.
+    """
+    key = VERSION_KEY.format(session_id=session_id)
+
+    # A counter lost from the cache restarts from the clock, in milliseconds, so versions keep
+    # increasing and no client mistakes a new version for one it has already seen. The version
+    # a counter started from stands for "no change yet", which clients know as version 0.
+    base = int(time.time() * 1000)
+    if cache.add(key, base, None):
+        cache.set(BASE_KEY.format(session_id=session_id), base, None)
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        version = int(time.time() * 1000)
+        cache.set(key, version, None)
+
+    cache.set(CHANGE_KEY.format(session_id=session_id, version=version), {'version': version, 'type': event_type, 'data': data}, CHANGE_TIMEOUT)
+    return version
+
+
+def current_version(session_id):
+    return cache.get(VERSION_KEY.format(session_id=session_id), 0)
+
+
+def changes_since(session_id, since, version):
+    """
+    Return the changes after version `since` up to `version`, oldest first, or None if they
+    can no longer all be read from the cache.
+    """
+    if since == 0:
+        since = cache.get(BASE_KEY.format(session_id=session_id))
+        if since is None:
+            return None
+
+    if since > version or version - since > MAX_CHANGES:
+        return None
+
+    keys = [CHANGE_KEY.format(session_id=session_id, version=v) for v in range(since + 1, version + 1)]
+    found = cache.get_many(keys)
+    if len(found) < len(keys):
+        return None
+    return [found[key] for key in keys]
+
+
+def snapshot(game_session, trade_limit=50):
+    """
+    The full state of a session: the quotes of everyone in it, the latest trades, the last
+    released message and the message clock.
+    """
+    # Imported here because models publishes its changes through this module
+    from .models import GameSession, Trade
+
+    quotes = [ai_player.quote_data(game_session) for ai_player in game_session.ai_players.order_by('id')]
+    quotes += [player.quote_data() for player in game_session.players.order_by('id')]
+    trades, has_older_trades = Trade.history(game_session.id, limit=trade_limit)
+
+    last_entry = game_session.deck.filter(release_timestamp__isnull=False).select_related('message').order_by('-release_timestamp').first()
+    last_message = None
+    next_release = None
+    if last_entry is not None:
+        last_message = {
+            'sequence': last_entry.sequence,
+            'message_content': last_entry.message.content,
+            'impact_type': last_entry.message.impact_type,
+            'impact_value': str(last_entry.message.impact_value),
+            'released_at': last_entry.release_timestamp.isoformat(),
+        }
+        if game_session.active and game_session.messages_released < GameSession.DECK_SIZE:
+            next_release = (last_entry.release_timestamp + timezone.timedelta(seconds=GameSession.MESSAGE_INTERVAL)).isoformat()
+
+    return {
+        'active': game_session.active,
+        'quotes': quotes,
+        'trades': [trade.feed_item() for trade in trades],
+        'has_older_trades': has_older_trades,
+        'last_message': last_message,
+        'clock': {
+            'messages_released': game_session.messages_released,
+            'deck_size': GameSession.DECK_SIZE,
+            'interval': GameSession.MESSAGE_INTERVAL,
+            'next_release': next_release,
+        },
+        'trade_out_price': None if game_session.active else str(game_session.trade_out_price),
+    }
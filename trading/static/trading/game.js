@@ -7,6 +7,7 @@ $("#bid-offer-form").on("submit", function(e){
     e.preventDefault();
     $.ajax({
         url: updateBidOfferUrl,
+        headers: { 'Authorization': 'Bearer ' + apiToken },
         data: $(this).serialize(),
         type: "POST",
         success: function(response){
@@ -61,26 +62,41 @@ $(document).on("click", ".hit-bid, .lift-offer", function(e){
     console.log(parentTr.find(".offer")); // Debug
     var price = $(this).hasClass("hit-bid") ? parentTr.find(".bid").data("bid") : parentTr.find(".offer").data("offer");
     console.log(price); // Log the price to console for debugging
+    var action = $(this).hasClass("hit-bid") ? 'sell' : 'buy';
     $.ajax({
         url: createTradeUrl,
+        // A trade is keyed by the quote it was made on, so a double click or a resent request
+        // gets the first trade back instead of making another one
+        headers: {
+            'Idempotency-Key': ['trade', gameSessionId, aiPlayerId, action, parentTr.data("quote-version")].join('-'),
+        },
         data: {
             ai_player_id: aiPlayerId,
             price: price,
-            action: $(this).hasClass("hit-bid") ? 'sell' : 'buy',
+            quote_version: parentTr.data("quote-version"),
+            action: action,
         },
         type: "POST",
         success: function(response) {
             if(response.status === 'success') {
-                let newRow = `<tr id="trade-row-${response.trade.id}">
-                    <td>${response.trade.buyer.name}</td>
-                    <td>${response.trade.seller.name}</td>
-                    <td>${response.trade.price}</td>
-                    <td>${response.trade.quantity}</td>
-                </tr>`;
-                $('.confirmed-trades table').append(newRow);
+                appendTradeRow({
+                    trade_id: response.trade.id,
+                    buyer: response.trade.buyer.name,
+                    seller: response.trade.seller.name,
+                    price: response.trade.price,
+                    quantity: response.trade.quantity
+                });
             } else {
                 alert("An error occurred while creating the trade."); 
             }
+        },
+        error: function(jqXHR) {
+            // The quote moved (or was already traded on) before the trade reached the server
+            if (jqXHR.status === 409 && jqXHR.responseJSON) {
+                let quote = jqXHR.responseJSON.quote;
+                updateQuoteRow(quote.name, quote.bid, quote.offer, quote.quote_version);
+                alert(jqXHR.responseJSON.message);
+            }
         }
     });
 });
@@ -111,6 +127,7 @@ const countdown = setInterval(function() {
     // Inside the function where the timer ends
     $.ajax({
         url: playerSummaryUrl,
+        headers: { 'Authorization': 'Bearer ' + apiToken },
         type: "GET",
         success: function(response) {
             let summaryHtml = `
@@ -119,6 +136,8 @@ const countdown = setInterval(function() {
                     <li>Cash Flow: ${response.cash_flow}</li>
                     <li>Buy Trades Count: ${response.buy_trades_count}</li>
                     <li>Sell Trades Count: ${response.sell_trades_count}</li>
+                    <li>Realized PnL: ${response.realized_pnl}</li>
+                    <li>Unrealized PnL: ${response.unrealized_pnl}</li>
                     <!-- Add other relevant data here -->
                 </ul>
             `;
@@ -139,15 +158,171 @@ const countdown = setInterval(function() {
 // Start the timer immediately
 updateDisplay();
 
+    function tradeRow(trade) {
+        return `<tr id="trade-row-${trade.trade_id}">
+            <td>${trade.buyer}</td>
+            <td>${trade.seller}</td>
+            <td>${trade.price}</td>
+            <td>${trade.quantity}</td>
+        </tr>`;
+    }
+
+    // Add a trade to the trade logs, unless it is already there (it can arrive both as a response and as an event)
+    function appendTradeRow(trade) {
+        if ($(`#trade-row-${trade.trade_id}`).length) {
+            return;
+        }
+        $('.confirmed-trades table').append(tradeRow(trade));
+    }
+
+    // Ids of the trades shown in the trade log
+    function shownTradeIds() {
+        return $('.confirmed-trades table').first().find('tr[id^="trade-row-"]').map(function() {
+            return Number(this.id.replace('trade-row-', ''));
+        }).get();
+    }
+
+    // The page only comes with the latest trades; older ones are loaded a page at a time
+    function loadOlderTrades() {
+        const ids = shownTradeIds();
+        $.ajax({
+            url: tradeHistoryUrl,
+            method: 'GET',
+            data: ids.length ? { before: Math.min(...ids) } : {},
+            success: function(response) {
+                const rows = response.trades
+                    .filter(trade => !$(`#trade-row-${trade.trade_id}`).length)
+                    .map(tradeRow)
+                    .join('');
+                $('.confirmed-trades table').each(function() {
+                    $(this).find('tr').first().after(rows);
+                });
+                $('.load-older-trades').toggle(response.has_more);
+            }
+        });
+    }
+
+    $('.load-older-trades').on('click', loadOlderTrades);
+
+    // Catch up on the trades made since the newest one shown, e.g. while the event stream was down
+    function fetchNewTrades() {
+        const ids = shownTradeIds();
+        $.ajax({
+            url: tradeHistoryUrl,
+            method: 'GET',
+            data: ids.length ? { after: Math.max(...ids) } : {},
+            success: function(response) {
+                response.trades.forEach(appendTradeRow);
+                if (response.has_more) {
+                    fetchNewTrades();
+                }
+            }
+        });
+    }
+
+    // Update the bid and offer of a player in the auction status table
+    function updateQuoteRow(name, bid, offer, quoteVersion) {
+        let row = $(`#user-row-${name}`);
+        row.find('.bid').text(`$${bid}`).data('bid', bid);
+        row.find('.offer').text(`$${offer}`).data('offer', offer);
+        if (quoteVersion !== undefined) {
+            row.data('quote-version', quoteVersion);
+        }
+    }
+
+    // Apply an event pushed by the server for this game session
+    function applyEvent(type, data) {
+        if (type === 'message_released') {
+            $('.news-reel').text("Breaking News: " + data.message_content);
+        } else if (type === 'quote_changed') {
+            updateQuoteRow(data.name, data.bid, data.offer, data.quote_version);
+        } else if (type === 'quotes_changed') {
+            data.quotes.forEach(function(quote) {
+                updateQuoteRow(quote.name, quote.bid, quote.offer, quote.quote_version);
+            });
+        } else if (type === 'trade_filled') {
+            appendTradeRow(data);
+        } else if (type === 'session_finished') {
+            $('.news-reel').text("The game has finished. Trade out price: " + data.trade_out_price);
+        }
+    }
+
+    // Replace what is shown with a full snapshot of the session's state
+    function applySnapshot(snapshot) {
+        snapshot.quotes.forEach(function(quote) {
+            updateQuoteRow(quote.name, quote.bid, quote.offer, quote.quote_version);
+        });
+        snapshot.trades.forEach(appendTradeRow);
+        if (snapshot.last_message) {
+            $('.news-reel').text("Breaking News: " + snapshot.last_message.message_content);
+        }
+        if (!snapshot.active) {
+            $('.news-reel').text("The game has finished. Trade out price: " + snapshot.trade_out_price);
+        }
+    }
+
+    // Fallback for browsers without EventSource, or when the event stream cannot be kept open:
+    // poll the versioned session state, which answers 304 while nothing changes
+    let eventPolling = null;
+
+    function pollState() {
+        $.ajax({
+            url: sessionStateUrl,
+            method: 'GET',
+            headers: { 'X-State-Token': stateToken, 'If-None-Match': `"${stateVersion}"` },
+            success: function(response, status, xhr) {
+                if (xhr.status === 304 || !response) {
+                    return;
+                }
+                if (response.changes) {
+                    response.changes.forEach(function(change) {
+                        applyEvent(change.type, change.data);
+                    });
+                } else {
+                    applySnapshot(response.state);
+                }
+                stateVersion = response.version;
+            }
+        });
+    }
+
+    function startEventPolling() {
+        if (eventPolling === null) {
+            eventPolling = setInterval(pollState, 2000);
+        }
+    }
+
+    if (window.EventSource) {
+        const eventSource = new EventSource(sessionEventsUrl);
+        ['message_released', 'quote_changed', 'quotes_changed', 'trade_filled', 'session_finished'].forEach(function(type) {
+            eventSource.addEventListener(type, function(e) {
+                applyEvent(type, JSON.parse(e.data));
+                if (type === 'session_finished') {
+                    eventSource.close();
+                }
+            });
+        });
+        eventSource.onopen = function() {
+            fetchNewTrades();
+        };
+        eventSource.onerror = function() {
+            // The browser retries on its own unless the stream was closed for good
+            if (eventSource.readyState === EventSource.CLOSED) {
+                startEventPolling();
+            }
+        };
+    } else {
+        startEventPolling();
+    }
+
     // The following code fetches and displays a message every 20 seconds
 
     function fetchAndDisplayMessage() {
         $.ajax({
-            url: '/get_next_message/',  // This matches your Django URL for the view
+            // Served on the API fast path, which knows the player's session from the token
+            url: apiNextMessageUrl,
             method: 'GET',
-            data: {
-                game_session_id: gameSessionId // You'll need to provide the game session ID here
-            },
+            headers: { 'Authorization': 'Bearer ' + apiToken },
             success: function(response) {
                 if (response.error) {
                     console.error("Error:", response.error);  // Handle this better if you want to show it to the user
@@ -158,23 +333,13 @@ updateDisplay();
                 // Check if there's trade data in the response
                 if(response.trade_data) {
                     // Append a new row to the trade summary table
-                    let newRow = `<tr id="trade-row-${response.trade_data.trade_id}">
-                        <td>${response.trade_data.buyer}</td>
-                        <td>${response.trade_data.seller}</td>
-                        <td>${response.trade_data.price}</td>
-                        <td>${response.trade_data.quantity}</td>
-                    </tr>`;
-                    $('.confirmed-trades table').append(newRow);
+                    appendTradeRow(response.trade_data);
                 };
                 // Check if the response contains AI's updated bid and offer
                 if(response.ai_bid && response.ai_offer) {
                     // Update the bid and offer in the auction status table
-                    // Log the row ID being targeted
-                    console.log(`Targeting row ID: #user-row-${response.ai_name}`); 
                     // Assuming AIPlayer's name is unique
-                    let aiRow = $(`#user-row-${response.ai_name}`);
-                    aiRow.find('.bid').text(`$${response.ai_bid}`);
-                    aiRow.find('.offer').text(`$${response.ai_offer}`);
+                    updateQuoteRow(response.ai_name, response.ai_bid, response.ai_offer, response.ai_quote_version);
                 }
             },
             error: function(xhr, status, error) {
@@ -184,11 +349,14 @@ updateDisplay();
         });
     }
 
-    // Call the function once when the page loads
-    fetchAndDisplayMessage();
+    // Without the server-side game clock, these requests are what release the messages
+    if (!gameClockEnabled) {
+        // Call the function once when the page loads
+        fetchAndDisplayMessage();
 
-    // And set it to repeat every 20 seconds
-    setInterval(fetchAndDisplayMessage, 20000);
+        // And set it to repeat every 20 seconds
+        setInterval(fetchAndDisplayMessage, 20000);
+    }
 
 });
 
@@ -0,0 +1,178 @@
+"""
+AI trading strategies, selected by AIPlayer.style.
+
+A strategy reacts to a released message for a whole group of AI players at once: on_message
+gets the group's state as NumPy arrays and returns their new EVs and quotes in the fixed-point
+units of trading.rules. Parameters are read from the StrategyParameters row of the style and
+fall back to the strategy's defaults. Styles without a registered strategy play the standard
+strategy.
+"""
+import abc
+from collections import namedtuple
+from decimal import Decimal
+
+import numpy as np
+
+from . import rules
+
+DEFAULT_STYLE = 'standard'
+
+# Registered strategy classes, by style
+STRATEGIES = {}
+
+# State of a group of AI players: EVs in EV_PLACES units and positions in tonnes
+AIStates = namedtuple('AIStates', ['ev_units', 'positions'])
+
+# The message being reacted to. history holds the impact types of the session's messages
+# released so far, this one included.
+MarketContext = namedtuple('MarketContext', ['initial_price', 'impact_type', 'impact_value', 'history', 'seed'])
+
+
+def register(style):
+    def decorator(cls):
+        cls.style = style
+        STRATEGIES[style] = cls
+        return cls
+    return decorator
+
+
+def get_strategy(style, parameters=None):
+    """
+    Return the strategy for the style, configured with the given parameters.
+    """
+    cls = STRATEGIES.get(style, STRATEGIES[DEFAULT_STYLE])
+    return cls(parameters)
+
+
+class Strategy(abc.ABC):
+    style = None
+    defaults = {}
+
+    # Whether on_message reads AIStates.positions / MarketContext.history, which cost a query each
+    uses_positions = False
+    uses_history = False
+
+    def __init__(self, parameters=None):
+        self.parameters = {**self.defaults, **(parameters or {})}
+
+    def param(self, name):
+        return Decimal(str(self.parameters[name]))
+
+    @abc.abstractmethod
+    def on_message(self, states, context):
+        """
+        Return (ev_units, bid_units, offer_units) for the group of AI players in `states`.
+        """
+
+
+@register('standard')
+class StandardStrategy(Strategy):
+    """
+    Move the EV by a fixed factor in the direction of the message and quote symmetrically around it.
+    """
+    defaults = {
+        'adjustment_factor': str(rules.ADJUSTMENT_FACTOR),
+        'uncertainty_factor': str(rules.UNCERTAINTY_FACTOR),
+    }
+
+    def on_message(self, states, context):
+        ev_units = rules.adjust_ev_many(states.ev_units, context.initial_price, context.impact_type, self.param('adjustment_factor'))
+        bids, offers = rules.quote_around_many(ev_units, self.param('uncertainty_factor'))
+        return ev_units, bids, offers
+
+
+@register('momentum')
+class MomentumStrategy(Strategy):
+    """
+    React harder to a message that follows others in the same direction: the factor grows by
+    `boost` for each previous message of the run, up to `max_factor`.
+    """
+    defaults = {
+        'adjustment_factor': '0.04',
+        'boost': '0.50',
+        'max_factor': '0.12',
+        'uncertainty_factor': str(rules.UNCERTAINTY_FACTOR),
+    }
+    uses_history = True
+
+    def on_message(self, states, context):
+        streak = 0
+        for impact_type in reversed(context.history[:-1]):
+            if impact_type != context.impact_type:
+                break
+            streak += 1
+
+        factor = self.param('adjustment_factor') * (1 + self.param('boost') * streak)
+        factor = min(factor, self.param('max_factor')).quantize(rules.FACTOR_PLACES)
+
+        ev_units = rules.adjust_ev_many(states.ev_units, context.initial_price, context.impact_type, factor)
+        bids, offers = rules.quote_around_many(ev_units, self.param('uncertainty_factor'))
+        return ev_units, bids, offers
+
+
+@register('mean_reversion')
+class MeanReversionStrategy(Strategy):
+    """
+    Follow the message, then pull the EV back towards the initial price by `reversion`.
+    """
+    defaults = {
+        'adjustment_factor': str(rules.ADJUSTMENT_FACTOR),
+        'reversion': '0.30',
+        'uncertainty_factor': str(rules.UNCERTAINTY_FACTOR),
+    }
+
+    def on_message(self, states, context):
+        ev_units = rules.adjust_ev_many(states.ev_units, context.initial_price, context.impact_type, self.param('adjustment_factor'))
+
+        anchor = rules.to_fixed([context.initial_price], rules.EV_PLACES)[0]
+        reversion = rules.factor_units(self.param('reversion'))
+        ev_units = ev_units + rules.divide_half_even((anchor - ev_units) * reversion, rules.FACTOR_SCALE)
+
+        bids, offers = rules.quote_around_many(ev_units, self.param('uncertainty_factor'))
+        return ev_units, bids, offers
+
+
+@register('market_maker')
+class InventoryMarketMakerStrategy(Strategy):
+    """
+    Value the commodity like the standard strategy, but skew the quotes against the inventory:
+    for every TRADE_QUANTITY held, both quotes move down by `skew` (and up when short), so the
+    maker is more likely to trade back towards a flat position.
+    """
+    defaults = {
+        'adjustment_factor': str(rules.ADJUSTMENT_FACTOR),
+        'uncertainty_factor': '0.05',
+        'skew': '0.50',
+    }
+    uses_positions = True
+
+    def on_message(self, states, context):
+        ev_units = rules.adjust_ev_many(states.ev_units, context.initial_price, context.impact_type, self.param('adjustment_factor'))
+
+        skew_units = rules.to_fixed([self.param('skew')], rules.EV_PLACES)[0]
+        centre = ev_units - rules.divide_half_even(states.positions * skew_units, rules.TRADE_QUANTITY)
+
+        bids, offers = rules.quote_around_many(centre, self.param('uncertainty_factor'))
+        return ev_units, bids, offers
+
+
+@register('noise')
+class NoiseTraderStrategy(Strategy):
+    """
+    Misjudge every message: each AI's factor is scaled by a random amount within `noise`,
+    drawn from a generator seeded by the session and the message so a replay gives the same quotes.
+    """
+    defaults = {
+        'adjustment_factor': str(rules.ADJUSTMENT_FACTOR),
+        'noise': '1.00',
+        'uncertainty_factor': str(rules.UNCERTAINTY_FACTOR),
+    }
+
+    def on_message(self, states, context):
+        rng = np.random.default_rng(context.seed)
+        scale = 1 + float(self.param('noise')) * rng.uniform(-1, 1, size=len(states.ev_units))
+        factor = np.rint(float(rules.factor_units(self.param('adjustment_factor'))) * scale).astype(np.int64)
+
+        ev_units = rules.adjust_ev_many(states.ev_units, context.initial_price, context.impact_type, factor)
+        bids, offers = rules.quote_around_many(ev_units, self.param('uncertainty_factor'))
+        return ev_units, bids, offers
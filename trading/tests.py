@@ -1,16 +1,35 @@
 from django.test import TestCase, Client
 from django.contrib.auth.models import User
-from .models import Player, Trade, AIPlayer, GameSession, Message
+from .models import Player, Trade, AIPlayer, GameSession, Message, TraderLedger, SessionMessage, SimulationRun, Order, StrategyParameters, IdempotencyKey
 from django.urls import reverse
 from .forms import BidOfferForm
 from django.utils import timezone
 import logging
 from .views import start_game_session
+from .sampling import MessagePool, sample_message_ids, POOL_TIMEOUT
+from .simulation import simulate_game, simulate_games, save_results
+from .clock import GameClock
+from .events import EventHub, hub
+from .orderbook import OrderBook
+from . import montecarlo
+from django.test import override_settings, TransactionTestCase, skipUnlessDBFeature
+import threading
+from django.core.exceptions import ValidationError
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Sum
+from . import rules, strategies, session_pool, reaper, state, api, log
+from asgiref.sync import sync_to_async
 from decimal import Decimal
-from django.core.management import call_command
+from django.core.management import call_command, CommandError
+import math
 import random
 from unittest.mock import patch, mock_open
 import json 
+import sys
+import asyncio
+import numpy as np
 
 # Create a logger object
 logger = logging.getLogger('trading')
@@ -747,6 +766,12 @@ class GetNextMessageViewTestCase_ActiveGameSession(TestCase):
         self.game_session = GameSession.objects.create(active=True, initial_price=Decimal('75.00'))
         self.inactive_game_session = GameSession.objects.create(active=False, initial_price=Decimal('75.00'))
 
+        # Requests come from a player of the session
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        self.player.games.add(self.game_session)
+        self.client.force_login(self.user)
+
     def test_no_game_session_id(self):
         # Test the scenario where game_session_id is not provided in the AJAX request
         response = self.client.get(self.url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
@@ -766,6 +791,21 @@ class GetNextMessageViewTestCase_ActiveGameSession(TestCase):
         params = {'game_session_id': self.game_session.id}
         response = self.client.get(self.url, params, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
         self.assertEqual(response.status_code, 200)
+
+    def test_non_member_cannot_release(self):
+        # Another player's session is not found, and none of its messages is released
+        outsider = User.objects.create_user(username='outsider', password='testpass')
+        Player.objects.create(user=outsider)
+        self.client.force_login(outsider)
+
+        params = {'game_session_id': self.game_session.id}
+        response = self.client.get(self.url, params, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(self.game_session.deck.filter(release_timestamp__isnull=False).exists())
+
+        self.client.logout()
+        response = self.client.get(self.url, params, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 404)
     
 class MessageTimer(TestCase):
 
@@ -782,12 +822,18 @@ class MessageTimer(TestCase):
         # Create an active GameSession instance
         self.game_session = GameSession.objects.create(active=True, initial_price=Decimal('75.00'))
 
+        # Requests come from a player of the session
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        self.player.games.add(self.game_session)
+        self.client.force_login(self.user)
+
     def test_less_than_20_seconds(self):
-        # Update the release timestamp of the last message to be 10 seconds ago
-        last_message = self.game_session.messages.last()
+        # Release the first message of the deck 10 seconds ago
+        first_entry = self.game_session.next_deck_entry()
         ten_seconds_ago = timezone.now() - timezone.timedelta(seconds=10)
-        last_message.release_timestamp = ten_seconds_ago
-        last_message.save()
+        first_entry.release_timestamp = ten_seconds_ago
+        first_entry.save()
 
         response = self.client.get(self.url, {'game_session_id': self.game_session.id}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
         self.assertEqual(response.status_code, 400)
@@ -808,27 +854,34 @@ class MessageReleaseTest(TestCase):
         # Create an active GameSession instance
         self.game_session = GameSession.objects.create(active=True, initial_price=Decimal('75.00'))
 
-        # Release the first four messages
-        for message in list(self.game_session.messages.all())[:4]:
-            message.release_timestamp = timezone.now()
-            message.save()
+        # Requests come from a player of the session
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        self.player.games.add(self.game_session)
+        self.client.force_login(self.user)
+
+        # Release the first four messages of the deck, the last one more than 20 seconds ago
+        released_at = timezone.now() - timezone.timedelta(seconds=30)
+        for entry in self.game_session.deck.order_by('sequence')[:4]:
+            entry.release_timestamp = released_at
+            entry.save()
     
     def test_message_release(self):
-        unreleased_before = [message for message in self.game_session.messages.all() if message.release_timestamp is None]
-        self.assertEqual(len(unreleased_before), 4)
+        unreleased_before = self.game_session.deck.filter(release_timestamp__isnull=True).count()
+        self.assertEqual(unreleased_before, 4)
 
         response = self.client.get(self.url, {'game_session_id': self.game_session.id}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
         self.assertNotIn('All messages for this session have been used.', str(response.content))
 
-        unreleased_after = [message for message in self.game_session.messages.all() if message.release_timestamp is None]
-        self.assertEqual(len(unreleased_after), 3)
+        unreleased_after = self.game_session.deck.filter(release_timestamp__isnull=True).count()
+        self.assertEqual(unreleased_after, 3)
 
     def test_no_more_messages(self):
         # Simulate releasing all messages with a 20-second interval between each one
-        current_timestamp = timezone.now()
-        for message in self.game_session.messages.all():
-            message.release_timestamp = current_timestamp
-            message.save()
+        current_timestamp = timezone.now() - timezone.timedelta(seconds=20)
+        for entry in self.game_session.deck.all():
+            entry.release_timestamp = current_timestamp
+            entry.save()
             current_timestamp -= timezone.timedelta(seconds=20)
 
         response = self.client.get(self.url, {'game_session_id': self.game_session.id}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
@@ -1233,4 +1286,1832 @@ class MessageReleaseFull(TestCase):
         self.assertIn('ai_bid', json_data)
         self.assertIn('ai_offer', json_data)
         self.assertEqual(Decimal(json_data['ai_bid']), self.ai_player.bid)
-        self.assertEqual(Decimal(json_data['ai_offer']), self.ai_player.offer)
\ No newline at end of file
+        self.assertEqual(Decimal(json_data['ai_offer']), self.ai_player.offer)
+
+
+class TraderLedgerTestCase(TestCase):
+    def setUp(self):
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard")
+        self.game_session = GameSession.objects.create(initial_price=Decimal('70.00'))
+        self.player.games.add(self.game_session)
+
+    def test_trades_update_ledger(self):
+        # Player buys 2000 at $70, then sells 1000 at $75
+        Trade.objects.create(game_session=self.game_session, buyer=self.player, seller=self.ai_player, price=70, quantity=2000)
+        Trade.objects.create(game_session=self.game_session, buyer=self.ai_player, seller=self.player, price=75, quantity=1000)
+
+        ledger = TraderLedger.for_trader(self.player, self.game_session)
+        self.assertEqual(ledger.position, 1000)
+        self.assertEqual(ledger.cash_flow, -65000)
+        self.assertEqual(ledger.buy_trades_count, 1)
+        self.assertEqual(ledger.sell_trades_count, 1)
+
+        ai_ledger = TraderLedger.for_trader(self.ai_player, self.game_session)
+        self.assertEqual(ai_ledger.position, -1000)
+        self.assertEqual(ai_ledger.cash_flow, 65000)
+
+    def test_initiate_trade_updates_ledger(self):
+        self.ai_player.initiate_trade(self.player, "sell", Decimal('71.50'), self.game_session)
+
+        ledger = TraderLedger.for_trader(self.player, self.game_session)
+        self.assertEqual(ledger.position, 2000)
+        self.assertEqual(ledger.cash_flow, Decimal('-143000.00'))
+
+    def test_empty_ledger_for_new_trader(self):
+        ledger = TraderLedger.for_trader(self.player, self.game_session)
+        self.assertIsNone(ledger.pk)
+        self.assertEqual(ledger.position, 0)
+        self.assertEqual(ledger.cash_flow, 0)
+
+    def test_reconcile(self):
+        Trade.objects.create(game_session=self.game_session, buyer=self.player, seller=self.ai_player, price=70, quantity=2000)
+        self.assertEqual(TraderLedger.reconcile(self.game_session), [])
+
+        # Corrupt the ledger and check the mismatch is reported
+        TraderLedger.objects.filter(trader=self.player).update(position=0)
+        mismatches = TraderLedger.reconcile(self.game_session)
+        self.assertEqual(len(mismatches), 1)
+        ledger, field, ledger_value, expected_value = mismatches[0]
+        self.assertEqual(field, 'position')
+        self.assertEqual(ledger_value, 0)
+        self.assertEqual(expected_value, 2000)
+
+    def test_reconcile_reports_missing_ledger(self):
+        Trade.objects.create(game_session=self.game_session, buyer=self.player, seller=self.ai_player, price=70, quantity=2000)
+        TraderLedger.objects.filter(trader=self.ai_player).delete()
+
+        mismatches = TraderLedger.reconcile(self.game_session)
+        self.assertTrue(mismatches)
+        self.assertTrue(all(ledger.trader_id == self.ai_player.id for ledger, *_ in mismatches))
+
+
+class SessionDeckTestCase(TestCase):
+    def setUp(self):
+        for i in range(10):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+
+        self.game_session = GameSession.objects.create(initial_price=Decimal('70.00'))
+
+    def test_deck_has_fixed_release_order(self):
+        sequences = list(self.game_session.deck.order_by('sequence').values_list('sequence', flat=True))
+        self.assertEqual(sequences, list(range(8)))
+
+    def test_next_deck_entry_follows_sequence(self):
+        first_entry = self.game_session.next_deck_entry()
+        self.assertEqual(first_entry.sequence, 0)
+
+        first_entry.release_timestamp = timezone.now()
+        first_entry.save()
+
+        self.assertEqual(self.game_session.next_deck_entry().sequence, 1)
+        self.assertEqual(self.game_session.last_released_entry(), first_entry)
+
+    def test_release_state_is_per_session(self):
+        other_session = GameSession.objects.create(initial_price=Decimal('70.00'))
+
+        # Release every message in the first session
+        self.game_session.deck.update(release_timestamp=timezone.now())
+
+        # The second session's deck is unaffected, even for messages both sessions drew
+        self.assertIsNone(self.game_session.next_deck_entry())
+        self.assertEqual(other_session.deck.filter(release_timestamp__isnull=True).count(), 8)
+
+    def test_reset_messages_only_touches_the_session_deck(self):
+        self.game_session.deck.update(release_timestamp=timezone.now())
+        GameSession.reset_messages_for_game_session(self.game_session)
+
+        self.assertEqual(SessionMessage.objects.filter(game_session=self.game_session, release_timestamp__isnull=True).count(), 8)
+
+
+class MessageSamplingTestCase(TestCase):
+    def setUp(self):
+        for i in range(6):
+            Message.objects.create(content=f"Bullish Message {i}", impact_type="bullish", impact_value=i + 1)
+        for i in range(6):
+            Message.objects.create(content=f"Bearish Message {i}", impact_type="bearish", impact_value=i + 1)
+
+    def test_draw_distinct_ids(self):
+        message_ids = sample_message_ids(8, rng=random.Random(1))
+        self.assertEqual(len(message_ids), 8)
+        self.assertEqual(len(set(message_ids)), 8)
+
+    def test_draw_is_repeatable_for_a_seed(self):
+        self.assertEqual(sample_message_ids(8, rng=random.Random(7)), sample_message_ids(8, rng=random.Random(7)))
+
+    def test_weighted_draw_by_impact_type(self):
+        message_ids = sample_message_ids(4, rng=random.Random(3), weighted=True, impact_type="bearish")
+        self.assertEqual(len(set(message_ids)), 4)
+        self.assertFalse(Message.objects.filter(pk__in=message_ids).exclude(impact_type="bearish").exists())
+
+        with self.assertRaises(ValueError):
+            sample_message_ids(7, weighted=True, impact_type="bearish")
+
+    def test_pool_refreshes_after_populate_messages(self):
+        version = MessagePool.current().version
+        with patch('builtins.open', mock_open(read_data="Content,Impact_Type,Impact_Value\nNew message,bullish,4.00\n")):
+            call_command('populate_messages', 'fake_file_path.csv')
+
+        pool = MessagePool.current()
+        self.assertNotEqual(pool.version, version)
+        self.assertIn(Message.objects.get(content="New message").id, pool.ids)
+
+    def test_pool_expires_without_a_version_bump(self):
+        pool = MessagePool.current()
+
+        # bulk_create skips Message.save, like a catalog change made by another process's cache
+        message = Message.objects.bulk_create([Message(content="Unseen", impact_type="bullish", impact_value=3)])[0]
+        self.assertIs(MessagePool.current(), pool)
+
+        with patch('trading.sampling.time.time', return_value=pool.expires_at):
+            refreshed = MessagePool.current()
+        self.assertEqual(refreshed.version, pool.version)
+        self.assertIn(message.id, refreshed.ids)
+
+    def test_stale_pool_is_rebuilt(self):
+        MessagePool.current()
+
+        # A raw delete leaves the cached pool pointing at missing messages
+        Message.objects.filter(impact_type="bearish")._raw_delete(Message.objects.db)
+        message_ids = sample_message_ids(6, rng=random.Random(5))
+        self.assertEqual(set(message_ids), set(Message.objects.values_list('id', flat=True)))
+
+    def test_deck_is_assigned_in_one_insert(self):
+        MessagePool.current()
+        game_session = GameSession.objects.create(initial_price=Decimal('70.00'))
+        game_session.deck.all().delete()
+
+        # One query to check the drawn ids still exist, one to insert the deck, one to store its price path
+        with self.assertNumQueries(3):
+            game_session.assign_random_messages()
+        self.assertEqual(game_session.deck.count(), 8)
+
+
+class SimulationTestCase(TestCase):
+    def setUp(self):
+        for i in range(10):
+            Message.objects.create(content=f"Bullish Message {i}", impact_type="bullish", impact_value=i + 1)
+            Message.objects.create(content=f"Bearish Message {i}", impact_type="bearish", impact_value=i + 1)
+
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user, bid=Decimal('72.00'), offer=Decimal('76.00'))
+
+    def play_database_game(self, seed, style="standard"):
+        # Play a whole game through the models, the way get_next_message does it
+        ai_player = AIPlayer.objects.create(name=f"AI {seed}", style=style)
+        game_session = GameSession.objects.create(initial_price=Decimal('70.00'))
+        game_session.deck.all().delete()
+        game_session.assign_random_messages(rng=random.Random(seed))
+        game_session.ai_players.add(ai_player)
+        self.player.games.add(game_session)
+
+        for _ in range(GameSession.DECK_SIZE):
+            game_session.release_next_message(self.player)
+
+        game_session.finish()
+        self.player.games.remove(game_session)
+        return game_session, AIPlayer.objects.get(pk=ai_player.pk)
+
+    def test_simulation_matches_database_game(self):
+        catalog = MessagePool.current()
+        trades = 0
+
+        for seed in range(5):
+            game_session, ai_player = self.play_database_game(seed)
+            ledger = TraderLedger.for_trader(self.player, game_session)
+            result = simulate_game(seed, catalog, player_bid=self.player.bid, player_offer=self.player.offer)
+
+            self.assertEqual(result.message_ids, list(game_session.deck.order_by('sequence').values_list('message_id', flat=True)))
+            self.assertEqual(result.final_price, game_session.trade_out_price)
+            self.assertEqual(result.ai_ev, ai_player.current_ev)
+            self.assertEqual(result.ai_bid, ai_player.bid)
+            self.assertEqual(result.ai_offer, ai_player.offer)
+            self.assertEqual(result.player_position, ledger.position)
+            self.assertEqual(result.player_cash_flow, ledger.cash_flow)
+            trades += result.trades
+
+        # The player's quotes are close enough to the price for the AI to trade against them
+        self.assertGreater(trades, 0)
+
+    def test_simulation_plays_style_with_stored_parameters(self):
+        StrategyParameters.objects.create(style="momentum", parameters={'boost': '1.00'})
+        parameters = StrategyParameters.for_styles(["momentum"])["momentum"]
+        catalog = MessagePool.current()
+
+        for seed in range(3):
+            game_session, ai_player = self.play_database_game(seed, style="momentum")
+            result = simulate_game(seed, catalog, player_bid=self.player.bid, player_offer=self.player.offer,
+                                   style="momentum", parameters=parameters)
+
+            self.assertEqual(result.ai_ev, ai_player.current_ev)
+            self.assertEqual((result.ai_bid, result.ai_offer), (ai_player.bid, ai_player.offer))
+            self.assertEqual(result.player_position, TraderLedger.for_trader(self.player, game_session).position)
+
+        # The stored boost makes the AI react differently from the standard strategy
+        self.assertNotEqual(simulate_game(0, catalog, style="momentum", parameters=parameters).ai_ev, simulate_game(0, catalog).ai_ev)
+
+    def test_process_pool_matches_serial_run(self):
+        catalog = MessagePool.current()
+        params = {'player_bid': Decimal('72.00'), 'player_offer': Decimal('76.00')}
+
+        serial = simulate_games(range(40), catalog, workers=1, **params)
+        pooled = simulate_games(range(40), catalog, workers=2, chunk_size=10, **params)
+
+        self.assertEqual([(r.seed, r.final_price, r.player_pnl) for r in serial], [(r.seed, r.final_price, r.player_pnl) for r in pooled])
+
+    def test_save_results_in_bulk(self):
+        results = simulate_games(range(25), MessagePool.current(), workers=1)
+
+        with self.assertNumQueries(4):
+            run = save_results(results, label='test')
+
+        self.assertEqual(run.games, 25)
+        self.assertEqual(run.simulated_games.count(), 25)
+
+    def test_simulate_games_command(self):
+        call_command('simulate_games', games=20, workers=1, label='command', stdout=open('/dev/null', 'w'))
+        self.assertEqual(SimulationRun.objects.get(label='command').simulated_games.count(), 20)
+
+
+class GameClockTestCase(TestCase):
+    def setUp(self):
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard")
+        self.game_session = GameSession.objects.create(initial_price=Decimal('70.00'))
+        self.game_session.ai_players.add(self.ai_player)
+        self.game_session.players.add(self.player)
+        self.player.games.add(self.game_session)
+
+        # Drive the clock with a fake time source
+        self.now = 1000.0
+        self.clock = GameClock(interval=20, workers=1, clock=lambda: self.now)
+
+    def released_count(self):
+        return self.game_session.deck.filter(release_timestamp__isnull=False).count()
+
+    def test_releases_on_schedule(self):
+        self.clock.scan()
+        self.assertEqual(self.clock.run_pending(), 1)
+        self.assertEqual(self.released_count(), 1)
+
+        # Nothing is due until the interval has passed
+        self.now += 10
+        self.assertEqual(self.clock.run_pending(), 0)
+
+        # Move the release timestamp back as if 20 real seconds had passed
+        self.game_session.deck.filter(release_timestamp__isnull=False).update(release_timestamp=timezone.now() - timezone.timedelta(seconds=20))
+        self.now += 10
+        self.assertEqual(self.clock.run_pending(), 1)
+        self.assertEqual(self.released_count(), 2)
+
+        self.ai_player.refresh_from_db()
+        self.assertNotEqual(self.ai_player.current_ev, Decimal('0.00'))
+
+    def test_finished_session_is_dropped(self):
+        self.clock.scan()
+        self.game_session.finish()
+
+        self.clock.run_pending()
+        self.assertEqual(self.clock.metrics()['scheduled_sessions'], 0)
+        self.assertEqual(self.clock.releases, 0)
+
+    def test_scan_finds_sessions_created_before_the_last_seen(self):
+        self.clock.scan()
+
+        # Created before the scan, but committed only after it
+        late = GameSession.objects.create(initial_price=Decimal('70.00'))
+        GameSession.objects.filter(pk=late.pk).update(created_at=timezone.now() - timezone.timedelta(minutes=5))
+
+        # A session whose whole deck is out is left alone
+        dealt_out = GameSession.objects.create(initial_price=Decimal('70.00'))
+        GameSession.objects.filter(pk=dealt_out.pk).update(messages_released=GameSession.DECK_SIZE)
+
+        self.clock.scan()
+        self.assertEqual(self.clock.metrics()['scheduled_sessions'], 2)
+        self.assertEqual(self.clock.run_pending(), 2)
+
+    def test_metrics_record_lag(self):
+        self.clock.scan()
+        self.now += 3
+        self.clock.run_pending()
+
+        metrics = self.clock.metrics()
+        self.assertEqual(metrics['releases'], 1)
+        self.assertAlmostEqual(metrics['lag_max'], 3)
+
+    @override_settings(GAME_CLOCK_ENABLED=True)
+    def test_standalone_clock_refuses_to_run_next_to_web_clock(self):
+        with self.assertRaises(CommandError):
+            call_command('run_game_clock', stdout=open('/dev/null', 'w'), stderr=open('/dev/null', 'w'))
+
+    @override_settings(GAME_CLOCK_ENABLED=True)
+    def test_view_only_reads_when_clock_enabled(self):
+        self.client.force_login(self.user)
+        params = {'game_session_id': self.game_session.id}
+
+        response = self.client.get('/get_next_message/', params, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.released_count(), 0)
+
+        release = self.game_session.release_next_message()
+        response = self.client.get('/get_next_message/', params, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['message_content'], release.entry.message.content)
+        self.assertEqual(self.released_count(), 1)
+
+
+class EventHubTestCase(TestCase):
+    def setUp(self):
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard")
+        self.game_session = GameSession.objects.create(initial_price=Decimal('70.00'))
+        self.game_session.ai_players.add(self.ai_player)
+        self.game_session.players.add(self.player)
+        self.player.games.add(self.game_session)
+
+    def test_subscribers_receive_published_events(self):
+        async def scenario():
+            event_hub = EventHub()
+            subscription = event_hub.subscribe(1)
+            other = event_hub.subscribe(2)
+            event_hub.publish(1, 'quote_changed', {'bid': '1.00'})
+            event = await asyncio.wait_for(subscription.get(), timeout=1)
+            self.assertEqual(event['type'], 'quote_changed')
+            self.assertTrue(other._queue.empty())
+
+            event_hub.unsubscribe(subscription)
+            self.assertEqual(event_hub.connection_count(1), 0)
+            self.assertEqual(event_hub.connection_count(), 1)
+
+        asyncio.run(scenario())
+
+    def test_slow_subscriber_drops_oldest_events(self):
+        async def scenario():
+            event_hub = EventHub()
+            subscription = event_hub.subscribe(1)
+            subscription._queue = asyncio.Queue(maxsize=2)
+            for i in range(3):
+                event_hub.publish(1, 'trade_filled', {'trade_id': i})
+            await asyncio.sleep(0)
+
+            self.assertEqual(subscription.dropped, 1)
+            self.assertEqual((await subscription.get())['data']['trade_id'], 1)
+
+        asyncio.run(scenario())
+
+    def test_events_published_on_commit_and_polled(self):
+        self.client.force_login(self.user)
+        url = reverse('poll_events', args=[self.game_session.id])
+        after = hub.publish(self.game_session.id, 'test', {})['id']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            release = self.game_session.release_next_message(self.player)
+
+        response = self.client.get(url, {'after': after})
+        data = response.json()
+        self.assertEqual([event['type'] for event in data['events']], ['message_released', 'quotes_changed'])
+        self.assertEqual(data['events'][0]['data']['message_content'], release.entry.message.content)
+        self.assertEqual(data['last_event_id'], data['events'][-1]['id'])
+
+        response = self.client.get(url, {'after': data['last_event_id']})
+        self.assertEqual(response.json()['events'], [])
+
+    def test_events_are_private_to_session_players(self):
+        other_user = User.objects.create_user(username='otheruser', password='testpass')
+        Player.objects.create(user=other_user)
+        self.client.force_login(other_user)
+
+        response = self.client.get(reverse('poll_events', args=[self.game_session.id]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_stream_replays_missed_events(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        event = hub.publish(self.game_session.id, 'quote_changed', {'name': 'AIPlayer1'})
+
+        response = await self.async_client.get(
+            reverse('session_events', args=[self.game_session.id]),
+            headers={'Last-Event-ID': str(event['id'] - 1)},
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunk = await response.streaming_content.__anext__()
+        await response.streaming_content.aclose()
+        self.assertIn(b'event: quote_changed', chunk)
+        self.assertIn(f"id: {event['id']}".encode(), chunk)
+
+
+class OrderBookTestCase(TestCase):
+    def test_price_time_priority(self):
+        book = OrderBook()
+        book.add(1, 10, 'sell', Decimal('71.00'), 100)
+        book.add(2, 11, 'sell', Decimal('70.50'), 100)
+        book.add(3, 12, 'sell', Decimal('70.50'), 100)
+        self.assertEqual(book.best_offer(), Decimal('70.50'))
+
+        result = book.submit(4, 20, 'buy', Decimal('71.00'), 250)
+        self.assertEqual([(fill.maker_id, fill.price, fill.quantity) for fill in result.fills],
+                         [(2, Decimal('70.50'), 100), (3, Decimal('70.50'), 100), (1, Decimal('71.00'), 50)])
+        self.assertEqual(result.remaining, 0)
+        self.assertEqual(book.best_offer(), Decimal('71.00'))
+        self.assertEqual(book.remaining(1), 50)
+
+    def test_unfilled_quantity_rests(self):
+        book = OrderBook()
+        book.add(1, 10, 'sell', Decimal('72.00'), 100)
+        result = book.submit(2, 20, 'buy', Decimal('71.00'), 300)
+
+        self.assertEqual(result.fills, [])
+        self.assertEqual(book.best_bid(), Decimal('71.00'))
+        self.assertEqual(book.depth(), {'bids': [(Decimal('71.00'), 300, 1)], 'offers': [(Decimal('72.00'), 100, 1)]})
+
+    def test_cancel_removes_level(self):
+        book = OrderBook()
+        book.add(1, 10, 'buy', Decimal('69.00'), 100)
+        book.add(2, 11, 'buy', Decimal('68.00'), 100)
+
+        self.assertEqual(book.cancel(1), 100)
+        self.assertEqual(book.cancel(1), 0)
+        self.assertEqual(book.best_bid(), Decimal('68.00'))
+
+        # A level that comes back at a cancelled price is found again
+        book.add(3, 12, 'buy', Decimal('69.00'), 50)
+        self.assertEqual(book.best_bid(), Decimal('69.00'))
+        self.assertEqual(len(book), 2)
+
+    def test_self_trade_cancels_resting_order(self):
+        book = OrderBook()
+        book.add(1, 10, 'sell', Decimal('70.00'), 100)
+        book.add(2, 11, 'sell', Decimal('70.00'), 100)
+
+        result = book.submit(3, 10, 'buy', Decimal('70.00'), 100)
+        self.assertEqual(result.cancelled, [1])
+        self.assertEqual([(fill.maker_id, fill.seller_id) for fill in result.fills], [(2, 11)])
+        self.assertEqual(book.best_offer(), None)
+
+
+class SessionOrderTestCase(TestCase):
+    def setUp(self):
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard")
+        self.game_session = GameSession.objects.create(initial_price=Decimal('70.00'))
+        self.game_session.players.add(self.player)
+        self.player.games.add(self.game_session)
+
+    def test_matching_creates_trades_of_any_quantity(self):
+        self.game_session.submit_order(self.ai_player, 'sell', Decimal('70.00'), 500)
+        order, trades = self.game_session.submit_order(self.player, 'buy', Decimal('71.00'), 800)
+
+        self.assertEqual(len(trades), 1)
+        self.assertEqual(trades[0].quantity, 500)
+        self.assertEqual(trades[0].price, Decimal('70.00'))
+        self.assertEqual(trades[0].buyer_id, self.player.id)
+        self.assertEqual(order.remaining, 300)
+        self.assertEqual(order.status, Order.OPEN)
+        self.assertEqual(Order.objects.get(trader=self.ai_player).status, Order.FILLED)
+        self.assertEqual(TraderLedger.for_trader(self.player, self.game_session).position, 500)
+
+    def test_book_is_rebuilt_when_another_process_changed_it(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.game_session.submit_order(self.ai_player, 'sell', Decimal('70.00'), 500)
+        self.assertEqual(self.game_session.order_book().best_offer(), Decimal('70.00'))
+
+        # Another process fills the order and bumps the version
+        other = GameSession.objects.get(pk=self.game_session.pk)
+        Order.objects.update(status=Order.FILLED, remaining=0)
+        GameSession.objects.filter(pk=other.pk).update(book_version=other.book_version + 1)
+
+        self.game_session.refresh_from_db()
+        self.assertIsNone(self.game_session.order_book().best_offer())
+
+    def test_cancel_order(self):
+        order, _ = self.game_session.submit_order(self.player, 'buy', Decimal('69.00'), 100)
+        self.assertTrue(self.game_session.cancel_order(order))
+        self.assertFalse(self.game_session.cancel_order(order))
+        self.assertEqual(Order.objects.get(pk=order.pk).status, Order.CANCELLED)
+        self.assertEqual(self.game_session.depth_data(), {'bids': [], 'offers': []})
+
+    def test_order_views(self):
+        self.client.force_login(self.user)
+        self.game_session.submit_order(self.ai_player, 'sell', Decimal('70.00'), 500)
+
+        response = self.client.post(reverse('submit_order'), {'side': 'buy', 'price': '70.00', 'quantity': 200})
+        data = response.json()
+        self.assertEqual(data['trades'][0]['quantity'], 200)
+        self.assertEqual(data['order']['status'], Order.FILLED)
+
+        response = self.client.get(reverse('order_book', args=[self.game_session.id]))
+        self.assertEqual(response.json()['offers'], [{'price': '70.00', 'quantity': 300, 'orders': 1}])
+
+        response = self.client.post(reverse('submit_order'), {'side': 'buy', 'price': '-1', 'quantity': 200})
+        self.assertEqual(response.status_code, 400)
+
+
+class SessionTopOfBookTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard", bid=60, offer=80)
+        self.game_session = GameSession.objects.create(initial_price=Decimal('70.00'))
+        self.game_session.ai_players.add(self.ai_player)
+        self.game_session.players.add(self.player)
+        self.player.games.add(self.game_session)
+
+        # An AI player in no session of this player, whose quotes would cross
+        AIPlayer.objects.create(name="Outsider", style="standard", bid=75, offer=65)
+
+    def test_membership_change_drops_top_of_book(self):
+        self.assertEqual(self.game_session.top_of_book(), (Decimal('60.00'), Decimal('80.00')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.game_session.ai_players.remove(self.ai_player)
+        self.assertEqual(self.game_session.top_of_book(), (None, None))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ai_player.game_sessions.add(self.game_session)
+        self.assertEqual(self.game_session.top_of_book(), (Decimal('60.00'), Decimal('80.00')))
+
+    def test_quotes_set_by_hand_drop_top_of_book(self):
+        self.game_session.top_of_book()
+
+        self.ai_player.bid = Decimal('61.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ai_player.save()
+        self.assertEqual(self.game_session.top_of_book(), (Decimal('61.00'), Decimal('80.00')))
+
+    def test_validation_reads_session_quotes_without_queries(self):
+        self.game_session.top_of_book()
+
+        form = BidOfferForm(data={'bid': 70, 'offer': 72}, game_session=self.game_session)
+        with self.assertNumQueries(0):
+            self.assertTrue(form.is_valid())
+
+        form = BidOfferForm(data={'bid': 80, 'offer': 85}, game_session=self.game_session)
+        self.assertFalse(form.is_valid())
+
+    def test_release_elsewhere_keeps_top_of_book(self):
+        other_session = GameSession.objects.create(initial_price=Decimal('70.00'))
+        other_session.ai_players.add(self.ai_player)
+        self.assertEqual(self.game_session.top_of_book(), (Decimal('60.00'), Decimal('80.00')))
+
+        # This session still shows the quotes it last published, until its own next release
+        with self.captureOnCommitCallbacks(execute=True):
+            other_session.release_next_message()
+        self.assertEqual(self.game_session.top_of_book(), (Decimal('60.00'), Decimal('80.00')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            release = self.game_session.release_next_message()
+        self.assertEqual(self.game_session.top_of_book(), (release.ai_player.bid, release.ai_player.offer))
+
+    def test_release_writes_top_of_book_through(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            release = self.game_session.release_next_message(self.player)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.game_session.top_of_book(), (release.ai_player.bid, release.ai_player.offer))
+
+    def test_update_bid_offer_uses_session_market(self):
+        self.client.force_login(self.user)
+
+        response = self.client.post('/update_bid_offer/', {'bid': 70, 'offer': 72})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post('/update_bid_offer/', {'bid': 50, 'offer': 60})
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkAIReactionTestCase(TestCase):
+    def setUp(self):
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user, bid=Decimal('60.00'), offer=Decimal('71.00'))
+        self.game_session = GameSession.objects.create(initial_price=Decimal('70.00'))
+        self.game_session.players.add(self.player)
+
+    def add_ai_players(self, count):
+        ai_players = [AIPlayer.objects.create(name=f"AI {i}", style="standard", current_ev=Decimal('70.00') + i) for i in range(count)]
+        self.game_session.ai_players.add(*ai_players)
+
+    def test_every_ai_moves_its_ev_once(self):
+        self.add_ai_players(3)
+        self.game_session.release_next_message(self.player)
+
+        for i, ai_player in enumerate(AIPlayer.objects.order_by('id')):
+            expected_ev = rules.quantize_ev((Decimal('70.00') + i) * (1 + rules.ADJUSTMENT_FACTOR))
+            self.assertEqual(ai_player.current_ev, expected_ev)
+            self.assertEqual((ai_player.bid, ai_player.offer), tuple(rules.quantize_price(quote) for quote in rules.quote_around(expected_ev)))
+
+    def test_reaction_builds_on_evs_written_after_loading(self):
+        self.add_ai_players(1)
+        ai_players = list(self.game_session.ai_players.all())
+
+        # Another session's release commits after these rows were loaded
+        AIPlayer.objects.filter(pk=ai_players[0].pk).update(current_ev=Decimal('80.00'))
+        AIPlayer.react_in_bulk(ai_players, self.game_session, Message.objects.first())
+
+        expected_ev = rules.quantize_ev(Decimal('80.00') * (1 + rules.ADJUSTMENT_FACTOR))
+        self.assertEqual(AIPlayer.objects.get(pk=ai_players[0].pk).current_ev, expected_ev)
+        self.assertEqual(ai_players[0].current_ev, expected_ev)
+
+    def test_players_offer_is_lifted_once_by_the_highest_ev(self):
+        self.add_ai_players(3)
+        release = self.game_session.release_next_message(self.player)
+
+        self.assertEqual(len(release.trades), 1)
+        self.assertEqual(release.trades[0].buyer_id, AIPlayer.objects.get(name="AI 2").id)
+        self.assertEqual(release.trades[0].price, Decimal('71.00'))
+
+    def test_queries_do_not_grow_with_ai_players(self):
+        self.player.bid = self.player.offer = Decimal('0.00')
+        self.player.save()
+
+        def release_queries(count):
+            AIPlayer.objects.all().delete()
+            self.add_ai_players(count)
+            self.game_session.deck.update(release_timestamp=None)
+            with CaptureQueriesContext(connection) as queries:
+                self.game_session.release_next_message(self.player)
+            return len(queries)
+
+        self.assertEqual(release_queries(1), release_queries(50))
+
+
+class StrategyTestCase(TestCase):
+    def context(self, impact_type="bullish", history=("bullish",), seed=0):
+        return strategies.MarketContext(Decimal('70.00'), impact_type, Decimal('5.00'), history, seed)
+
+    def states(self, *evs, positions=None):
+        ev_units = rules.to_fixed(evs, rules.EV_PLACES)
+        positions = np.array(positions or [0] * len(evs), dtype=np.int64)
+        return strategies.AIStates(ev_units, positions)
+
+    def test_unknown_style_plays_standard(self):
+        self.assertIsInstance(strategies.get_strategy("something else"), strategies.StandardStrategy)
+
+    def test_strategy_must_implement_on_message(self):
+        with self.assertRaises(TypeError):
+            strategies.Strategy()
+
+    def test_momentum_grows_with_streak(self):
+        strategy = strategies.get_strategy("momentum")
+        first, _, _ = strategy.on_message(self.states('70.00'), self.context(history=("bullish",)))
+        third, _, _ = strategy.on_message(self.states('70.00'), self.context(history=("bullish", "bullish", "bullish")))
+        self.assertGreater(third[0], first[0])
+
+        # Capped at max_factor
+        long_run, _, _ = strategy.on_message(self.states('70.00'), self.context(history=("bullish",) * 10))
+        self.assertEqual(rules.from_fixed(long_run, rules.EV_PLACES), [Decimal('78.4000')])
+
+    def test_mean_reversion_moves_less_than_standard(self):
+        standard, _, _ = strategies.get_strategy("standard").on_message(self.states('80.00'), self.context())
+        reverting, _, _ = strategies.get_strategy("mean_reversion").on_message(self.states('80.00'), self.context())
+        self.assertLess(reverting[0], standard[0])
+
+    def test_market_maker_skews_quotes_against_inventory(self):
+        strategy = strategies.get_strategy("market_maker", {'skew': '1.00'})
+        ev_units, bids, offers = strategy.on_message(self.states('70.00', '70.00', positions=[0, 4000]), self.context())
+
+        self.assertEqual(ev_units[0], ev_units[1])
+        self.assertLess(bids[1], bids[0])
+        self.assertLess(offers[1], offers[0])
+
+    def test_noise_is_reproducible(self):
+        strategy = strategies.get_strategy("noise")
+        first = strategy.on_message(self.states('70.00', '70.00', '70.00'), self.context(seed=[1, 2]))
+        again = strategy.on_message(self.states('70.00', '70.00', '70.00'), self.context(seed=[1, 2]))
+        self.assertEqual(first[0].tolist(), again[0].tolist())
+
+    def test_mixed_population_uses_stored_parameters(self):
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+        StrategyParameters.objects.create(style="standard", parameters={'adjustment_factor': '0.10'})
+
+        game_session = GameSession.objects.create(initial_price=Decimal('70.00'))
+        for style in ("standard", "momentum", "mean_reversion", "market_maker", "noise"):
+            game_session.ai_players.add(AIPlayer.objects.create(name=style, style=style))
+
+        game_session.release_next_message()
+
+        self.assertEqual(AIPlayer.objects.get(style="standard").current_ev, Decimal('77.0000'))
+        self.assertEqual(AIPlayer.objects.filter(current_ev=0).count(), 0)
+
+    def test_parameters_must_fit_fixed_point(self):
+        with self.assertRaises(ValidationError):
+            StrategyParameters(style="standard", parameters={'adjustment_factor': '0.00001'}).full_clean()
+
+
+class PriceDistributionTestCase(TestCase):
+    def setUp(self):
+        for i in range(10):
+            Message.objects.create(content=f"Bullish Message {i}", impact_type="bullish", impact_value=i + 1)
+            Message.objects.create(content=f"Bearish Message {i}", impact_type="bearish", impact_value=i + 1)
+
+    def test_sampled_prices_match_compounding(self):
+        catalog = MessagePool.current()
+        deck = catalog.draw(8, rng=random.Random(3))
+        expected = rules.compound_price(Decimal('70.00'), [(catalog.impact_types[i], catalog.impact_values[i]) for i in catalog.positions_of(deck)])
+
+        # With a catalog of exactly one deck there is only one outcome
+        single = MessagePool(catalog.version, deck, [catalog.impact_types[i] for i in catalog.positions_of(deck)], [catalog.impact_values[i] for i in catalog.positions_of(deck)])
+        prices = montecarlo.sample_final_prices(single, 10, initial_price=70.0)
+        self.assertAlmostEqual(prices[0], float(expected), places=6)
+        self.assertEqual(len(set(prices.round(9))), 1)
+
+    def test_mean_converges_to_exact_mean(self):
+        catalog = MessagePool.current()
+        prices = montecarlo.sample_final_prices(catalog, 200000, seed=1)
+        self.assertAlmostEqual(prices.mean(), montecarlo.exact_mean(catalog), delta=0.05)
+
+    def test_large_catalog_draws_are_uniform_and_distinct(self):
+        catalog_size, decks, deck_size = 50_000, 200_000, 8
+        deck = montecarlo.draw_decks(np.random.default_rng(0), catalog_size, decks, deck_size)
+
+        self.assertEqual(deck.shape, (decks, deck_size))
+        ordered = np.sort(deck, axis=1)
+        self.assertFalse((ordered[:, 1:] == ordered[:, :-1]).any())
+
+        # Chi-square of the position counts against a uniform draw, within 5 standard deviations of its mean
+        expected = decks * deck_size / catalog_size
+        chi_square = (((np.bincount(deck.ravel(), minlength=catalog_size) - expected) ** 2) / expected).sum()
+        self.assertLess(abs(chi_square - (catalog_size - 1)), 5 * math.sqrt(2 * (catalog_size - 1)))
+
+        # Every slot of the deck is uniform too, not only the deck as a whole
+        first = np.bincount(deck[:, 0] * 10 // catalog_size, minlength=10)
+        self.assertLess(abs(first - decks / 10).max(), 5 * math.sqrt(decks / 10))
+
+    def test_distribution_is_cached_per_catalog_version(self):
+        summary = montecarlo.price_distribution(decks=1000)
+        self.assertEqual(summary['decks'], 1000)
+        self.assertLessEqual(summary['quantiles']['0.05'], summary['quantiles']['0.95'])
+
+        with patch('trading.montecarlo.sample_final_prices') as sampler:
+            self.assertEqual(montecarlo.price_distribution(decks=1000), summary)
+            sampler.assert_not_called()
+
+        Message.objects.create(content="New Message", impact_type="bullish", impact_value=50)
+        self.assertNotEqual(montecarlo.price_distribution(decks=1000)['catalog_version'], summary['catalog_version'])
+
+
+class PricePathTestCase(TestCase):
+    def setUp(self):
+        for i in range(8):
+            Message.objects.create(content=f"Bullish Message {i}", impact_type="bullish", impact_value=i + 1)
+            Message.objects.create(content=f"Bearish Message {i}", impact_type="bearish", impact_value=i + 1)
+        self.game_session = GameSession.objects.create(initial_price=Decimal('70.00'))
+
+    def deck_impacts(self):
+        return self.game_session.deck.order_by('sequence').values_list('message__impact_type', 'message__impact_value')
+
+    def test_path_is_stored_when_deck_is_dealt(self):
+        stored = GameSession.objects.get(pk=self.game_session.pk)
+        self.assertEqual(len(stored.price_path), GameSession.DECK_SIZE)
+        self.assertEqual(stored.final_price(), rules.quantize_price(rules.compound_price(Decimal('70.00'), self.deck_impacts())))
+
+        impacts = list(self.deck_impacts())
+        self.assertEqual(stored.step_impact(1), rules.quantize_price(rules.compound_price(Decimal('70.00'), impacts[:1])) - Decimal('70.00'))
+
+    def test_fair_value_follows_releases(self):
+        self.assertEqual(self.game_session.fair_value(), Decimal('70.00'))
+
+        self.game_session.release_next_message()
+        self.game_session.release_next_message()
+        stored = GameSession.objects.get(pk=self.game_session.pk)
+        self.assertEqual(stored.messages_released, 2)
+        self.assertEqual(stored.fair_value(), Decimal(stored.price_path[1]))
+
+        stored.finish()
+        self.assertEqual(stored.trade_out_price, stored.final_price())
+        self.assertEqual(GameSession.objects.get(pk=stored.pk).fair_value(), Decimal(stored.price_path[1]))
+
+    def test_changing_messages_rebuilds_path(self):
+        self.game_session.messages.clear()
+        self.assertEqual(self.game_session.price_path, [])
+
+        self.game_session.messages.add(Message.objects.filter(impact_type="bullish").first())
+        self.assertEqual(GameSession.objects.get(pk=self.game_session.pk).price_path, ['70.70'])
+
+    def test_player_summary_reports_fair_value(self):
+        user = User.objects.create_user(username='testuser', password='testpass')
+        player = Player.objects.create(user=user)
+        player.games.add(self.game_session)
+        self.game_session.release_next_message()
+
+        self.client.force_login(user)
+        response = self.client.get(reverse('player_summary'))
+        self.assertEqual(Decimal(response.json()['fair_value']), Decimal(self.game_session.price_path[0]))
+
+    def test_player_summary_survives_finish(self):
+        user = User.objects.create_user(username='testuser', password='testpass')
+        player = Player.objects.create(user=user)
+        GameSession.add_player_to_game_session(player, self.game_session)
+        player.games.add(self.game_session)
+        self.game_session.release_next_message()
+        self.game_session.release_next_message()
+
+        self.client.force_login(user)
+        before = self.client.get(reverse('player_summary')).json()
+        GameSession.objects.get(pk=self.game_session.pk).finish()
+        after = self.client.get(reverse('player_summary')).json()
+
+        self.assertEqual(after['fair_value'], before['fair_value'])
+        self.assertEqual(Decimal(after['fair_value']), Decimal(self.game_session.price_path[1]))
+
+
+class MarkToMarketPnLTestCase(TestCase):
+    def setUp(self):
+        for i in range(8):
+            Message.objects.create(content=f"Bullish Message {i}", impact_type="bullish", impact_value=i + 1)
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard")
+        self.game_session = GameSession.objects.create(initial_price=Decimal('70.00'))
+
+    def trade(self, buyer, seller, price, quantity):
+        return Trade.objects.create(game_session=self.game_session, buyer=buyer, seller=seller, price=Decimal(price), quantity=quantity)
+
+    def ledger(self, trader):
+        return TraderLedger.for_trader(trader, self.game_session)
+
+    def test_average_cost_realized_pnl(self):
+        self.trade(self.player, self.ai_player, '70.00', 2000)
+        self.trade(self.player, self.ai_player, '72.00', 2000)
+        self.trade(self.ai_player, self.player, '75.00', 3000)
+
+        ledger = self.ledger(self.player)
+        self.assertEqual(ledger.position, 1000)
+        self.assertEqual(ledger.cost_basis, Decimal('71000.00'))
+        self.assertEqual(ledger.realized_pnl, Decimal('12000.00'))
+
+        # Reversing through zero opens a short at the fill price
+        self.trade(self.ai_player, self.player, '74.00', 2000)
+        ledger = self.ledger(self.player)
+        self.assertEqual(ledger.position, -1000)
+        self.assertEqual(ledger.cost_basis, Decimal('-74000.00'))
+        self.assertEqual(ledger.realized_pnl, Decimal('15000.00'))
+        self.assertEqual(TraderLedger.reconcile(self.game_session), [])
+
+    def test_release_marks_to_fair_value(self):
+        self.trade(self.player, self.ai_player, '70.00', 2000)
+        self.assertEqual(self.ledger(self.player).unrealized_pnl, Decimal('0.00'))
+
+        self.game_session.release_next_message()
+        fair_value = self.game_session.fair_value()
+        ledger = self.ledger(self.player)
+        self.assertEqual(ledger.mark_price, fair_value)
+        self.assertEqual(ledger.unrealized_pnl, 2000 * (fair_value - Decimal('70.00')))
+        self.assertEqual(self.ledger(self.ai_player).unrealized_pnl, -ledger.unrealized_pnl)
+
+    def test_finish_settles_at_trade_out_price(self):
+        self.trade(self.player, self.ai_player, '70.00', 2000)
+        self.game_session.finish()
+
+        ledger = self.ledger(self.player)
+        self.assertEqual(ledger.unrealized_pnl, Decimal('0.00'))
+        self.assertEqual(ledger.realized_pnl, 2000 * (self.game_session.trade_out_price - Decimal('70.00')))
+        self.assertEqual(self.player.calculate_total_pnl(self.game_session), ledger.realized_pnl)
+        self.assertEqual(TraderLedger.reconcile(self.game_session), [])
+
+
+class SessionBootstrapTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=i + 1)
+        self.player = Player.objects.create(user=User.objects.create(username='player1'))
+        self.ai_players = [AIPlayer.objects.create(name=f"AI {i}", style="standard", bid=60 + i, offer=80 - i) for i in range(3)]
+
+    def test_bootstrap_sets_up_session(self):
+        game_session = GameSession.bootstrap(self.player)
+
+        self.assertTrue(game_session.active)
+        self.assertEqual(game_session.deck.count(), GameSession.DECK_SIZE)
+        self.assertEqual(set(game_session.ai_players.all()), set(self.ai_players))
+        self.assertTrue(game_session.players.filter(pk=self.player.pk).exists())
+        self.assertTrue(self.player.games.filter(pk=game_session.pk).exists())
+
+        # The price path and best quotes match what the slower paths compute
+        stored = GameSession.objects.get(pk=game_session.pk)
+        self.assertEqual(stored.top_of_book(), (Decimal('62.00'), Decimal('78.00')))
+        stored.rebuild_price_path()
+        self.assertEqual(stored.price_path, game_session.price_path)
+
+    def test_bootstrap_finishes_previous_session(self):
+        first = GameSession.bootstrap(self.player)
+        Trade.objects.create(game_session=first, buyer=self.player, seller=self.ai_players[0], price=Decimal('70.00'), quantity=1000)
+
+        second = GameSession.bootstrap(self.player)
+        first.refresh_from_db()
+
+        self.assertFalse(first.active)
+        self.assertEqual(first.trade_out_price, first.final_price())
+        self.assertEqual(TraderLedger.for_trader(self.player, first).realized_pnl, 1000 * (first.trade_out_price - Decimal('70.00')))
+        self.assertEqual(list(self.player.games.filter(active=True)), [second])
+
+    def test_query_count_does_not_grow_with_ai_players(self):
+        # Warm the message pool and leave an active session behind to be finished
+        GameSession.bootstrap(self.player)
+        with CaptureQueriesContext(connection) as few:
+            GameSession.bootstrap(self.player)
+
+        for i in range(50):
+            AIPlayer.objects.create(name=f"Extra AI {i}", style="standard")
+        with self.assertNumQueries(len(few)):
+            game_session = GameSession.bootstrap(self.player)
+        self.assertEqual(game_session.ai_players.count(), 53)
+
+
+@override_settings(SESSION_POOL_ENABLED=True)
+class SessionPoolTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=i + 1)
+        self.player = Player.objects.create(user=User.objects.create(username='player1'))
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard", bid=60, offer=80)
+
+    def test_fill_to_high_watermark(self):
+        self.assertEqual(session_pool.fill(3), 3)
+        self.assertEqual(session_pool.fill(3), 0)
+        self.assertEqual(session_pool.depth(), 3)
+
+        pooled = GameSession.objects.filter(pooled=True).first()
+        self.assertEqual(pooled.deck.count(), GameSession.DECK_SIZE)
+        self.assertEqual(list(pooled.ai_players.all()), [self.ai_player])
+        self.assertFalse(pooled.players.exists())
+
+    def test_login_claims_oldest_pooled_session(self):
+        session_pool.fill(2)
+        oldest = GameSession.objects.filter(pooled=True).order_by('pk').first()
+        before = session_pool.metrics()
+
+        # The AI player requoted while the session waited in the pool
+        AIPlayer.objects.filter(pk=self.ai_player.pk).update(bid=65)
+
+        game_session = GameSession.bootstrap(self.player)
+        self.assertEqual(game_session.pk, oldest.pk)
+        self.assertFalse(game_session.pooled)
+        self.assertEqual(game_session.top_of_book(), (Decimal('65.00'), Decimal('80.00')))
+        self.assertTrue(self.player.games.filter(pk=game_session.pk).exists())
+        self.assertEqual(session_pool.depth(), 1)
+        self.assertEqual(session_pool.metrics()['hits'], before['hits'] + 1)
+
+    def test_empty_pool_builds_session(self):
+        before = session_pool.metrics()
+
+        game_session = GameSession.bootstrap(self.player)
+        self.assertFalse(game_session.pooled)
+        self.assertEqual(game_session.deck.count(), GameSession.DECK_SIZE)
+        self.assertEqual(session_pool.metrics()['misses'], before['misses'] + 1)
+
+    def test_filler_refills_below_low_watermark(self):
+        filler = session_pool.SessionPoolFiller(low=2, high=4)
+        self.assertEqual(filler.run_once(), 4)
+
+        GameSession.bootstrap(self.player)
+        GameSession.bootstrap(self.player)
+        self.assertEqual(filler.run_once(), 0)
+
+        GameSession.bootstrap(self.player)
+        self.assertEqual(filler.run_once(), 3)
+        self.assertEqual(filler.built, 7)
+
+    def test_clock_starts_claimed_sessions_only(self):
+        session_pool.fill(1)
+        clock = GameClock(interval=20, workers=1, clock=lambda: 1000.0)
+
+        clock.scan()
+        self.assertEqual(clock.metrics()['scheduled_sessions'], 0)
+
+        # A session built at login after the pooled one, then the pooled one claimed
+        GameSession.build()
+        clock.scan()
+        game_session = GameSession.bootstrap(self.player)
+        clock.scan()
+        self.assertEqual(clock.metrics()['scheduled_sessions'], 2)
+        self.assertEqual(clock.run_pending(), 2)
+        self.assertEqual(game_session.deck.filter(release_timestamp__isnull=False).count(), 1)
+
+
+class SessionReaperTestCase(TestCase):
+    def setUp(self):
+        for i in range(8):
+            Message.objects.create(content=f"Bullish Message {i}", impact_type="bullish", impact_value=i + 1)
+        self.player = Player.objects.create(user=User.objects.create(username='player1'))
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard")
+
+    def session(self, minutes_ago, released_minutes_ago=None):
+        game_session = GameSession.build()
+        GameSession.objects.filter(pk=game_session.pk).update(created_at=timezone.now() - timezone.timedelta(minutes=minutes_ago))
+        if released_minutes_ago is not None:
+            game_session.release_next_message()
+            game_session.deck.filter(release_timestamp__isnull=False).update(release_timestamp=timezone.now() - timezone.timedelta(minutes=released_minutes_ago))
+        return game_session
+
+    def test_reaps_idle_sessions_only(self):
+        abandoned = self.session(minutes_ago=60)
+        stale_release = self.session(minutes_ago=60, released_minutes_ago=45)
+        playing = self.session(minutes_ago=60, released_minutes_ago=1)
+        fresh = self.session(minutes_ago=1)
+        pooled = GameSession.build(pooled=True)
+        GameSession.objects.filter(pk=pooled.pk).update(created_at=timezone.now() - timezone.timedelta(minutes=60))
+
+        self.assertEqual(reaper.reap_expired_sessions(max_age=30 * 60, chunk_size=1), 2)
+
+        active = set(GameSession.objects.filter(active=True).values_list('pk', flat=True))
+        self.assertEqual(active, {playing.pk, fresh.pk, pooled.pk})
+
+        stale_release.refresh_from_db()
+        self.assertEqual(stale_release.trade_out_price, stale_release.final_price())
+        self.assertIsNotNone(stale_release.finished_at)
+
+        # The release history is kept, so the session still reports the fair value it ended on
+        self.assertEqual(stale_release.messages_released, 1)
+        self.assertEqual(stale_release.deck.filter(release_timestamp__isnull=False).count(), 1)
+
+    def test_settles_ledgers_of_reaped_sessions(self):
+        game_session = self.session(minutes_ago=60)
+        Trade.objects.create(game_session=game_session, buyer=self.player, seller=self.ai_player, price=Decimal('70.00'), quantity=1000)
+
+        call_command('reap_sessions', max_age=30 * 60)
+
+        game_session.refresh_from_db()
+        self.assertFalse(game_session.active)
+        ledger = TraderLedger.for_trader(self.player, game_session)
+        self.assertEqual(ledger.realized_pnl, 1000 * (game_session.trade_out_price - Decimal('70.00')))
+        self.assertEqual(TraderLedger.reconcile(game_session), [])
+
+    def test_chunk_query_count_does_not_grow(self):
+        for _ in range(2):
+            self.session(minutes_ago=60)
+        cutoff = timezone.now() - timezone.timedelta(minutes=30)
+        with CaptureQueriesContext(connection) as few:
+            reaper.reap_chunk(cutoff)
+
+        for _ in range(20):
+            self.session(minutes_ago=60)
+        with self.assertNumQueries(len(few)):
+            self.assertEqual(reaper.reap_chunk(cutoff), 20)
+
+
+class CurrentSessionTestCase(TestCase):
+    def setUp(self):
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=i + 1)
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        AIPlayer.objects.create(name="AIPlayer1", style="standard")
+
+    def test_bootstrap_moves_current_session(self):
+        first = GameSession.bootstrap(self.player)
+        self.assertEqual(Player.objects.get(pk=self.player.pk).current_session, first)
+
+        second = GameSession.bootstrap(self.player)
+        self.assertEqual(Player.objects.get(pk=self.player.pk).current_session, second)
+        first.refresh_from_db()
+        self.assertFalse(first.active)
+
+    def test_finish_clears_current_session(self):
+        game_session = GameSession.bootstrap(self.player)
+        game_session.finish()
+        self.assertIsNone(Player.objects.get(pk=self.player.pk).current_session)
+
+    def test_finish_is_rolled_back_as_a_whole(self):
+        game_session = GameSession.bootstrap(self.player)
+        game_session.deck.update(release_timestamp=timezone.now())
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            game_session.finish()
+            raise RuntimeError
+
+        self.assertEqual(Player.objects.get(pk=self.player.pk).current_session, game_session)
+        self.assertFalse(game_session.deck.filter(release_timestamp__isnull=True).exists())
+        self.assertTrue(GameSession.objects.get(pk=game_session.pk).active)
+
+    def test_membership_sets_current_session(self):
+        game_session = GameSession.objects.create(initial_price=Decimal('70.00'))
+        self.player.games.add(game_session)
+        self.assertEqual(Player.objects.get(pk=self.player.pk).current_session, game_session)
+
+        game_session.players.remove(self.player)
+        self.assertIsNone(Player.objects.get(pk=self.player.pk).current_session)
+
+    def test_stale_player_save_keeps_current_session(self):
+        stale = Player.objects.get(pk=self.player.pk)
+        game_session = GameSession.bootstrap(self.player)
+
+        stale.bid = Decimal('69.00')
+        stale.save()
+
+        player = Player.objects.get(pk=self.player.pk)
+        self.assertEqual(player.bid, Decimal('69.00'))
+        self.assertEqual(player.current_session, game_session)
+
+    def test_session_is_one_per_player(self):
+        game_session = GameSession.bootstrap(self.player)
+        other = Player.objects.create(user=User.objects.create(username='other'))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Player.objects.filter(pk=other.pk).update(current_session=game_session)
+
+    def test_views_resolve_session_by_primary_key(self):
+        game_session = GameSession.bootstrap(self.player)
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('game'))
+        self.assertEqual(response.context['game_session_id'], game_session.id)
+
+        self.client.get(reverse('logout_view'))
+        game_session.refresh_from_db()
+        self.assertFalse(game_session.active)
+
+
+class TradeIdentityTestCase(TestCase):
+    def setUp(self):
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard")
+        self.game_session = GameSession.bootstrap(self.player)
+
+    def trade(self, **kwargs):
+        return Trade.objects.create(game_session=self.game_session, price=Decimal('70.00'), **kwargs)
+
+    def test_identities_are_stored_on_trade(self):
+        trade = self.trade(buyer=self.player, seller=self.ai_player)
+        self.assertEqual((trade.buyer_name, trade.buyer_kind), ('testuser', Trade.PLAYER))
+        self.assertEqual((trade.seller_name, trade.seller_kind), ('AIPlayer1', Trade.AI))
+        self.assertEqual(str(trade), "Trade: testuser bought from AIPlayer1 at 70.00")
+
+        # Traders given by id are looked up together
+        trade = Trade(game_session=self.game_session, buyer_id=self.ai_player.pk, seller_id=self.player.pk, price=Decimal('70.00'))
+        with self.assertNumQueries(1):
+            trade.resolve_identities()
+        self.assertEqual(trade.feed_item()['buyer_kind'], Trade.AI)
+
+    def test_order_fills_carry_names(self):
+        self.game_session.submit_order(self.ai_player, Order.SELL, Decimal('70.00'), 2000)
+        _, trades = self.game_session.submit_order(self.player, Order.BUY, Decimal('70.00'), 2000)
+        self.assertEqual(trades[0].feed_item()['seller'], 'AIPlayer1')
+        self.assertEqual(trades[0].feed_item()['buyer'], 'testuser')
+
+    def test_game_view_queries_do_not_grow_with_trades(self):
+        self.client.force_login(self.user)
+        self.trade(buyer=self.player, seller=self.ai_player)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('game'))
+
+        for _ in range(30):
+            self.trade(buyer=self.ai_player, seller=self.player)
+        with self.assertNumQueries(len(few)):
+            response = self.client.get(reverse('game'))
+        # Both trade logs of the page list every trade
+        self.assertContains(response, 'id="trade-row-', count=2 * 31)
+
+
+class TradeHistoryTestCase(TestCase):
+    def setUp(self):
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard")
+        self.game_session = GameSession.bootstrap(self.player)
+        self.trades = [
+            Trade.objects.create(game_session=self.game_session, buyer=self.player, seller=self.ai_player, price=Decimal('70.00') + i)
+            for i in range(7)
+        ]
+        self.url = reverse('trade_history', args=[self.game_session.id])
+        self.client.force_login(self.user)
+
+    def ids(self, response):
+        return [trade['trade_id'] for trade in response.json()['trades']]
+
+    def test_latest_page_then_older_pages(self):
+        response = self.client.get(self.url, {'limit': 3})
+        self.assertEqual(self.ids(response), [trade.id for trade in self.trades[4:]])
+        self.assertTrue(response.json()['has_more'])
+
+        response = self.client.get(self.url, {'limit': 3, 'before': response.json()['first_id']})
+        self.assertEqual(self.ids(response), [trade.id for trade in self.trades[1:4]])
+
+        response = self.client.get(self.url, {'limit': 3, 'before': response.json()['first_id']})
+        self.assertEqual(self.ids(response), [self.trades[0].id])
+        self.assertFalse(response.json()['has_more'])
+
+    def test_new_trades_after_id(self):
+        response = self.client.get(self.url, {'after': self.trades[4].id})
+        self.assertEqual(self.ids(response), [trade.id for trade in self.trades[5:]])
+        self.assertFalse(response.json()['has_more'])
+        self.assertEqual(response.json()['trades'][0]['buyer'], 'testuser')
+
+    def test_other_players_cannot_read(self):
+        other = User.objects.create_user(username='other', password='testpass')
+        Player.objects.create(user=other)
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_game_view_renders_latest_page(self):
+        with patch('trading.views.TRADE_PAGE_SIZE', 5):
+            response = self.client.get(reverse('game'))
+        self.assertEqual([trade.id for trade in response.context['trades']], [trade.id for trade in self.trades[2:]])
+        self.assertTrue(response.context['has_older_trades'])
+        self.assertNotContains(response, f'id="trade-row-{self.trades[0].id}"')
+
+
+class SessionStateTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard")
+        self.game_session = GameSession.bootstrap(self.player)
+        self.url = reverse('session_state', args=[self.game_session.id])
+        self.headers = {'X-State-Token': state.make_token(self.game_session.id, self.player.id)}
+
+    def poll(self, version=None):
+        headers = dict(self.headers)
+        if version is not None:
+            headers['If-None-Match'] = f'"{version}"'
+        return self.client.get(self.url, headers=headers)
+
+    def test_snapshot_then_changes_then_not_modified(self):
+        response = self.poll()
+        snapshot = response.json()
+        self.assertEqual(snapshot['state']['quotes'][0]['name'], 'AIPlayer1')
+        self.assertIsNone(snapshot['state']['last_message'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            release = self.game_session.release_next_message(self.player)
+
+        response = self.poll(snapshot['version'])
+        self.assertEqual(response.status_code, 200)
+        changes = response.json()['changes']
+        self.assertEqual(changes[0]['type'], 'message_released')
+        self.assertEqual(changes[0]['data']['message_content'], release.entry.message.content)
+        self.assertEqual(response['ETag'], f'"{response.json()["version"]}"')
+
+        # Nothing changed since: a 304 from one cache read, without touching the database
+        version = response.json()['version']
+        with self.assertNumQueries(0):
+            response = self.poll(version)
+        self.assertEqual(response.status_code, 304)
+
+    def test_expired_changes_fall_back_to_snapshot(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.game_session.release_next_message(self.player)
+        version = state.current_version(self.game_session.id)
+        cache.delete(state.CHANGE_KEY.format(session_id=self.game_session.id, version=version))
+
+        response = self.client.get(self.url, {'since': version - 1}, headers=self.headers)
+        self.assertIn('state', response.json())
+        self.assertEqual(response.json()['state']['clock']['messages_released'], 1)
+        self.assertIsNotNone(response.json()['state']['clock']['next_release'])
+
+    def test_token_is_bound_to_session(self):
+        other = GameSession.bootstrap(Player.objects.create(user=User.objects.create(username='other')))
+        response = self.client.get(reverse('session_state', args=[other.id]), headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+        # Without a token the login is checked instead
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+class QuoteConcurrencyTestCase(TestCase):
+    def setUp(self):
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard", bid=Decimal('68.00'), offer=Decimal('72.00'))
+        self.game_session = GameSession.bootstrap(self.player)
+
+    def test_quote_can_only_be_taken_once_per_version(self):
+        trade = self.ai_player.trade_at_quote(self.player, 'buy', '72.00', self.game_session, quote_version=0)
+        self.assertEqual((trade.buyer_id, trade.price), (self.player.pk, Decimal('72.00')))
+
+        # A double-submitted click carries the version it was shown
+        with self.assertRaises(ValidationError):
+            self.ai_player.trade_at_quote(self.player, 'buy', '72.00', self.game_session, quote_version=0)
+
+        # A stale price is refused whatever the version
+        with self.assertRaises(ValidationError):
+            self.ai_player.trade_at_quote(self.player, 'sell', '69.00', self.game_session)
+
+        self.ai_player.trade_at_quote(self.player, 'sell', '68.00', self.game_session, quote_version=1)
+        self.assertEqual(Trade.objects.filter(game_session=self.game_session).count(), 2)
+        self.assertEqual(TraderLedger.reconcile(self.game_session), [])
+
+    def test_create_trade_conflict(self):
+        self.client.force_login(self.user)
+        data = {'ai_player_id': self.ai_player.pk, 'price': '72.00', 'action': 'buy', 'quote_version': 0}
+
+        self.assertEqual(self.client.post(reverse('create_trade'), data).status_code, 200)
+        response = self.client.post(reverse('create_trade'), data)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['quote']['quote_version'], 1)
+
+    def test_quote_update_only_writes_quotes(self):
+        self.client.force_login(self.user)
+        TraderLedger.objects.all().delete()
+        Player.objects.filter(pk=self.player.pk).update(position=4000)
+
+        response = self.client.post(reverse('update_bid_offer'), {'bid': 69, 'offer': 71})
+        self.assertEqual(response.status_code, 200)
+
+        player = Player.objects.get(pk=self.player.pk)
+        self.assertEqual((player.bid, player.offer, player.quote_version), (Decimal('69.00'), Decimal('71.00'), 1))
+        self.assertEqual(player.position, 4000)
+
+    def test_release_moves_ai_quote_versions(self):
+        self.game_session.release_next_message(self.player)
+        self.assertEqual(self.ai_player.quote_version_in(GameSession.objects.get(pk=self.game_session.pk)), 1)
+
+    def test_release_payload_carries_quote_version(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/get_next_message/', {'game_session_id': self.game_session.pk}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['ai_quote_version'], 1)
+
+    def test_quote_versions_are_kept_per_session(self):
+        other_player = Player.objects.create(user=User.objects.create_user(username='other', password='testpass'))
+        other_session = GameSession.bootstrap(other_player)
+
+        # Releases and trades in one session leave the versions the other session's clients hold alone
+        self.game_session.release_next_message(self.player)
+        self.ai_player.refresh_from_db()
+        self.ai_player.trade_at_quote(self.player, 'buy', self.ai_player.offer, self.game_session, quote_version=1)
+        self.assertEqual(self.ai_player.quote_version_in(GameSession.objects.get(pk=self.game_session.pk)), 2)
+
+        trade = self.ai_player.trade_at_quote(other_player, 'sell', self.ai_player.bid, other_session, quote_version=0)
+        self.assertEqual(trade.game_session_id, other_session.pk)
+        self.assertEqual(self.ai_player.quote_version_in(GameSession.objects.get(pk=other_session.pk)), 1)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentTradeStressTestCase(TransactionTestCase):
+    """
+    Fires trades at one session from several threads at once. Needs a database with row
+    locks, so it is skipped on SQLite.
+    """
+    THREADS = 8
+    TRADES_PER_THREAD = 5
+
+    def setUp(self):
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+        self.player = Player.objects.create(user=User.objects.create(username='player1'), bid=Decimal('60.00'), offer=Decimal('80.00'))
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard", bid=Decimal('68.00'), offer=Decimal('72.00'))
+        self.game_session = GameSession.bootstrap(self.player)
+
+    def run_threads(self, target):
+        barrier = threading.Barrier(self.THREADS)
+        errors = []
+
+        def worker(index):
+            try:
+                barrier.wait()
+                target(index)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_concurrent_trades_keep_ledgers_consistent(self):
+        def trade(index):
+            for _ in range(self.TRADES_PER_THREAD):
+                self.ai_player.trade_at_quote(self.player, 'buy' if index % 2 else 'sell', '72.00' if index % 2 else '68.00', self.game_session)
+
+        self.assertEqual(self.run_threads(trade), [])
+
+        trades = Trade.objects.filter(game_session=self.game_session)
+        self.assertEqual(trades.count(), self.THREADS * self.TRADES_PER_THREAD)
+        self.assertEqual(self.ai_player.quote_version_in(GameSession.objects.get(pk=self.game_session.pk)), self.THREADS * self.TRADES_PER_THREAD)
+
+        # Every fill has two sides: positions and cash flows net out, and the ledgers match the trades
+        totals = TraderLedger.objects.filter(game_session=self.game_session).aggregate(position=Sum('position'), cash_flow=Sum('cash_flow'))
+        self.assertEqual(totals['position'], 0)
+        self.assertEqual(totals['cash_flow'], 0)
+        self.assertEqual(TraderLedger.reconcile(self.game_session), [])
+
+    def test_same_quote_version_is_taken_once(self):
+        def trade(index):
+            try:
+                self.ai_player.trade_at_quote(self.player, 'buy', '72.00', self.game_session, quote_version=0)
+            except ValidationError:
+                pass
+
+        self.assertEqual(self.run_threads(trade), [])
+        self.assertEqual(Trade.objects.filter(game_session=self.game_session).count(), 1)
+
+
+class IdempotencyKeyTestCase(TestCase):
+    def setUp(self):
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard", bid=Decimal('68.00'), offer=Decimal('72.00'))
+        self.game_session = GameSession.bootstrap(self.player)
+        self.client.force_login(self.user)
+
+    def trade(self, key, quote_version=0):
+        data = {'ai_player_id': self.ai_player.pk, 'price': '72.00', 'action': 'buy', 'quote_version': quote_version}
+        return self.client.post(reverse('create_trade'), data, HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replay_returns_the_first_trade(self):
+        first = self.trade('trade-1')
+        self.assertEqual(first.status_code, 200)
+
+        # The replay is answered from the key without touching the trades or ledgers: besides
+        # the session, user and player lookups of every request, it is one indexed read
+        with self.assertNumQueries(4):
+            replay = self.trade('trade-1')
+        self.assertEqual(replay.status_code, 200)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(replay.json(), first.json())
+        self.assertEqual(Trade.objects.filter(game_session=self.game_session).count(), 1)
+
+        # A new key is a new request, which the moved quote then refuses
+        self.assertEqual(self.trade('trade-2').status_code, 409)
+        self.assertEqual(self.trade('trade-3', quote_version=1).status_code, 200)
+        self.assertEqual(Trade.objects.filter(game_session=self.game_session).count(), 2)
+
+    def test_failures_are_not_stored(self):
+        self.assertEqual(self.trade('trade-1', quote_version=5).status_code, 409)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.trade('trade-1').status_code, 200)
+
+    def test_concurrent_duplicate_is_rolled_back(self):
+        # Another request recorded the key between this one's lookup and its own record
+        first = self.trade('trade-1')
+        with patch.object(IdempotencyKey, 'lookup', side_effect=[None, IdempotencyKey.lookup(self.player, 'create_trade', 'trade-1')]):
+            replay = self.trade('trade-1', quote_version=1)
+
+        self.assertEqual(replay.json(), first.json())
+        self.assertEqual(Trade.objects.filter(game_session=self.game_session).count(), 1)
+        self.assertEqual(TraderLedger.reconcile(self.game_session), [])
+
+    def test_submit_order_replay(self):
+        data = {'side': 'buy', 'price': '60.00', 'quantity': 100}
+        first = self.client.post(reverse('submit_order'), data, HTTP_IDEMPOTENCY_KEY='order-1')
+        replay = self.client.post(reverse('submit_order'), data, HTTP_IDEMPOTENCY_KEY='order-1')
+
+        self.assertEqual(replay.json(), first.json())
+        self.assertEqual(Order.objects.filter(game_session=self.game_session).count(), 1)
+
+    def test_purge_expired(self):
+        now = timezone.now()
+        for i in range(5):
+            IdempotencyKey.objects.create(player=self.player, endpoint='create_trade', key=f'old-{i}', response={}, expires_at=now - timezone.timedelta(minutes=1))
+        IdempotencyKey.objects.create(player=self.player, endpoint='create_trade', key='new', response={}, expires_at=now + timezone.timedelta(minutes=1))
+
+        self.assertEqual(IdempotencyKey.purge_expired(chunk_size=2, now=now), 5)
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
+
+
+class SingleFlightReleaseTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+        self.player = Player.objects.create(user=User.objects.create(username='player1'))
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard")
+        self.game_session = GameSession.bootstrap(self.player)
+
+    def test_concurrent_callers_get_the_winning_release(self):
+        # Two callers that loaded the session at the same point
+        first = GameSession.objects.get(pk=self.game_session.pk)
+        second = GameSession.objects.get(pk=self.game_session.pk)
+
+        won = first.release_next_message()
+        lost = second.release_next_message()
+
+        self.assertFalse(won.contended)
+        self.assertTrue(lost.contended)
+        self.assertEqual(lost.entry.pk, won.entry.pk)
+        self.assertEqual(lost.ai_player.pk, self.ai_player.pk)
+        self.assertEqual(self.game_session.deck.filter(release_timestamp__isnull=False).count(), 1)
+        self.assertEqual((first.messages_released, second.messages_released), (1, 1))
+
+        # The loser has caught up, so its next call releases the next message
+        self.assertFalse(second.release_next_message().contended)
+        self.assertEqual(GameSession.objects.get(pk=self.game_session.pk).messages_released, 2)
+
+        self.assertEqual(GameSession.release_metrics(), {'releases': 2, 'contended_releases': 1, 'contention_rate': 1 / 3})
+
+    def test_exhausted_deck_leaves_counter(self):
+        self.game_session.deck.update(release_timestamp=timezone.now())
+
+        self.assertIsNone(self.game_session.release_next_message())
+        self.assertEqual(self.game_session.messages_released, 0)
+        self.assertEqual(GameSession.objects.get(pk=self.game_session.pk).messages_released, 0)
+        self.assertEqual(GameSession.release_metrics()['releases'], 0)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentReleaseStressTestCase(TransactionTestCase):
+    THREADS = 8
+
+    def setUp(self):
+        cache.clear()
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+        self.player = Player.objects.create(user=User.objects.create(username='player1'))
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard")
+        self.game_session = GameSession.bootstrap(self.player)
+
+    def test_one_release_per_message(self):
+        barrier = threading.Barrier(self.THREADS)
+        releases = []
+
+        def worker():
+            try:
+                game_session = GameSession.objects.get(pk=self.game_session.pk)
+                barrier.wait()
+                releases.append(game_session.release_next_message())
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(releases), self.THREADS)
+        self.assertEqual(sum(not release.contended for release in releases), 1)
+        self.assertEqual({release.entry.pk for release in releases}, {releases[0].entry.pk})
+        self.assertEqual(self.game_session.deck.filter(release_timestamp__isnull=False).count(), 1)
+        self.assertEqual(GameSession.release_metrics()['contended_releases'], self.THREADS - 1)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class CrossSessionStressTestCase(TransactionTestCase):
+    """
+    Releases messages and trades on the shared AI players in two sessions at once. A lock taken
+    out of order would deadlock, which the database reports as an error in one of the threads.
+    """
+    TRADES_PER_THREAD = 10
+
+    def setUp(self):
+        cache.clear()
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish" if i % 2 else "bearish", impact_value=5.00)
+        self.ai_players = [
+            AIPlayer.objects.create(name=f"AIPlayer{i}", style="standard", bid=Decimal('68.00'), offer=Decimal('72.00'))
+            for i in range(2)
+        ]
+        self.players = [Player.objects.create(user=User.objects.create(username=f'player{i}')) for i in range(2)]
+        self.game_sessions = [GameSession.bootstrap(player) for player in self.players]
+
+    def test_releases_and_trades_across_sessions(self):
+        def release(game_session, player):
+            for _ in range(GameSession.DECK_SIZE):
+                GameSession.objects.get(pk=game_session.pk).release_next_message(player)
+
+        def trade(game_session, player):
+            for i in range(self.TRADES_PER_THREAD):
+                ai_player = AIPlayer.objects.get(pk=self.ai_players[i % 2].pk)
+                action, price = ('buy', ai_player.offer) if i % 3 else ('sell', ai_player.bid)
+                try:
+                    ai_player.trade_at_quote(player, action, price, game_session)
+                except ValidationError:
+                    # Requoted by a release in between
+                    pass
+
+        targets = []
+        for game_session, player in zip(self.game_sessions, self.players):
+            targets += [(release, game_session, player), (trade, game_session, player), (trade, game_session, player)]
+
+        barrier = threading.Barrier(len(targets))
+        errors = []
+
+        def worker(target, game_session, player):
+            try:
+                barrier.wait()
+                target(game_session, player)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=args) for args in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for game_session in self.game_sessions:
+            self.assertEqual(game_session.deck.filter(release_timestamp__isnull=False).count(), GameSession.DECK_SIZE)
+            self.assertEqual(TraderLedger.reconcile(game_session), [])
+
+
+class ApiFastPathTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(8):
+            Message.objects.create(content=f"Sample Message {i}", impact_type="bullish", impact_value=5.00)
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.player = Player.objects.create(user=self.user)
+        self.ai_player = AIPlayer.objects.create(name="AIPlayer1", style="standard", bid=Decimal('68.00'), offer=Decimal('72.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.game_session = GameSession.bootstrap(self.player)
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {api.make_token(self.player)}'}
+
+    def test_token(self):
+        token = api.make_token(self.player)
+        self.assertEqual(api.check_token(token), (self.player.pk, 0))
+        self.assertIsNone(api.check_token(f'{self.player.pk + 1}.0:' + token.split(':', 1)[1]))
+        self.assertIsNone(api.check_token(''))
+
+    def test_logout_revokes_token(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/player_summary/', **self.auth).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('logout_view'))
+        self.assertEqual(self.client.get('/api/player_summary/', **self.auth).status_code, 401)
+
+        # A saved copy of the player loaded before the logout does not bring the token back
+        self.player.save()
+        self.assertEqual(self.client.get('/api/player_summary/', **self.auth).status_code, 401)
+
+        # The next login's game page hands out a token that works
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            GameSession.bootstrap(self.player)
+        token = self.client.get(reverse('game')).context['api_token']
+        self.assertEqual(self.client.get('/api/player_summary/', HTTP_AUTHORIZATION=f'Bearer {token}').status_code, 200)
+
+    def test_requires_token(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/player_summary/').status_code, 401)
+        self.assertEqual(self.client.get('/api/player_summary/', HTTP_AUTHORIZATION='Bearer nonsense').status_code, 401)
+        self.assertEqual(self.client.get('/api/nothing_here/', **self.auth).status_code, 404)
+
+    def test_skips_page_middleware(self):
+        api.player_context(self.player.pk)
+
+        # No session, user or player loads: the summary only reads the session and the ledger
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/player_summary/', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['position'], 0)
+        self.assertFalse(response.has_header('X-Frame-Options'))
+        self.assertFalse(response.cookies)
+
+    def test_update_bid_offer(self):
+        # No CSRF token is needed, since the request is authenticated by a header
+        client = Client(enforce_csrf_checks=True)
+        response = client.post('/api/update_bid_offer/', {'bid': 69, 'offer': 71}, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['player_name'], 'testuser')
+
+        player = Player.objects.get(pk=self.player.pk)
+        self.assertEqual((player.bid, player.offer, player.quote_version), (Decimal('69.00'), Decimal('71.00'), 1))
+
+    def test_next_message(self):
+        response = self.client.get('/api/next_message/', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['ai_name'], 'AIPlayer1')
+        self.assertEqual(self.game_session.deck.filter(release_timestamp__isnull=False).count(), 1)
+
+    def test_session_changes_reach_the_cache(self):
+        self.assertEqual(api.player_context(self.player.pk)['session_id'], self.game_session.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            new_session = GameSession.bootstrap(self.player)
+        self.assertEqual(api.player_context(self.player.pk)['session_id'], new_session.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            new_session.finish()
+        self.assertIsNone(api.player_context(self.player.pk)['session_id'])
+        self.assertEqual(self.client.get('/api/next_message/', **self.auth).status_code, 404)
+
+    def test_game_page_hands_out_token(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('game'))
+        self.assertEqual(api.check_token(response.context['api_token']), (self.player.pk, 0))
+        self.assertContains(response, '/api/next_message/')
+
+
+class CollectingHandler(logging.Handler):
+    """
+    Keeps the records it is given, with the thread that handled them.
+    """
+    def __init__(self, gate=None):
+        super().__init__()
+        self.records = []
+        self.threads = []
+        self.gate = gate
+
+    def emit(self, record):
+        if self.gate is not None:
+            self.gate.wait()
+        self.records.append(record)
+        self.threads.append(threading.current_thread())
+
+
+class LoggingPipelineTestCase(TestCase):
+    def logger(self, handler):
+        logger = logging.getLogger(f'trading.tests.pipeline.{id(handler)}')
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        return logger
+
+    def test_records_are_written_by_the_logging_thread(self):
+        target = CollectingHandler()
+        handler = log.QueueHandler([target])
+        logger = self.logger(handler)
+
+        quotes = {'bid': 68}
+        logger.info("Quotes: %s", quotes)
+        quotes['bid'] = 70  # changed after logging, which the record must not see
+        handler.stop()
+
+        self.assertEqual([record.getMessage() for record in target.records], ["Quotes: {'bid': 68}"])
+        self.assertIsNot(target.threads[0], threading.current_thread())
+
+    def test_full_queue_drops_without_blocking(self):
+        gate = threading.Event()
+        target = CollectingHandler(gate)
+        handler = log.QueueHandler([target], maxsize=2)
+        logger = self.logger(handler)
+
+        logger.info("first")  # taken by the logging thread, which waits on the gate
+        while handler.queue.qsize():
+            pass
+        for i in range(5):
+            logger.info("burst %s", i)
+        self.assertEqual(handler.dropped, 3)
+
+        gate.set()
+        while handler.queue.qsize():
+            pass
+        logger.info("after")
+        handler.stop()
+
+        messages = [record.getMessage() for record in target.records]
+        self.assertEqual(messages, ["first", "burst 0", "burst 1", "Dropped 3 log records, the logging queue was full.", "after"])
+
+    def test_sampling(self):
+        now = [0.0]
+        sample = log.SampleFilter(rate=2, period=1.0, level='WARNING', clock=lambda: now[0])
+
+        def record(msg, level=logging.DEBUG):
+            return logging.LogRecord('trading.views', level, __file__, 0, msg, (1,), None)
+
+        self.assertEqual([sample.filter(record("Hot %s")) for _ in range(5)], [True, True, False, False, False])
+        self.assertTrue(sample.filter(record("Other %s")))
+        self.assertTrue(sample.filter(record("Hot %s", logging.WARNING)))
+
+        now[0] = 1.0
+        passed = record("Hot %s")
+        self.assertTrue(sample.filter(passed))
+        self.assertEqual(passed.suppressed, 3)
+
+    def test_json_formatter(self):
+        try:
+            raise ValueError("bad quote")
+        except ValueError:
+            record = logging.LogRecord('trading.views', logging.ERROR, __file__, 0, "Trade %s failed", (7,), sys.exc_info())
+        record.game_session_id = 3
+
+        data = json.loads(log.JsonFormatter().format(record))
+        self.assertEqual((data['level'], data['logger'], data['message']), ('ERROR', 'trading.views', 'Trade 7 failed'))
+        self.assertEqual(data['game_session_id'], 3)
+        self.assertIn('ValueError: bad quote', data['exception'])
@@ -26,8 +26,15 @@ urlpatterns = [
     path("register", views.register, name="register"),
     path("update_bid_offer/", views.update_bid_offer, name="update_bid_offer"),
     path('create_trade/', views.create_trade, name='create_trade'),
+    path('submit_order/', views.submit_order, name='submit_order'),
+    path('cancel_order/', views.cancel_order, name='cancel_order'),
+    path('order_book/<int:game_session_id>/', views.order_book, name='order_book'),
+    path('trade_history/<int:game_session_id>/', views.trade_history, name='trade_history'),
+    path('state/<int:game_session_id>/', views.session_state, name='session_state'),
     path('player_summary/', views.player_summary, name='player_summary'),
     path('get_next_message/', views.get_next_message, name='get_next_message'),
+    path('events/<int:game_session_id>/', views.session_events, name='session_events'),
+    path('events/<int:game_session_id>/poll/', views.poll_events, name='poll_events'),
     path('admin/', admin.site.urls),
     
 
@@ -2,7 +2,7 @@ import json
 from django.contrib.auth import authenticate
 from django.shortcuts import render, redirect, HttpResponse, HttpResponseRedirect
 from django.contrib import messages
-from .models import Player, Trader, User, AIPlayer, Trade, GameSession, Message
+from .models import Player, Trader, User, AIPlayer, Trade, GameSession, Message, TraderLedger, Order, IdempotencyKey
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.contrib.auth import logout
@@ -11,16 +11,71 @@ from django.urls import reverse
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_GET
-from django.db import IntegrityError
-from .forms import BidOfferForm
+from django.db import IntegrityError, transaction
+from .forms import BidOfferForm, OrderForm
+from django.core.exceptions import ValidationError
 from django.utils import timezone
+from django.conf import settings
 import sys
 import random
 from django.views.debug import technical_500_response
 from decimal import Decimal
 import logging
+import asyncio
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from . import events
+from . import state
+from . import api
+from django.http import HttpResponseNotModified
+from functools import wraps
 logger = logging.getLogger(__name__)
 
+# Trades per page of the trade logs, and the most a client may ask for
+TRADE_PAGE_SIZE = 50
+MAX_TRADE_PAGE_SIZE = 200
+
+
+
+def idempotent(endpoint):
+    """
+    Let clients of a POST view send an Idempotency-Key header (or an idempotency_key field). The
+    first successful response for a key is stored in the same transaction as whatever the view
+    wrote, and a request repeating the key gets that response back, flagged with an
+    Idempotent-Replayed header, instead of running the view again.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request.headers.get('Idempotency-Key') or request.POST.get('idempotency_key')
+            if not key or not request.user.is_authenticated or not hasattr(request.user, 'player'):
+                return view(request, *args, **kwargs)
+            if len(key) > IdempotencyKey.MAX_LENGTH:
+                return JsonResponse({"status": "error", "message": "Idempotency key too long."}, status=400)
+
+            player = request.user.player
+            stored = IdempotencyKey.lookup(player, endpoint, key)
+            if stored is None:
+                try:
+                    with transaction.atomic():
+                        response = view(request, *args, **kwargs)
+                        # Only successes are kept, so a request that failed can be retried with its key
+                        if response.status_code == 200:
+                            IdempotencyKey.record(player, endpoint, key, response.status_code, json.loads(response.content))
+                        return response
+                except IntegrityError:
+                    # The same key was recorded by a concurrent request, and what this one did is rolled back
+                    stored = IdempotencyKey.lookup(player, endpoint, key)
+                    if stored is None:
+                        raise
+
+            response = JsonResponse(stored.response, status=stored.status_code)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+        return wrapper
+    return decorator
+
 
 
 def index(request):
@@ -33,29 +88,9 @@ def index(request):
         return HttpResponseRedirect(reverse("register"))
 
 def start_game_session(player):
-    # Create a new game session, for now always set the initial price to 70
-    game_session = GameSession.objects.create(initial_price=Decimal('70.00'))
-
-    # Add the AI player to the game session
-    game_session.ai_players.add(*AIPlayer.objects.all())
-
-    # Add the player to the game session via the utility method to ensure player can only be in one active game at a time
-    GameSession.add_player_to_game_session(player, game_session)
-
-    #game_session.save()
-
-    # Add the game session to the player
-    player.games.add(game_session)
-    player.save()
-
-    # Refresh the player and game session instances
-    player.refresh_from_db()
-    game_session.refresh_from_db()
-
-    # Debug print statements
-    print(f'game_session.id: {game_session.id}')
-    print(f'game_session.players.count: {game_session.players.count()}')
-    print(f'player.games.count: {player.games.count()}')
+    # Create a new game session, for now always set the initial price to 70. The player leaves
+    # any other active session, so a player is only ever in one active game at a time.
+    game_session = GameSession.bootstrap(player, initial_price=Decimal('70.00'))
 
     return {
         'game_session': game_session,
@@ -88,10 +123,9 @@ def register(request):
             user.set_password(password)
             user.save()
             player, player_created = Player.objects.get_or_create(user=user)
-            print(f'Player created: {player_created}')
-            print(f'Player: {player}') 
+            logger.debug("Registered %s (player created: %s).", username, player_created)
         except IntegrityError as e:
-            print(e)
+            logger.info("Registration of %s failed: %s", username, e)
             return render(request, "register.html", {
                 "message": "Email address already taken."
             })
@@ -132,26 +166,34 @@ def login_view(request):
 @login_required
 def game(request):
     username = request.user.username
-    position = request.user.player.position
-    pnl = request.user.player.cash_flow
     form = BidOfferForm()
 
-    # Get all AI Players
-    ai_players = AIPlayer.objects.all()
-
     # Retrieve the Player instance associated with the logged-in user
     player_instance = request.user.player
 
     # Get the active game session for the user
-    game_session = GameSession.objects.filter(players=player_instance, active=True).first()
+    game_session = player_instance.current_session
 
     # If there's no active session for the user, you might want to handle this case. 
     # For instance, you could redirect them to another page or show a message.
     if not game_session:
         return render(request, "error.html", {"message": "No active game session found."})
 
-    # Get trades for the active game session
-    trades = Trade.objects.filter(game_session=game_session)
+    # Get all AI Players, with the versions of their quotes in this session
+    ai_players = list(AIPlayer.objects.all())
+    for ai_player in ai_players:
+        ai_player.session_quote_version = ai_player.quote_version_in(game_session)
+
+    # The version is read before the page is built, so polls from it cannot miss a change
+    state_version = state.current_version(game_session.id)
+
+    # Only the latest trades are rendered; older ones are fetched from trade_history on demand
+    trades, has_older_trades = Trade.history(game_session.id, limit=TRADE_PAGE_SIZE)
+
+    # Position and marked-to-market PnL in this session
+    ledger = TraderLedger.for_trader(player_instance, game_session)
+    position = ledger.position
+    pnl = ledger.total_pnl
 
     return render(request, "game.html", {
         'username': username,
@@ -160,42 +202,67 @@ def game(request):
         'form':form,
         'ai_players':ai_players,
         'trades': trades,
+        'has_older_trades': has_older_trades,
+        'state_version': state_version,
+        'state_token': state.make_token(game_session.id, player_instance.id),
+        # The polling endpoints are called on the API fast path, with this token
+        'api_token': api.make_token(player_instance),
+        'api_urls': {name: reverse(name, urlconf=settings.API_URLCONF) for name in ('api_next_message', 'api_player_summary', 'api_update_bid_offer')},
         'game_session_id': game_session.id,
-        'initial_price': game_session.initial_price
+        'initial_price': game_session.initial_price,
+        'game_clock_enabled': settings.GAME_CLOCK_ENABLED
         })
 
 @require_POST
 def update_bid_offer(request):
-    form = BidOfferForm(request.POST)
+    player = request.user.player
+    return update_quotes(request, player.pk, player.current_session)
+
+
+@require_POST
+def api_update_bid_offer(request):
+    # The market is read through the session's cached top of book, so the row is not loaded
+    game_session = GameSession(pk=request.game_session_id) if request.game_session_id else None
+    return update_quotes(request, request.player_id, game_session)
+
+
+def update_quotes(request, player_id, game_session):
+    form = BidOfferForm(request.POST, game_session=game_session)
     if form.is_valid():
         bid = form.cleaned_data.get("bid")
         offer = form.cleaned_data.get("offer")
-        player = request.user.player
-        if bid is not None:
-            player.bid = bid
-        if offer is not None:
-            player.offer = offer
-        player.save()
-        return JsonResponse({"status": "success", "bid":bid, "offer":offer,"player_name":request.user.username}, status=200)
+
+        # Only the quotes are written, on the locked row, so a concurrent update of the player is not lost
+        with transaction.atomic():
+            player = Player.objects.select_for_update(of=('self',)).select_related('user').get(pk=player_id)
+            if bid is not None:
+                player.bid = bid
+            if offer is not None:
+                player.offer = offer
+            player.quote_version += 1
+            player.save(update_fields=['bid', 'offer', 'quote_version'])
+
+        # Let the other clients of the player's session see the new quote
+        if game_session:
+            events.publish(game_session.id, 'quote_changed', player.quote_data())
+
+        return JsonResponse({"status": "success", "bid":bid, "offer":offer,"player_name":player.name}, status=200)
     else:
         # Collect form error messages
         error_messages = form.non_field_errors()
-        print("Form Errors:", error_messages)  # This line will print the error messages to the console.
+        logger.debug("Quotes of player %s rejected: %s", player_id, error_messages)
         return JsonResponse({"status": "error", "errors": list(error_messages)}, status=400)
 
 
 @require_POST
+@idempotent('create_trade')
 def create_trade(request):
-    print(request.POST)
     try:
         ai_player_id = request.POST.get("ai_player_id")
         price = request.POST.get("price")
         action = request.POST.get("action")
 
-        # Debug: print the price value
-        print(price)
-
-        print(f'ai_player_id={ai_player_id}, price={price}, action={action}')  # Print the incoming parameters
+        logger.debug("Trade request: ai_player_id=%s, price=%s, action=%s", ai_player_id, price, action)
 
         # Check if price is None
         if price is None:
@@ -209,31 +276,27 @@ def create_trade(request):
         ai_player = AIPlayer.objects.get(pk=ai_player_id)
         player = request.user.player
 
-        if action == "sell":
-            buyer = ai_player
-            seller = player
-        else:  # action == "buy"
-            buyer = player
-            seller = ai_player
-
-        # Get the latest game session for the player
-        try:
-            print(f'player.games.count={player.games.count()}')
-            game_session = player.games.latest('id')
-            print(f'game_session_exists={game_session is not None}')  # Print True if game_session exists, False otherwise
-        except Exception as e:
-            print(e) # print the exception for debugging
+        # Get the game session the player is playing
+        game_session = player.current_session
+        if game_session is None:
             return JsonResponse({"status": "error", "message": "No game session found for player."}, status=400)
 
-        trade = Trade(buyer=buyer, seller=seller, price=price, game_session=game_session)
-        trade.save()
+        # The trade only goes through at the AI's current quote, and only once per quote_version seen
+        quote_version = request.POST.get("quote_version", "")
+        try:
+            trade = ai_player.trade_at_quote(player, action, price, game_session, int(quote_version) if quote_version.isdigit() else None)
+        except ValidationError as e:
+            # Send the current quote back, so the client can show it and try again
+            ai_player.refresh_from_db(fields=['bid', 'offer'])
+            game_session.refresh_from_db(fields=['ai_quote_versions'])
+            return JsonResponse({"status": "error", "message": e.messages[0], "quote": ai_player.quote_data(game_session)}, status=409)
 
         return JsonResponse({
             "status": "success",
             "trade": {
                 'id': trade.id,
-                'buyer': {'name': trade.buyer.name},
-                'seller': {'name': trade.seller.name},
+                'buyer': {'name': trade.buyer_name},
+                'seller': {'name': trade.seller_name},
                 'price': str(trade.price),
                 'quantity': trade.quantity
             }}, status=200)
@@ -243,37 +306,147 @@ def create_trade(request):
 
 
 
-def get_game_state():
-    # Get all Users and AIPlayers
-    users = User.objects.all()
-    ai_players = AIPlayer.objects.all()
+@require_POST
+@idempotent('submit_order')
+def submit_order(request):
+    if not request.user.is_authenticated or not hasattr(request.user, 'player'):
+        return JsonResponse({"status": "error", "message": "Not logged in."}, status=403)
 
-    # Initialize lists to hold all bids and offers
-    bids = []
-    offers = []
+    form = OrderForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse({"status": "error", "errors": form.errors}, status=400)
 
-    # Iterate over Users, appending their bids and offers to the appropriate lists
-    for user in users:
-        if hasattr(user, 'player'):  # Ensure the user has a related 'player' object
-            bids.append({'player': user.player, 'bid': user.player.bid})
-            offers.append({'player': user.player, 'offer': user.player.offer})
+    player = request.user.player
+    game_session = player.current_session
+    if not game_session:
+        return JsonResponse({"status": "error", "message": "No active game session found for player."}, status=400)
 
-    # Iterate over AIPlayers, appending their bids and offers to the appropriate lists
-    for ai_player in ai_players:
-        bids.append({'player': ai_player, 'bid': ai_player.bid})
-        offers.append({'player': ai_player, 'offer': ai_player.offer})
+    try:
+        order, trades = game_session.submit_order(player, form.cleaned_data['side'], form.cleaned_data['price'], form.cleaned_data['quantity'])
+    except ValidationError as e:
+        return JsonResponse({"status": "error", "message": e.messages[0]}, status=400)
+
+    return JsonResponse({
+        "status": "success",
+        "order": order.order_data(),
+        "trades": [trade.feed_item() for trade in trades],
+    }, status=200)
+
+
+@require_POST
+def cancel_order(request):
+    if not request.user.is_authenticated or not hasattr(request.user, 'player'):
+        return JsonResponse({"status": "error", "message": "Not logged in."}, status=403)
+
+    # Players can only cancel their own orders
+    order = Order.objects.filter(pk=request.POST.get("order_id"), trader=request.user.player).select_related('game_session').first()
+    if order is None:
+        return JsonResponse({"status": "error", "message": "Order not found."}, status=404)
+
+    if not order.game_session.cancel_order(order):
+        return JsonResponse({"status": "error", "message": "Order is no longer open."}, status=400)
+
+    return JsonResponse({"status": "success", "order": order.order_data()}, status=200)
+
+
+@require_GET
+def trade_history(request, game_session_id):
+    """
+    Return a page of the session's trades, oldest first. `after=<id>` returns the trades made
+    since that one, `before=<id>` the ones before it, and neither the latest page. `has_more`
+    tells whether there are more trades past the page in the same direction.
+    """
+    if not player_in_game_session(request.user, game_session_id):
+        return JsonResponse({'error': 'Game session not found.'}, status=404)
+
+    after = request.GET.get('after', '')
+    before = request.GET.get('before', '')
+    limit = request.GET.get('limit', '')
+    limit = min(int(limit), MAX_TRADE_PAGE_SIZE) if limit.isdigit() and int(limit) > 0 else TRADE_PAGE_SIZE
+
+    trades, has_more = Trade.history(
+        game_session_id,
+        after=int(after) if after.isdigit() else None,
+        before=int(before) if before.isdigit() else None,
+        limit=limit,
+    )
+
+    return JsonResponse({
+        'trades': [trade.feed_item() for trade in trades],
+        'has_more': has_more,
+        'first_id': trades[0].id if trades else None,
+        'last_id': trades[-1].id if trades else None,
+    })
+
+
+@require_GET
+def session_state(request, game_session_id):
+    """
+    Return what changed in the session since the client's version, given as If-None-Match or
+    `since`: 304 if nothing did, the list of changes if they are still cached, otherwise a full
+    snapshot. The client proves it belongs to the session with the token of its game page
+    (X-State-Token or `token`), or its login, so an idle poll reads the cache and nothing else.
+    """
+    token = request.headers.get('X-State-Token') or request.GET.get('token', '')
+    if not (state.check_token(token, game_session_id) if token else player_in_game_session(request.user, game_session_id)):
+        return JsonResponse({'error': 'Game session not found.'}, status=404)
+
+    since = request.headers.get('If-None-Match', '').removeprefix('W/').strip('"') or request.GET.get('since', '')
+    since = int(since) if since.isdigit() else None
+
+    # Read before the snapshot, so a change made while it is built is sent again rather than missed
+    version = state.current_version(game_session_id)
+    etag = f'"{version}"'
+
+    if since == version:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    changes = state.changes_since(game_session_id, since, version) if since is not None else None
+    if changes is not None:
+        response = JsonResponse({'version': version, 'changes': changes})
+    else:
+        game_session = GameSession.objects.filter(pk=game_session_id).first()
+        if game_session is None:
+            return JsonResponse({'error': 'Game session not found.'}, status=404)
+        response = JsonResponse({'version': version, 'state': state.snapshot(game_session, TRADE_PAGE_SIZE)})
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@require_GET
+def order_book(request, game_session_id):
+    """
+    Return the best price levels of a session's order book.
+    """
+    if not player_in_game_session(request.user, game_session_id):
+        return JsonResponse({'error': 'Game session not found.'}, status=404)
+
+    game_session = GameSession.objects.get(pk=game_session_id)
+    levels = request.GET.get('levels', '5')
+    levels = min(int(levels), 50) if levels.isdigit() else 5
+
+    return JsonResponse(game_session.depth_data(levels=levels))
 
-    # Return the bids and offers as a dictionary
-    return {'bids': bids, 'offers': offers}
 
 def player_summary(request):
-    
     player = request.user.player
-  
+    return summary_response(player.pk, player.current_session)
+
+
+@require_GET
+def api_player_summary(request):
+    game_session = GameSession.objects.filter(pk=request.game_session_id).first() if request.game_session_id else None
+    return summary_response(request.player_id, game_session)
+
+
+def summary_response(player_id, game_session):
+    # Get the session the player is playing, or the last one they played
+    latest_game_session = game_session or GameSession.objects.filter(games=player_id).order_by('-created_at').first()
 
-    # Get the latest game session for the player
-    latest_game_session = player.games.order_by('-created_at').first()
- 
 
     # If there's no game session for the player, return appropriate defaults
     if not latest_game_session:
@@ -281,15 +454,24 @@ def player_summary(request):
             'position': 0,
             'cash_flow': 0,
             'buy_trades_count': 0,
-            'sell_trades_count': 0
+            'sell_trades_count': 0,
+            'realized_pnl': 0,
+            'unrealized_pnl': 0,
+            'total_pnl': 0
         })
 
+    # The ledger row holds the running totals for this session, so no trades are scanned here
+    ledger = TraderLedger.for_trader(Player(pk=player_id), latest_game_session)
+
     summary_data = {
-        'position': player.calculate_position(latest_game_session),
-        'cash_flow': player.calculate_cash_flow(latest_game_session),
-        'buy_trades_count': player.buy_trades.filter(game_session=latest_game_session).count(),
-        'sell_trades_count': player.sell_trades.filter(game_session=latest_game_session).count(),
-        
+        'position': ledger.position,
+        'cash_flow': ledger.cash_flow,
+        'buy_trades_count': ledger.buy_trades_count,
+        'sell_trades_count': ledger.sell_trades_count,
+        'fair_value': latest_game_session.fair_value(),
+        'realized_pnl': ledger.realized_pnl,
+        'unrealized_pnl': ledger.unrealized_pnl,
+        'total_pnl': ledger.total_pnl,
     }
     return JsonResponse(summary_data)
 
@@ -301,20 +483,23 @@ def logout_view(request):
     player_instance = request.user.player
 
     # Get the active game session for the user 
-    game_session = GameSession.objects.filter(players=player_instance, active=True).first()
+    game_session = player_instance.current_session
 
     #Check if there is an active game session
     if game_session:
         # End active game session
         game_session.finish()
-    
+
+    # The game page's API token must not outlive the login
+    api.revoke_tokens(player_instance.pk)
+
     # Logout the user
     logout(request)
     return redirect('index')
 
 @require_GET
 def get_next_message(request):
-    logger.info("Starting get_next_message view.")
+    logger.debug("Starting get_next_message view.")
     # 1. Ensure the request is an AJAX request
     if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
         logger.warning("Not an AJAX request.")
@@ -327,101 +512,156 @@ def get_next_message(request):
         logger.warning("Game session ID not provided.")
         return JsonResponse({'error': 'Game session ID not provided.'}, status=400)
 
+    # Only the session the player is playing can be released through, so a guessed id is not found
+    player = getattr(request.user, 'player', None)
+    if player is None or str(player.current_session_id) != game_session_id:
+        logger.warning("Game session %s is not the player's current session.", game_session_id)
+        return JsonResponse({'error': 'Active game session not found.'}, status=404)
+
+    return next_message_response(game_session_id, player)
+
+
+@require_GET
+def api_next_message(request):
+    if not request.game_session_id:
+        return JsonResponse({'error': 'Active game session not found.'}, status=404)
+    return next_message_response(request.game_session_id, Player(pk=request.player_id))
+
+
+def next_message_response(game_session_id, player):
     try:
         game_session = GameSession.objects.get(id=game_session_id, active=True)
-        logger.info(f"Active game session retrieved: {game_session_id}")
+        logger.debug("Active game session retrieved: %s", game_session_id)
     except GameSession.DoesNotExist:
         logger.warning("Active game session not found.")
         return JsonResponse({'error': 'Active game session not found.'}, status=404)
     
 
+    # With the server-side game clock running, the clock releases the messages and this view only reads the outcome
+    if settings.GAME_CLOCK_ENABLED:
+        last_entry = game_session.last_released_entry()
+        if not last_entry:
+            return JsonResponse({'error': 'No message has been released yet.'}, status=400)
+        return JsonResponse(release_data(last_entry, game_session.ai_players.first(), game_session))
+
     # 3. Check if 20 seconds have passed since the last message
-    last_message = game_session.messages.last()
-    last_message_timestamp = last_message.release_timestamp if last_message else None
-    if last_message_timestamp and (timezone.now() - last_message_timestamp).total_seconds() < 20:
-        logger.warning("20 seconds have not passed yet.")
+    last_entry = game_session.last_released_entry()
+    last_message_timestamp = last_entry.release_timestamp if last_entry else None
+    if last_message_timestamp and (timezone.now() - last_message_timestamp).total_seconds() < GameSession.MESSAGE_INTERVAL:
+        # Early polls are expected, so they are not worth a warning
+        logger.debug("20 seconds have not passed yet.")
         return JsonResponse({'error': '20 seconds have not passed yet.'}, status=400)
 
-    # 4. Randomly select a new message for the game session
-    game_messages = set(game_session.messages.all())
-    unreleased_messages = [message for message in game_messages if message.release_timestamp is None]
+    # 4. Release the next message from the session's deck, and let the session's AI player
+    # compute its Expected Value, decide to trade based on the new EV and update its bid and offer.
+    # A request racing another one for the same message gets the release the other one made
+    release = game_session.release_next_message(player)
 
-    # Log all the unreleased messages
-    logger.info(f"Unreleased messages for game session {game_session_id}: {[message.content for message in unreleased_messages]}")
-
-    if not unreleased_messages:
+    if not release:
         logger.warning("All messages for this session have been used.")
         return JsonResponse({'error': 'All messages for this session have been used.'}, status=400)
 
+    if release.contended:
+        logger.info("Message already released by a concurrent request.")
 
-    next_message = random.choice(unreleased_messages)
-    logger.info(f"Selected message: {next_message.content}")
-    next_message.release_timestamp = timezone.now()
-    next_message.save()
-
-    # 5. Fetch the AIPlayer associated with a game session.
-    ai_player = game_session.ai_players.first()
+    logger.debug("Selected message: %s", release.entry.message.content)
 
     # If no AIPlayer is associated with the game session, handle appropriately
-    if not ai_player:
+    if not release.ai_player:
         logger.warning("No AI Player associated with this game session.")
         return JsonResponse({'error': 'No AI Player associated with this game session.'}, status=400)
-    
-    # 6. Compute the Expected Value for the AI Player with the new message
-    initial_price = game_session.initial_price
-    ai_player.compute_ev(initial_price, next_message)
 
-    # 7. Decide to trade based on the new EV 
-    player = request.user.player
-    trade_decision = ai_player.decide_to_trade(player)
-
-    trade_data = None
-    if isinstance(trade_decision, Trade):  # Checking if a trade occurred
-        logger.info(f"Trade occurred between {trade_decision.buyer.name} and {trade_decision.seller.name}")
-        trade_data = {
-            'buyer': trade_decision.buyer.name,
-            'seller': trade_decision.seller.name,
-            'price': str(trade_decision.price),
-            'trade_id': trade_decision.id
-        }
-    elif trade_decision == 'no_opportunity_to_trade':
-        logger.info("No opportunity for the AI Player to trade with the Player.")
-        # Handle or log this scenario if needed. For now, I'm just noting that no trade happened.
-        print("No opportunity for the AI Player to trade with the Player.")
-
-    # 8. Update its bid and offer based on the new message.   
-    bid, offer = ai_player.decide_bid_offer(initial_price, next_message)
-    ai_player.bid = bid 
-    ai_player.offer = offer
-    ai_player.save()
-
-    logger.info(f"AI Player's new bid: {bid}, offer: {offer}")
-
-    # 9. Return the message to the frontend
-    return JsonResponse({
-        'message_content': next_message.content, 
-        'impact_type': next_message.impact_type, 
-        'impact_value': str(next_message.impact_value),
-        'trade_data': trade_data,
-        'ai_name': ai_player.name,
-        'ai_bid': bid,  
-        'ai_offer': offer
-    
-    })
-    
+    if release.trade:
+        logger.info("Trade occurred between %s and %s", release.trade.buyer_name, release.trade.seller_name)
+    else:
+        logger.debug("No opportunity for the AI Player to trade with the Player.")
+
+    logger.debug("AI Player's new bid: %s, offer: %s", release.ai_player.bid, release.ai_player.offer)
 
+    # 5. Return the message to the frontend
+    return JsonResponse(release_data(release.entry, release.ai_player, game_session))
 
 
+def release_data(entry, ai_player, game_session):
+    """
+    Build the JSON payload describing a released deck entry and the AI's quotes after it, with
+    their version in the session, which the release moved on.
+    """
+    message = entry.message
+    trade_data = entry.trade.feed_item() if entry.trade else None
 
+    return {
+        'message_content': message.content, 
+        'impact_type': message.impact_type, 
+        'impact_value': str(message.impact_value),
+        'trade_data': trade_data,
+        'ai_name': ai_player.name if ai_player else None,
+        'ai_bid': ai_player.bid if ai_player else None,
+        'ai_offer': ai_player.offer if ai_player else None,
+        'ai_quote_version': ai_player.quote_version_in(game_session) if ai_player else None,
+    }
 
 
+def player_in_game_session(user, game_session_id):
+    return (
+        user.is_authenticated
+        and hasattr(user, 'player')
+        and GameSession.objects.filter(pk=game_session_id, players=user.player).exists()
+    )
 
 
+def format_event(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'], cls=DjangoJSONEncoder)}\n\n"
 
 
+async def session_events(request, game_session_id):
+    """
+    Stream a game session's events to the browser as Server-Sent Events. Needs the ASGI app;
+    clients that cannot keep the connection open use poll_events instead.
+    """
+    if not await sync_to_async(player_in_game_session)(request.user, game_session_id):
+        return JsonResponse({'error': 'Game session not found.'}, status=404)
 
+    # EventSource sends Last-Event-ID when it reconnects, so the missed events can be replayed
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('after')
+    after_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    subscription = events.hub.subscribe(game_session_id, after_id)
 
+    async def stream():
+        try:
+            for event in subscription.backlog:
+                yield format_event(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Comment line to keep proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_event(event)
+        finally:
+            events.hub.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
+@require_GET
+def poll_events(request, game_session_id):
+    """
+    Return the session's events after the `after` event id, for clients without EventSource.
+    """
+    if not player_in_game_session(request.user, game_session_id):
+        return JsonResponse({'error': 'Game session not found.'}, status=404)
+
+    after = request.GET.get('after', '0')
+    after_id = int(after) if after.isdigit() else 0
+    session_events = events.hub.events_since(game_session_id, after_id)
+
+    return JsonResponse({
+        'events': session_events,
+        'last_event_id': session_events[-1]['id'] if session_events else after_id,
+    })
 
-    
\ No newline at end of file